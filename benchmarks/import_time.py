@@ -0,0 +1,71 @@
+"""
+Import-time benchmark for revenium_middleware_ollama.
+
+Runs each import in a fresh interpreter several times and reports the median
+wall time, so results aren't skewed by modules already being loaded:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --runs 20 --budget-ms 150
+
+With ``--budget-ms``, the script exits with status 1 when importing the
+package (without ``ollama``) takes longer than the budget.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+TIMER = (
+    "import time; started = time.perf_counter(); {statement}; "
+    "print((time.perf_counter() - started) * 1000)"
+)
+
+CASES = (
+    ("revenium_middleware_ollama", "import revenium_middleware_ollama"),
+    ("ollama", "import ollama"),
+    ("ollama + revenium_middleware_ollama", "import ollama, revenium_middleware_ollama"),
+)
+
+
+def measure(statement: str, runs: int) -> float:
+    """
+    Measure the median time of a statement in fresh interpreters.
+
+    Args:
+        statement: Python statement to time
+        runs: Number of interpreters to start
+
+    Returns:
+        Median time in milliseconds
+    """
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", TIMER.format(statement=statement)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10, help="interpreters per case")
+    parser.add_argument("--budget-ms", type=float, help="fail if the package import exceeds this")
+    options = parser.parse_args()
+
+    results = {}
+    for name, statement in CASES:
+        results[name] = measure(statement, options.runs)
+        print(f"{name:40} {results[name]:8.1f} ms")
+
+    package_ms = results["revenium_middleware_ollama"]
+    if options.budget_ms is not None and package_ms > options.budget_ms:
+        print(f"Import budget exceeded: {package_ms:.1f} ms > {options.budget_ms:.1f} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
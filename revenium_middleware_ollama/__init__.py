@@ -4,4 +4,31 @@ ollama.chat using wrapt, and log token usage after
 each request. You can customize or extend this logging logic later
 to add user or organization metadata for metering purposes.
 """
-from .middleware import chat_wrapper,generate_wrapper
\ No newline at end of file
+from .middleware import chat_wrapper,generate_wrapper,embed_wrapper
+from .instrumentation import (
+    instrument,
+    uninstrument,
+    instrument_client,
+    uninstrument_client,
+    suppress_metering,
+    install_import_hook,
+)
+from .metrics import enable_metrics, disable_metrics, render_metrics, start_metrics_server
+from .cache import enable_response_cache, disable_response_cache
+from .coalesce import enable_request_coalescing, disable_request_coalescing
+from .embed_batcher import enable_embed_batching, disable_embed_batching
+from .routing import enable_host_routing, disable_host_routing
+from .concurrency import enable_concurrency_limit, disable_concurrency_limit, ConcurrencyLimitTimeout
+from .ratelimit import enable_rate_limit, disable_rate_limit, RateLimitExceeded
+from .keep_alive import enable_keep_alive_management, disable_keep_alive_management
+from .token_estimator import enable_token_estimation, disable_token_estimation
+from .context import current_request
+from .chunk_merging import enable_chunk_merging, disable_chunk_merging
+from .tee import tee_stream, SlowConsumerError
+from .async_stream import aiter_stream, set_stream_executor_size
+from .profiling import enable_stage_profiling, disable_stage_profiling
+from .exporter import enable_metering_exporter, disable_metering_exporter, metering_stats
+from .file_sink import FileSink
+from .sinks import MeteringSink, ReveniumSink, CallbackSink, CollectorSink, SinkError
+
+install_import_hook()
@@ -0,0 +1,197 @@
+"""
+Async iteration of metered sync streams.
+
+Iterating the stream returned by the sync ``ollama.chat(stream=True)`` inside
+a coroutine blocks the event loop while each chunk is read. ``aiter_stream()``
+reads the stream on a shared, bounded thread pool instead and exposes it as
+an async iterator::
+
+    stream = ollama.chat(model="llama3.2", messages=messages, stream=True)
+    async for chunk in aiter_stream(stream):
+        ...
+
+Up to ``prefetch`` chunks are read ahead of the consumer. A pool thread is
+only held while the stream is being read, so a slow consumer doesn't tie up
+a thread. Metering is unchanged: the call is metered when the stream is
+exhausted, and as cancelled if the consumer stops early.
+"""
+
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Deque, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREFETCH = 8
+DEFAULT_MAX_WORKERS = 16
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_stream_executor() -> ThreadPoolExecutor:
+    """
+    Get the shared thread pool that reads streams for ``aiter_stream()``.
+
+    Returns:
+        The thread pool, created on first use
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix="revenium-ollama-stream"
+                )
+    return _executor
+
+
+def set_stream_executor_size(max_workers: int) -> None:
+    """
+    Resize the shared stream thread pool.
+
+    Streams already being read keep using the previous pool until they end.
+
+    Args:
+        max_workers: Maximum number of streams read at the same time
+    """
+    global _executor
+    with _executor_lock:
+        previous, _executor = _executor, ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="revenium-ollama-stream"
+        )
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+
+class _Prefetcher:
+    """Reads a sync stream on a thread pool into a bounded buffer."""
+
+    def __init__(self, stream: Iterator[Any], prefetch: int, executor: Executor):
+        self._stream = stream
+        self._prefetch = prefetch
+        self._executor = executor
+        self._buffer: Deque[Any] = deque()
+        self._lock = threading.Lock()
+        self._loop = asyncio.get_running_loop()
+        self._waiter: Optional[asyncio.Future] = None
+        self._pumping = False
+        self._finished = False
+        self._closed = False
+        self._error: Optional[BaseException] = None
+
+    async def next(self) -> Any:
+        """
+        Get the next chunk.
+
+        Raises:
+            StopAsyncIteration: When the stream is exhausted
+        """
+        while True:
+            with self._lock:
+                if self._buffer:
+                    chunk = self._buffer.popleft()
+                    self._schedule()
+                    return chunk
+                if self._finished:
+                    if self._error is not None:
+                        raise self._error
+                    raise StopAsyncIteration
+                waiter = self._waiter = self._loop.create_future()
+                self._schedule()
+            await waiter
+
+    def _schedule(self) -> None:
+        # Called with the lock held
+        if not self._pumping and not self._finished and len(self._buffer) < self._prefetch:
+            self._pumping = True
+            self._executor.submit(self._pump)
+
+    def _pump(self) -> None:
+        while True:
+            finished, error, chunk = False, None, None
+            if self._closed:
+                finished = True
+            else:
+                try:
+                    chunk = next(self._stream)
+                except StopIteration:
+                    finished = True
+                except BaseException as e:
+                    finished, error = True, e
+            with self._lock:
+                if finished:
+                    self._finished = True
+                    self._error = error
+                else:
+                    self._buffer.append(chunk)
+                self._wake()
+                if self._finished or self._closed or len(self._buffer) >= self._prefetch:
+                    self._pumping = False
+                    close_stream = self._closed
+                    break
+        if close_stream:
+            self._close_stream()
+
+    def _wake(self) -> None:
+        # Called with the lock held
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None:
+            self._loop.call_soon_threadsafe(_resolve, waiter)
+
+    def _close_stream(self) -> None:
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+
+    async def aclose(self) -> None:
+        """Stop reading; an unfinished stream is closed and metered as cancelled."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._buffer.clear()
+            if self._pumping:
+                # The pump closes the stream once the current read returns
+                return
+            finished, self._finished = self._finished, True
+        if not finished:
+            await self._loop.run_in_executor(self._executor, self._close_stream)
+
+
+def _resolve(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+async def aiter_stream(
+    stream: Iterator[Any],
+    prefetch: int = DEFAULT_PREFETCH,
+    executor: Optional[Executor] = None
+) -> AsyncIterator[Any]:
+    """
+    Iterate a metered sync stream without blocking the event loop.
+
+    Args:
+        stream: Stream returned by ``ollama.chat(stream=True)`` or
+            ``ollama.generate(stream=True)``
+        prefetch: Maximum chunks read ahead of the consumer
+        executor: Executor to read the stream on, defaults to the shared
+            stream thread pool
+
+    Returns:
+        Async iterator of the stream's chunks
+    """
+    prefetcher = _Prefetcher(iter(stream), prefetch, executor or get_stream_executor())
+    try:
+        while True:
+            try:
+                chunk = await prefetcher.next()
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        await prefetcher.aclose()
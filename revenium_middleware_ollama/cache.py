@@ -0,0 +1,391 @@
+"""
+Exact-match response cache for ollama.chat and ollama.generate.
+
+The cache is opt-in. When enabled, deterministic requests are keyed on a
+canonical hash of the endpoint, model, messages/prompt, options, format and
+the remaining request parameters. A hit is served without calling Ollama and
+is metered as cached tokens.
+
+Two backends are provided: an in-memory LRU and a SQLite file that survives
+process restarts. Both evict least recently used entries beyond
+``max_entries`` and expire entries after ``ttl_seconds``.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL_SECONDS = 3600.0
+
+# Positional parameter names of the wrapped module functions
+POSITIONAL_PARAMS = {
+    "chat": ("model", "messages"),
+    "generate": ("model", "prompt", "suffix"),
+}
+
+# Request parameters that don't affect the generated output
+NON_SEMANTIC_PARAMS = frozenset(("keep_alive",))
+
+
+def _json_default(value: Any) -> Any:
+    if hasattr(value, "model_dump"):
+        return value.model_dump(exclude_none=True)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"__bytes_sha256__": hashlib.sha256(value).hexdigest()}
+    if callable(value):
+        # Tools may be passed as Python functions
+        return f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', repr(value))}"
+    raise TypeError(f"Unsupported type in cache key: {type(value).__name__}")
+
+
+def request_params(endpoint: str, args: tuple, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Normalize positional and keyword arguments into one parameter dict.
+
+    Args:
+        endpoint: The endpoint being called ('chat' or 'generate')
+        args: Positional arguments of the call
+        kwargs: Keyword arguments of the call
+
+    Returns:
+        Parameters keyed by name, without None values
+    """
+    params = dict(zip(POSITIONAL_PARAMS.get(endpoint, ()), args))
+    params.update(kwargs)
+    return {key: value for key, value in params.items() if value is not None}
+
+
+def make_cache_key(
+    endpoint: str,
+    args: tuple,
+    kwargs: Dict[str, Any],
+    scope: Optional[str] = None
+) -> Optional[str]:
+    """
+    Build the canonical cache key for a request.
+
+    Args:
+        endpoint: The endpoint being called ('chat' or 'generate')
+        args: Positional arguments of the call
+        kwargs: Keyword arguments of the call
+        scope: Keeps the key apart from other clients' calls (e.g. the host
+            of the ``ollama.Client`` making the call)
+
+    Returns:
+        Hex SHA-256 digest, or None if the request can't be hashed
+    """
+    params = {
+        key: value
+        for key, value in request_params(endpoint, args, kwargs).items()
+        if key not in NON_SEMANTIC_PARAMS
+    }
+    if not params.get("stream"):
+        params.pop("stream", None)
+    params["__endpoint__"] = endpoint
+    if scope is not None:
+        params["__scope__"] = scope
+    try:
+        canonical = json.dumps(
+            params, sort_keys=True, separators=(",", ":"), default=_json_default
+        )
+    except (TypeError, ValueError) as e:
+        logger.debug("Request is not cacheable: %s", str(e))
+        return None
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(params: Dict[str, Any]) -> bool:
+    """
+    Check whether a request asks for deterministic sampling.
+
+    Args:
+        params: Request parameters from ``request_params()``
+
+    Returns:
+        True when ``temperature`` is 0 or a fixed ``seed`` is set
+    """
+    options = params.get("options")
+    if options is None:
+        return False
+    if hasattr(options, "model_dump"):
+        options = options.model_dump(exclude_none=True)
+    return options.get("temperature") == 0 or options.get("seed") is not None
+
+
+def request_key(
+    endpoint: str,
+    args: tuple,
+    kwargs: Dict[str, Any],
+    deterministic_only: bool = True,
+    scope: Optional[str] = None
+) -> Optional[str]:
+    """
+    Get the canonical key of a call if the call may share its response.
+
+    Args:
+        endpoint: The endpoint being called ('chat' or 'generate')
+        args: Positional arguments of the call
+        kwargs: Keyword arguments of the call
+        deterministic_only: Require ``temperature=0`` or a fixed ``seed``
+        scope: Only share responses between calls with the same scope
+
+    Returns:
+        The key, or None if the response must not be shared
+    """
+    if endpoint not in POSITIONAL_PARAMS:
+        return None
+    if deterministic_only and not is_deterministic(request_params(endpoint, args, kwargs)):
+        return None
+    return make_cache_key(endpoint, args, kwargs, scope)
+
+
+class MemoryCacheBackend:
+    """
+    In-memory LRU backend with per-entry expiry.
+
+    Args:
+        max_entries: Maximum number of cached responses
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """
+    On-disk backend stored in a SQLite database file.
+
+    Entries are stored as JSON and survive process restarts. The database is
+    opened in WAL mode so several processes can share one cache file.
+
+    Args:
+        path: Path of the database file
+        max_entries: Maximum number of cached responses
+    """
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        import sqlite3
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS response_cache_lru ON response_cache (last_access)"
+        )
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key)
+            )
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, separators=(",", ":")), expires_at, time.time())
+            )
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                "SELECT key FROM response_cache ORDER BY last_access DESC "
+                "LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+def _response_class(endpoint: str):
+    from ollama import ChatResponse, GenerateResponse
+    return {"chat": ChatResponse, "generate": GenerateResponse}[endpoint]
+
+
+class ResponseCache:
+    """
+    Exact-match cache of Ollama responses.
+
+    Responses are stored serialized, so every hit returns fresh objects that
+    can be annotated with their own transaction ID.
+
+    Args:
+        backend: Storage backend, defaults to a ``MemoryCacheBackend``
+        ttl_seconds: Lifetime of an entry
+        deterministic_only: Only cache requests with ``temperature=0`` or a
+            fixed ``seed``
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        deterministic_only: bool = True
+    ):
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.ttl_seconds = ttl_seconds
+        self.deterministic_only = deterministic_only
+
+    def key_for(
+        self,
+        endpoint: str,
+        args: tuple,
+        kwargs: Dict[str, Any],
+        scope: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Get the cache key for a call.
+
+        Args:
+            scope: Only serve the response to calls with the same scope
+
+        Returns:
+            The key, or None if the call must not be cached
+        """
+        return request_key(endpoint, args, kwargs, self.deterministic_only, scope)
+
+    def get(self, key: str, endpoint: str) -> Optional[Any]:
+        """
+        Look up a cached response.
+
+        Returns:
+            A response object, a list of chunks for streamed requests, or
+            None on a miss
+        """
+        try:
+            payload = self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"Error reading response cache: {str(e)}")
+            return None
+        if payload is None:
+            return None
+        response_class = _response_class(endpoint)
+        chunks = [response_class.model_validate(chunk) for chunk in payload["chunks"]]
+        return chunks if payload["stream"] else chunks[0]
+
+    def set(self, key: str, response: Any) -> None:
+        """
+        Store a response object or the list of chunks of a streamed response.
+        """
+        is_stream = isinstance(response, list)
+        chunks: List[Any] = response if is_stream else [response]
+        if not chunks or not all(hasattr(chunk, "model_dump") for chunk in chunks):
+            return
+        payload = {
+            "stream": is_stream,
+            "chunks": [chunk.model_dump(mode="json", exclude_none=True) for chunk in chunks],
+        }
+        try:
+            self.backend.set(key, payload, time.time() + self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Error writing response cache: {str(e)}")
+
+
+_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Get the active response cache.
+
+    Returns:
+        The cache, or None when caching is disabled
+    """
+    return _cache
+
+
+def enable_response_cache(
+    backend=None,
+    ttl_seconds: float = DEFAULT_TTL_SECONDS,
+    max_entries: int = DEFAULT_MAX_ENTRIES,
+    path: Optional[str] = None,
+    deterministic_only: bool = True
+) -> ResponseCache:
+    """
+    Enable the response cache for ollama.chat and ollama.generate.
+
+    Args:
+        backend: Custom backend; overrides ``path`` and ``max_entries``
+        ttl_seconds: Lifetime of an entry
+        max_entries: LRU capacity of the default backends
+        path: Store entries in a SQLite file at this path instead of memory
+        deterministic_only: Only cache requests with ``temperature=0`` or a
+            fixed ``seed``
+
+    Returns:
+        The active cache
+    """
+    global _cache
+    if backend is None:
+        backend = (
+            SQLiteCacheBackend(path, max_entries) if path
+            else MemoryCacheBackend(max_entries)
+        )
+    _cache = ResponseCache(backend, ttl_seconds, deterministic_only)
+    return _cache
+
+
+def disable_response_cache() -> None:
+    """Disable the response cache."""
+    global _cache
+    _cache = None
@@ -0,0 +1,177 @@
+"""
+Merging of streamed token chunks into larger frames.
+
+Ollama streams one chunk per token, so consumers that forward streams (for
+example as server-sent events) spend more time per chunk than the model
+spends generating it. When chunk merging is enabled, the chunks returned by
+``ollama.chat(stream=True)`` and ``ollama.generate(stream=True)`` are joined
+into frames of up to ``max_chars`` characters or ``max_interval_ms`` of
+generation time, whichever comes first.
+
+A frame is a copy of its first chunk holding the text (and ``thinking`` and
+``logprobs``) of all merged chunks. Chunks with tool calls or images and the
+final chunk, which carries the usage statistics, are never merged: pending
+text is flushed as a frame before them and they are passed through as is.
+Frames are emitted when a chunk arrives, so a frame can't close before the
+next token is generated.
+
+Metering counts the chunks as Ollama sent them, before merging.
+"""
+
+import logging
+import time
+from typing import Any, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CHARS = 1024
+DEFAULT_MAX_INTERVAL_MS = 20.0
+
+
+class _Frame:
+    __slots__ = ("first", "content", "thinking", "logprobs", "size", "started")
+
+    def __init__(self, first: Any, started: float):
+        self.first = first
+        self.content: List[str] = []
+        self.thinking: List[str] = []
+        self.logprobs: List[Any] = []
+        self.size = 0
+        self.started = started
+
+
+def _text_holder(chunk: Any) -> Any:
+    # Chat chunks carry their text on the message, generate chunks directly
+    message = getattr(chunk, "message", None)
+    return message if message is not None else chunk
+
+
+def _text_field(holder: Any) -> str:
+    return "content" if hasattr(holder, "content") else "response"
+
+
+def _is_mergeable(chunk: Any) -> bool:
+    if getattr(chunk, "done", False) or getattr(chunk, "image", None):
+        return False
+    message = getattr(chunk, "message", None)
+    return message is None or not (message.tool_calls or message.images)
+
+
+class ChunkMerger:
+    """
+    Joins consecutive token chunks into larger frames.
+
+    Args:
+        max_chars: Close a frame once it holds this many characters
+        max_interval_ms: Close a frame once it spans this much time
+    """
+
+    def __init__(
+        self,
+        max_chars: int = DEFAULT_MAX_CHARS,
+        max_interval_ms: float = DEFAULT_MAX_INTERVAL_MS
+    ):
+        self.max_chars = max_chars
+        self.max_interval_s = max_interval_ms / 1000
+
+    def merge(self, stream: Iterator[Any]) -> Iterator[Any]:
+        """
+        Merge the chunks of a stream into frames.
+
+        Closing the returned generator closes ``stream``.
+
+        Args:
+            stream: Stream of Ollama chunks
+
+        Returns:
+            Generator of frames
+        """
+        frame: Optional[_Frame] = None
+        try:
+            for chunk in stream:
+                if not _is_mergeable(chunk):
+                    if frame is not None:
+                        yield self._build(frame)
+                        frame = None
+                    yield chunk
+                    continue
+
+                now = time.monotonic()
+                if frame is None:
+                    frame = _Frame(chunk, now)
+                holder = _text_holder(chunk)
+                text = getattr(holder, _text_field(holder)) or ""
+                frame.content.append(text)
+                frame.size += len(text)
+                thinking = getattr(holder, "thinking", None)
+                if thinking:
+                    frame.thinking.append(thinking)
+                    frame.size += len(thinking)
+                logprobs = getattr(chunk, "logprobs", None)
+                if logprobs:
+                    frame.logprobs.extend(logprobs)
+
+                if frame.size >= self.max_chars or now - frame.started >= self.max_interval_s:
+                    yield self._build(frame)
+                    frame = None
+
+            if frame is not None:
+                yield self._build(frame)
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+    @staticmethod
+    def _build(frame: _Frame) -> Any:
+        first = frame.first
+        if len(frame.content) == 1:
+            return first
+        holder = _text_holder(first)
+        text_update = {_text_field(holder): "".join(frame.content)}
+        if frame.thinking:
+            text_update["thinking"] = "".join(frame.thinking)
+        update = {"logprobs": frame.logprobs} if frame.logprobs else {}
+        if holder is first:
+            update.update(text_update)
+        else:
+            update["message"] = holder.model_copy(update=text_update)
+        return first.model_copy(update=update)
+
+
+_merger: Optional[ChunkMerger] = None
+
+
+def get_chunk_merger() -> Optional[ChunkMerger]:
+    """
+    Get the active chunk merger.
+
+    Returns:
+        The merger, or None when streams are returned chunk by chunk
+    """
+    return _merger
+
+
+def enable_chunk_merging(
+    max_chars: int = DEFAULT_MAX_CHARS,
+    max_interval_ms: float = DEFAULT_MAX_INTERVAL_MS
+) -> ChunkMerger:
+    """
+    Merge streamed token chunks into larger frames.
+
+    Args:
+        max_chars: Close a frame once it holds this many characters
+        max_interval_ms: Close a frame once it spans this much time
+
+    Returns:
+        The active merger
+    """
+    global _merger
+    _merger = ChunkMerger(max_chars, max_interval_ms)
+    return _merger
+
+
+def disable_chunk_merging() -> None:
+    """Return streams chunk by chunk again."""
+    global _merger
+    _merger = None
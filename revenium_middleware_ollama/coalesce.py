@@ -0,0 +1,333 @@
+"""
+Single-flight coalescing of identical concurrent requests.
+
+When coalescing is enabled, concurrent ``chat``/``generate`` calls with the
+same canonical request key share one Ollama generation. The first caller
+(the leader) runs the request; callers arriving while it is in flight wait
+for its result, or receive their own replay of the stream as chunks arrive.
+
+Flights are backed by ``concurrent.futures.Future`` so thread-based callers
+and asyncio callers can share them: threads block on ``do()``, coroutines
+await ``do_async()``. A coroutine leading a flight runs the blocking call on
+an executor, and coroutines following one await the leader's future without
+holding a thread.
+"""
+
+import asyncio
+import contextvars
+import logging
+import threading
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from .cache import request_key
+
+logger = logging.getLogger(__name__)
+
+
+def copy_response(response: Any) -> Any:
+    """
+    Copy a response so every caller can annotate its own object.
+
+    Args:
+        response: An Ollama response or stream chunk
+
+    Returns:
+        A shallow copy of the response
+    """
+    if hasattr(response, "model_copy"):
+        return response.model_copy()
+    return response
+
+
+class _StreamFlight:
+    """
+    A streamed response shared by several subscribers.
+
+    The leader starts the source with ``start()``; after that it is pulled
+    by whichever subscriber needs the next chunk first, so no background
+    thread is involved and the stream advances at the pace of the fastest
+    subscriber. Chunks are buffered until the stream finishes so late
+    subscribers can replay it from the start.
+    """
+
+    def __init__(self, factory: Callable[[], Iterator[Any]], on_finish: Callable[[], None]):
+        self._factory = factory
+        self._on_finish = on_finish
+        self._source: Optional[Iterator[Any]] = None
+        self._started = threading.Event()
+        self._chunks = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._subscribers = 0
+        # Held while pulling from the source, which may wait on the network
+        self._pull_lock = threading.Lock()
+        # Guards the subscriber count only, so subscribing never waits on a pull
+        self._count_lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        Start the source stream in the calling thread.
+
+        Raises:
+            The factory's exception, which subscribers also receive
+        """
+        try:
+            self._source = iter(self._factory())
+        except BaseException as e:
+            self._error = e
+            self._done = True
+            self._on_finish()
+            raise
+        finally:
+            self._started.set()
+
+    def _chunk_at(self, index: int) -> Any:
+        self._started.wait()
+        while True:
+            if index < len(self._chunks):
+                return self._chunks[index]
+            if self._done:
+                if self._error is not None:
+                    raise self._error
+                raise StopIteration
+            finished = False
+            with self._pull_lock:
+                if index < len(self._chunks) or self._done:
+                    continue
+                try:
+                    self._chunks.append(next(self._source))
+                except StopIteration:
+                    self._done = finished = True
+                except BaseException as e:
+                    self._error = e
+                    self._done = finished = True
+            if finished:
+                self._on_finish()
+
+    def subscribe(self) -> Iterator[Any]:
+        """
+        Get a generator replaying the stream from its first chunk.
+        """
+        with self._count_lock:
+            self._subscribers += 1
+        return self._iterate()
+
+    def _iterate(self) -> Iterator[Any]:
+        index = 0
+        try:
+            while True:
+                try:
+                    chunk = self._chunk_at(index)
+                except StopIteration:
+                    return
+                index += 1
+                yield copy_response(chunk)
+        finally:
+            self._unsubscribe()
+
+    def _unsubscribe(self) -> None:
+        with self._count_lock:
+            self._subscribers -= 1
+            if self._subscribers > 0 or self._done:
+                return
+        # Stop new callers from joining before giving up on the stream; one
+        # may have subscribed in between, in which case the stream goes on
+        self._on_finish()
+        with self._count_lock:
+            abandoned = self._subscribers == 0 and not self._done
+            if abandoned:
+                self._error = RuntimeError("Coalesced stream was abandoned")
+                self._done = True
+        if abandoned:
+            # Nobody is reading anymore; release the Ollama stream
+            source, self._source = self._source, None
+            if source is not None and hasattr(source, "close"):
+                source.close()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one execution.
+
+    Args:
+        deterministic_only: Only coalesce requests with ``temperature=0`` or a
+            fixed ``seed``; other requests are expected to differ per call
+    """
+
+    def __init__(self, deterministic_only: bool = True):
+        self.deterministic_only = deterministic_only
+        self._flights: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def key_for(
+        self,
+        endpoint: str,
+        args: tuple,
+        kwargs: Dict[str, Any],
+        scope: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Get the coalescing key for a call.
+
+        Args:
+            scope: Only coalesce with calls with the same scope
+
+        Returns:
+            The key, or None if the call must not be coalesced
+        """
+        return request_key(endpoint, args, kwargs, self.deterministic_only, scope)
+
+    def _join(self, key: str, make_flight: Callable[[], Any]) -> Tuple[Any, bool]:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = make_flight()
+            return flight, True
+
+    def _forget(self, key: str, flight: Any) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run ``fn`` once for all concurrent callers with the same key.
+
+        Args:
+            key: Coalescing key
+            fn: Function producing the result
+
+        Returns:
+            Tuple of the result and whether this caller ran ``fn``. Exceptions
+            raised by ``fn`` propagate to every caller.
+        """
+        future, is_leader = self._join(key, Future)
+        if not is_leader:
+            logger.debug("Joining in-flight request %s", key)
+            return future.result(), False
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, True
+        finally:
+            self._forget(key, future)
+
+    async def do_async(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        executor: Optional[Executor] = None
+    ) -> Tuple[Any, bool]:
+        """
+        Await ``fn`` once for all concurrent callers with the same key.
+
+        Coroutines share flights with thread-based callers using ``do()``.
+        The leader runs ``fn`` on ``executor`` in a copy of its context, so a
+        blocking call such as ``ollama.chat`` doesn't block the event loop.
+        If the leader is cancelled, ``fn`` still completes for the followers.
+
+        Args:
+            key: Coalescing key
+            fn: Function producing the result
+            executor: Executor running ``fn``; the loop's default executor if
+                None
+
+        Returns:
+            Tuple of the result and whether this caller ran ``fn``. Exceptions
+            raised by ``fn`` propagate to every caller.
+        """
+        future, is_leader = self._join(key, Future)
+        if not is_leader:
+            logger.debug("Joining in-flight request %s", key)
+            # Shielded so a cancelled caller doesn't cancel the shared flight
+            return await asyncio.shield(asyncio.wrap_future(future)), False
+
+        def lead() -> None:
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                self._forget(key, future)
+
+        context = contextvars.copy_context()
+        asyncio.get_running_loop().run_in_executor(executor, context.run, lead)
+        return await asyncio.shield(asyncio.wrap_future(future)), True
+
+    def stream(self, key: str, factory: Callable[[], Iterator[Any]]) -> Tuple[Iterator[Any], bool]:
+        """
+        Share one streamed generation among concurrent callers.
+
+        The leader calls ``factory`` before returning, so the stream is
+        started in its own thread and context and errors starting it are
+        raised here.
+
+        Args:
+            key: Coalescing key
+            factory: Function starting the stream; only called by the leader
+
+        Returns:
+            Tuple of this caller's chunk generator and whether this caller
+            started the stream
+        """
+        holder = {}
+
+        def make_flight():
+            flight = _StreamFlight(factory, lambda: self._forget(key, holder["flight"]))
+            holder["flight"] = flight
+            return flight
+
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = make_flight()
+            # Subscribe while the flight is still registered so it can't be
+            # abandoned between joining and subscribing
+            subscription = flight.subscribe()
+        if is_leader:
+            flight.start()
+        else:
+            logger.debug("Joining in-flight stream %s", key)
+        return subscription, is_leader
+
+
+_coalescer: Optional[SingleFlight] = None
+
+
+def get_request_coalescer() -> Optional[SingleFlight]:
+    """
+    Get the active request coalescer.
+
+    Returns:
+        The coalescer, or None when coalescing is disabled
+    """
+    return _coalescer
+
+
+def enable_request_coalescing(deterministic_only: bool = True) -> SingleFlight:
+    """
+    Enable single-flight coalescing for ollama.chat and ollama.generate.
+
+    Args:
+        deterministic_only: Only coalesce requests with ``temperature=0`` or a
+            fixed ``seed``
+
+    Returns:
+        The active coalescer
+    """
+    global _coalescer
+    _coalescer = SingleFlight(deterministic_only)
+    return _coalescer
+
+
+def disable_request_coalescing() -> None:
+    """Disable request coalescing."""
+    global _coalescer
+    _coalescer = None
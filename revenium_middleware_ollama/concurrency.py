@@ -0,0 +1,258 @@
+"""
+Per-model and per-host concurrency limits for Ollama calls.
+
+Ollama degrades when more requests reach a model than it can run in parallel
+(``OLLAMA_NUM_PARALLEL``) or fit in VRAM. When a limiter is enabled, every
+call first acquires a slot for its model and, if a cap is set, for its host.
+Calls beyond the cap wait in a fair queue, first come first served or by
+priority, and fail with ``ConcurrencyLimitTimeout`` if no slot frees up in
+time. The time spent queuing is reported on the metering record as
+``queue_wait_ms``, separately from the inference time.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+POLICY_FIFO = "fifo"
+POLICY_PRIORITY = "priority"
+
+DEFAULT_HOST_KEY = "default"
+
+
+class ConcurrencyLimitTimeout(TimeoutError):
+    """Raised when a call waited longer than the limiter timeout for a slot."""
+
+
+class _Waiter:
+    __slots__ = ("event", "granted")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class FairSemaphore:
+    """
+    Semaphore that admits waiters in queue order.
+
+    Released slots are handed directly to the next waiter, so new arrivals
+    can't overtake callers that are already queued.
+
+    Args:
+        capacity: Number of concurrent holders
+        policy: ``fifo`` or ``priority`` (higher priority admitted first,
+            FIFO among equal priorities)
+    """
+
+    def __init__(self, capacity: int, policy: str = POLICY_FIFO):
+        self.capacity = capacity
+        self.policy = policy
+        self.active = 0
+        self._queue: List[Any] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._queue)
+
+    def acquire(self, priority: int = 0, timeout: Optional[float] = None) -> bool:
+        """
+        Acquire a slot, waiting in queue order if none is free.
+
+        Returns:
+            True if a slot was acquired, False on timeout
+        """
+        with self._lock:
+            if self.active < self.capacity and not self._queue:
+                self.active += 1
+                return True
+            waiter = _Waiter()
+            rank = -priority if self.policy == POLICY_PRIORITY else 0
+            heapq.heappush(self._queue, (rank, next(self._sequence), waiter))
+
+        waiter.event.wait(timeout)
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+            heapq.heapify(self._queue)
+            return False
+
+    def release(self) -> None:
+        with self._lock:
+            if self._queue:
+                # Hand the slot over; the active count stays the same
+                _, _, waiter = heapq.heappop(self._queue)
+                waiter.granted = True
+                waiter.event.set()
+            else:
+                self.active -= 1
+
+
+class Permit:
+    """
+    Slots held by one call.
+
+    Attributes:
+        wait_ms: Time the call spent queuing for its slots
+    """
+
+    def __init__(self, semaphores: List[FairSemaphore], wait_ms: float):
+        self._semaphores = semaphores
+        self.wait_ms = wait_ms
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        for semaphore in reversed(self._semaphores):
+            semaphore.release()
+
+    def hold(self, response: Any, is_streaming: bool) -> Any:
+        """
+        Keep the slots until the response is done.
+
+        Non-streaming responses are done immediately; streams release their
+        slots once exhausted or closed.
+        """
+        if is_streaming and hasattr(response, "__next__"):
+            return self._hold_stream(response)
+        self.release()
+        return response
+
+    def _hold_stream(self, stream: Iterator[Any]) -> Iterator[Any]:
+        try:
+            yield from stream
+        finally:
+            self.release()
+
+
+class ConcurrencyLimiter:
+    """
+    Enforces concurrency caps per model and per host.
+
+    Args:
+        max_per_model: Default cap for every model (None for no cap)
+        model_limits: Caps for specific models, overriding ``max_per_model``
+        max_per_host: Cap per Ollama host (None for no cap)
+        timeout_s: Maximum queue wait before ``ConcurrencyLimitTimeout``
+        policy: ``fifo`` or ``priority``
+    """
+
+    def __init__(
+        self,
+        max_per_model: Optional[int] = None,
+        model_limits: Optional[Dict[str, int]] = None,
+        max_per_host: Optional[int] = None,
+        timeout_s: Optional[float] = None,
+        policy: str = POLICY_FIFO
+    ):
+        if policy not in (POLICY_FIFO, POLICY_PRIORITY):
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.max_per_model = max_per_model
+        self.model_limits = dict(model_limits or {})
+        self.max_per_host = max_per_host
+        self.timeout_s = timeout_s
+        self.policy = policy
+        self._models: Dict[str, FairSemaphore] = {}
+        self._hosts: Dict[str, FairSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, table: Dict[str, FairSemaphore], key: str, capacity: Optional[int]):
+        if capacity is None:
+            return None
+        semaphore = table.get(key)
+        if semaphore is None:
+            with self._lock:
+                semaphore = table.setdefault(key, FairSemaphore(capacity, self.policy))
+        return semaphore
+
+    def acquire(self, model: str, host: Optional[str] = None, priority: int = 0) -> Permit:
+        """
+        Acquire the slots for a call.
+
+        Args:
+            model: Model the call is made for
+            host: Ollama host serving the call, None for the default host
+            priority: Admission priority under the ``priority`` policy
+
+        Returns:
+            Permit to release once the call is done
+
+        Raises:
+            ConcurrencyLimitTimeout: If no slot was free within the timeout
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout_s if self.timeout_s is not None else None
+        acquired: List[FairSemaphore] = []
+        semaphores = (
+            self._semaphore(self._models, model, self.model_limits.get(model, self.max_per_model)),
+            self._semaphore(self._hosts, host or DEFAULT_HOST_KEY, self.max_per_host),
+        )
+        for semaphore in semaphores:
+            if semaphore is None:
+                continue
+            remaining = max(deadline - time.monotonic(), 0) if deadline is not None else None
+            if not semaphore.acquire(priority, remaining):
+                Permit(acquired, 0).release()
+                raise ConcurrencyLimitTimeout(
+                    f"No Ollama slot for model {model!r} within {self.timeout_s}s"
+                )
+            acquired.append(semaphore)
+        wait_ms = (time.monotonic() - started) * 1000
+        if wait_ms >= 1:
+            logger.debug("Call for %s queued %.1fms for a concurrency slot", model, wait_ms)
+        return Permit(acquired, wait_ms)
+
+
+_limiter: Optional[ConcurrencyLimiter] = None
+
+
+def get_concurrency_limiter() -> Optional[ConcurrencyLimiter]:
+    """
+    Get the active concurrency limiter.
+
+    Returns:
+        The limiter, or None when calls are not limited
+    """
+    return _limiter
+
+
+def enable_concurrency_limit(
+    max_per_model: Optional[int] = None,
+    model_limits: Optional[Dict[str, int]] = None,
+    max_per_host: Optional[int] = None,
+    timeout_s: Optional[float] = None,
+    policy: str = POLICY_FIFO
+) -> ConcurrencyLimiter:
+    """
+    Limit concurrent Ollama calls per model and per host.
+
+    Args:
+        max_per_model: Default cap for every model (None for no cap)
+        model_limits: Caps for specific models, overriding ``max_per_model``
+        max_per_host: Cap per Ollama host (None for no cap)
+        timeout_s: Maximum queue wait before ``ConcurrencyLimitTimeout``
+        policy: ``fifo`` or ``priority``; with ``priority``, calls pass
+            ``usage_metadata={"priority": n}`` and higher values go first
+
+    Returns:
+        The active limiter
+    """
+    global _limiter
+    _limiter = ConcurrencyLimiter(max_per_model, model_limits, max_per_host, timeout_s, policy)
+    return _limiter
+
+
+def disable_concurrency_limit() -> None:
+    """Stop limiting concurrent calls."""
+    global _limiter
+    _limiter = None
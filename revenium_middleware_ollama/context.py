@@ -0,0 +1,164 @@
+"""
+Per-call request context.
+
+Every metered call gets a ``RequestContext`` holding what the middleware
+knows about the call before and after it reaches Ollama. While the call is
+dispatched, the context is available through ``current_request()``, so code
+running inside the call (routing, limits, custom hooks) can read it. Once the
+response is metered, the context is attached to the response as
+``response._revenium_request_context``.
+
+The context also keeps the few facts metering needs from the request
+payload, such as whether it declared tools, so the payload itself (message
+history, images) isn't kept alive until the metering record is exported.
+
+Images are counted and sized in the same pass without decoding or copying
+them: bytes are measured through ``memoryview``, base64 strings by their
+length and padding, and image files with ``os.stat``.
+"""
+
+import contextvars
+import os
+from typing import Any, Dict, Optional
+
+from .cache import request_params
+
+_current_request: "contextvars.ContextVar[Optional[RequestContext]]" = contextvars.ContextVar(
+    "revenium_ollama_request", default=None
+)
+
+
+class RequestContext:
+    """
+    What the middleware knows about one call.
+
+    Attributes:
+        endpoint: The endpoint being called ('chat', 'generate', 'embed')
+        model: Model the call is made for
+        transaction_id: Revenium transaction ID of the call
+        estimated_prompt_tokens: Pre-flight prompt token estimate, if token
+            estimation is enabled
+        prompt_tokens: Prompt tokens reported by Ollama, once known
+        tokens_estimated: Whether the metered token counts were estimated
+            because Ollama didn't report them
+        has_tools: Whether the request declared tools, once described
+        message_count: Number of chat messages, 1 for ``generate``
+        image_count: Number of images attached to the request
+        image_bytes: Total decoded size of the images
+        span: OpenTelemetry span of the call, if tracing is configured
+    """
+
+    __slots__ = (
+        "endpoint", "model", "transaction_id",
+        "estimated_prompt_tokens", "prompt_tokens", "tokens_estimated",
+        "prompt_size", "prompt_parts", "has_tools", "message_count", "image_count",
+        "image_bytes", "span"
+    )
+
+    def __init__(self, endpoint: str, model: str, transaction_id: str):
+        self.endpoint = endpoint
+        self.model = model
+        self.transaction_id = transaction_id
+        self.estimated_prompt_tokens: Optional[int] = None
+        self.prompt_tokens: Optional[int] = None
+        self.tokens_estimated = False
+        # Measured prompt size, kept to calibrate the estimator
+        self.prompt_size = 0
+        self.prompt_parts = 0
+        self.has_tools: Optional[bool] = None
+        self.message_count = 0
+        self.image_count = 0
+        self.image_bytes = 0
+        self.span: Any = None
+
+    def describe_request(self, args: tuple, kwargs: Dict[str, Any]) -> None:
+        """
+        Record what metering needs from the request payload.
+
+        Args:
+            args: Positional arguments of the call
+            kwargs: Keyword arguments of the call
+        """
+        params = request_params(self.endpoint, args, kwargs)
+        self.has_tools = bool(params.get("tools"))
+        if self.endpoint == "chat":
+            messages = params.get("messages") or ()
+            self.message_count = len(messages)
+            for message in messages:
+                images = message.get("images")
+                if images:
+                    self._count_images(images)
+        elif self.endpoint == "generate":
+            self.message_count = 1
+            images = params.get("images")
+            if images:
+                self._count_images(images)
+
+    def _count_images(self, images: Any) -> None:
+        self.image_count += len(images)
+        for image in images:
+            self.image_bytes += image_size(image)
+
+    @property
+    def estimate_error(self) -> Optional[int]:
+        """Reported minus estimated prompt tokens, once both are known."""
+        if self.estimated_prompt_tokens is None or self.prompt_tokens is None:
+            return None
+        return self.prompt_tokens - self.estimated_prompt_tokens
+
+    def activate(self) -> contextvars.Token:
+        """Make this the current request; pass the token to ``deactivate()``."""
+        return _current_request.set(self)
+
+    @staticmethod
+    def deactivate(token: contextvars.Token) -> None:
+        _current_request.reset(token)
+
+
+def current_request() -> Optional[RequestContext]:
+    """
+    Get the context of the call being dispatched.
+
+    Returns:
+        The context, or None outside a metered call
+    """
+    return _current_request.get()
+
+
+# Extensions Ollama treats as image file paths rather than base64 data
+IMAGE_FILE_EXTENSIONS = frozenset(("png", "jpg", "jpeg", "webp"))
+# Longer strings are base64 data; shorter ones may be file paths
+MAX_IMAGE_PATH_LENGTH = 4096
+
+
+def image_size(image: Any) -> int:
+    """
+    Get the decoded size of a request image without decoding it.
+
+    Args:
+        image: Raw bytes, a base64 string, a file path or an ``ollama.Image``
+
+    Returns:
+        Size in bytes, 0 if unknown
+    """
+    image = getattr(image, "value", image)
+    if isinstance(image, str):
+        if len(image) <= MAX_IMAGE_PATH_LENGTH and image.rpartition(".")[2].lower() in IMAGE_FILE_EXTENSIONS:
+            return _file_size(image)
+        # Every 4 base64 characters encode 3 bytes, minus the padding
+        padding = 2 if image.endswith("==") else 1 if image.endswith("=") else 0
+        return max(len(image) * 3 // 4 - padding, 0)
+    if isinstance(image, os.PathLike):
+        return _file_size(image)
+    try:
+        with memoryview(image) as view:
+            return view.nbytes
+    except TypeError:
+        return 0
+
+
+def _file_size(path: Any) -> int:
+    try:
+        return os.stat(path).st_size
+    except (OSError, ValueError):
+        return 0
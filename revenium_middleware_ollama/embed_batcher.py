@@ -0,0 +1,206 @@
+"""
+Micro-batching of concurrent ollama.embed calls.
+
+When enabled, embed calls that arrive within a short window are gathered per
+model (and per embed options) and sent to Ollama as one batched request. The
+embeddings are split back to each caller, and the batch's
+``prompt_eval_count`` is shared across callers in proportion to the size of
+their input so every caller can be metered for its part of the batch.
+
+No background thread is used: the first caller of a batch waits for the
+window to close (or the batch to fill up) and then dispatches it.
+"""
+
+import json
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT_MS = 5.0
+
+# Positional parameter names of ollama.embed
+EMBED_PARAMS = ("model", "input", "truncate", "options", "keep_alive", "dimensions")
+
+
+def split_proportionally(total: int, weights: Sequence[int]) -> List[int]:
+    """
+    Split an integer total in proportion to weights.
+
+    Uses the largest remainder method so the parts always sum to ``total``.
+
+    Args:
+        total: Amount to split
+        weights: Non-negative weight per part
+
+    Returns:
+        One integer share per weight
+    """
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        weights = [1] * len(weights)
+        weight_sum = len(weights)
+    exact = [total * weight / weight_sum for weight in weights]
+    shares = [int(value) for value in exact]
+    remainders = sorted(
+        range(len(weights)), key=lambda index: exact[index] - shares[index], reverse=True
+    )
+    for index in remainders[:total - sum(shares)]:
+        shares[index] += 1
+    return shares
+
+
+class _Batch:
+    def __init__(self):
+        self.items: List[Tuple[List[str], Future]] = []
+        self.size = 0
+        self.closed = False
+        self.full = threading.Event()
+
+
+class EmbedBatcher:
+    """
+    Gathers concurrent embed calls into batched Ollama requests.
+
+    Args:
+        max_batch_size: Maximum number of inputs per batched request
+        max_wait_ms: How long the first call of a batch waits for others
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self._open: Dict[str, _Batch] = {}
+        self._lock = threading.Lock()
+
+    def _batch_key(self, params: Dict[str, Any]) -> Optional[str]:
+        rest = {key: value for key, value in params.items() if key != "input"}
+        try:
+            return json.dumps(rest, sort_keys=True, default=lambda value: value.model_dump())
+        except (TypeError, ValueError, AttributeError):
+            return None
+
+    def embed(self, wrapped, args: tuple, kwargs: Dict[str, Any]):
+        """
+        Embed through a shared batch.
+
+        Calls that can't be batched (unhashable options or inputs larger than
+        a batch) are passed straight to ``wrapped``.
+
+        Args:
+            wrapped: The original ollama.embed function
+            args: Positional arguments of the call
+            kwargs: Keyword arguments of the call
+
+        Returns:
+            An EmbedResponse holding this caller's embeddings and its share
+            of the batch's ``prompt_eval_count``
+        """
+        params = dict(zip(EMBED_PARAMS, args))
+        params.update(kwargs)
+        params = {key: value for key, value in params.items() if value is not None}
+        inputs = params.get("input", "")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+        key = self._batch_key(params)
+        if key is None or not inputs or len(inputs) >= self.max_batch_size:
+            return wrapped(*args, **kwargs)
+
+        future: Future = Future()
+        with self._lock:
+            batch = self._open.get(key)
+            if batch is not None and batch.size + len(inputs) > self.max_batch_size:
+                # Send the open batch as it is rather than overfill it
+                self._close(key, batch)
+                batch = None
+            is_dispatcher = batch is None
+            if is_dispatcher:
+                batch = self._open[key] = _Batch()
+            batch.items.append((inputs, future))
+            batch.size += len(inputs)
+            if batch.size >= self.max_batch_size:
+                self._close(key, batch)
+
+        if is_dispatcher:
+            batch.full.wait(self.max_wait_s)
+            with self._lock:
+                if not batch.closed:
+                    self._close(key, batch)
+            self._dispatch(wrapped, params, batch)
+        return future.result()
+
+    def _close(self, key: str, batch: _Batch) -> None:
+        batch.closed = True
+        if self._open.get(key) is batch:
+            del self._open[key]
+        batch.full.set()
+
+    def _dispatch(self, wrapped, params: Dict[str, Any], batch: _Batch) -> None:
+        all_inputs = [text for inputs, _ in batch.items for text in inputs]
+        logger.debug(
+            "Sending batched embed of %d inputs for %d calls",
+            len(all_inputs), len(batch.items)
+        )
+        request = dict(params, input=all_inputs)
+        try:
+            response = wrapped(**request)
+            shares = split_proportionally(
+                getattr(response, "prompt_eval_count", 0) or 0,
+                [sum(len(text) for text in inputs) for inputs, _ in batch.items]
+            )
+            offset = 0
+            for (inputs, future), share in zip(batch.items, shares):
+                embeddings = response.embeddings[offset:offset + len(inputs)]
+                offset += len(inputs)
+                future.set_result(
+                    response.model_copy(update={"embeddings": embeddings, "prompt_eval_count": share})
+                )
+        except BaseException as e:
+            # Callers still waiting would otherwise block forever
+            for _, future in batch.items:
+                if not future.done():
+                    future.set_exception(e)
+
+
+_batcher: Optional[EmbedBatcher] = None
+
+
+def get_embed_batcher() -> Optional[EmbedBatcher]:
+    """
+    Get the active embed batcher.
+
+    Returns:
+        The batcher, or None when embed batching is disabled
+    """
+    return _batcher
+
+
+def enable_embed_batching(
+    max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+    max_wait_ms: float = DEFAULT_MAX_WAIT_MS
+) -> EmbedBatcher:
+    """
+    Enable micro-batching of concurrent ollama.embed calls.
+
+    Args:
+        max_batch_size: Maximum number of inputs per batched request
+        max_wait_ms: How long the first call of a batch waits for others
+
+    Returns:
+        The active batcher
+    """
+    global _batcher
+    _batcher = EmbedBatcher(max_batch_size, max_wait_ms)
+    return _batcher
+
+
+def disable_embed_batching() -> None:
+    """Disable embed batching."""
+    global _batcher
+    _batcher = None
@@ -0,0 +1,731 @@
+"""
+Queued export of metering records with self-monitoring.
+
+By default every metered call starts its own metering thread. When the
+metering exporter is enabled, records are queued instead, built in batches
+by a worker thread and fanned out to one or more sinks (see ``sinks.py``):
+Revenium by default, local files, a callback or an in-memory collector.
+
+Every sink has its own bounded queue and worker thread, so a slow or failing
+sink doesn't hold up the others. Queue size, batch size, retries and the
+spool file can be set per sink with ``sink_options``. Failed exports are
+retried with exponential backoff. Records that still fail, and records left
+in a queue at shutdown, are appended to the sink's optional JSONL spool file
+that the replay tool can send later.
+
+The metering record is built on the worker thread, so a metered call only
+pays for appending to the queue. In synchronous mode, used by the test
+harness in ``testing.py``, records are instead built and exported inside
+``submit()`` without any thread. Queues are bounded, and records that
+arrive while one is full are dropped and counted.
+
+``stats()`` reports how metering keeps up with inference:
+
+- ``queue_depth`` and ``oldest_queued_s``: records waiting to be built and
+  the age of the oldest record waiting in any queue
+- ``enqueued``, ``exported``, ``failed``, ``dropped``, ``retries``,
+  ``spooled``: record totals, summed over the sinks
+- ``spool_backlog``: records in spool files waiting to be replayed; it drops
+  to 0 once the replay tool moves a spool file away (``--rotate``)
+- ``bytes_sent`` and ``batches``
+- ``export_latency_s``: enqueue-to-export latency percentiles
+- ``batch_size``: batch size percentiles
+- ``sinks``: queue depth, record totals and latency of each sink
+
+Counters written by the calling threads are sharded per thread like the
+metrics registry and the workers' counters each have a single writer, so
+neither the hot path nor ``stats()`` contend with each other. The exporter
+also logs the stats periodically, or passes them to a reporter callback.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from .metrics import Counter, Histogram, bucket_quantile
+from .sinks import MeteringSink, ReveniumSink, SinkError
+from .trace_fields import cached_env
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL_S = 0.5
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF_S = 0.5
+DEFAULT_REPORT_INTERVAL_S = 60.0
+DEFAULT_SHUTDOWN_TIMEOUT_S = 5.0
+
+# Bucket upper bounds for enqueue-to-export latency, in seconds
+EXPORT_LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Options that can be set per sink through sink_options
+SINK_OPTIONS = (
+    "max_queue_size", "batch_size", "flush_interval_s", "max_retries",
+    "retry_backoff_s", "spool_path",
+)
+
+# A queued record: when it was enqueued, the function building its
+# create_completion arguments and an optional callback run once it is built
+_QueuedRecord = Tuple[float, Callable[[], Optional[Dict[str, Any]]], Optional[Callable[[], None]]]
+# A built record waiting for a sink: when it was enqueued and its
+# create_completion arguments
+_BuiltRecord = Tuple[float, Dict[str, Any]]
+
+
+def _percentiles(buckets: Sequence[float], entries: Sequence[Optional[List[float]]]) -> Dict[str, float]:
+    entries = [entry for entry in entries if entry is not None]
+    if not entries:
+        return {}
+    entry = [sum(values) for values in zip(*entries)]
+    count = sum(entry[:-1])
+    return {
+        "mean": entry[-1] / count,
+        "p50": bucket_quantile(buckets, entry, 0.5),
+        "p90": bucket_quantile(buckets, entry, 0.9),
+        "p99": bucket_quantile(buckets, entry, 0.99),
+    }
+
+
+class _SinkQueue:
+    """Bounded queue and worker thread feeding one sink."""
+
+    def __init__(
+        self,
+        sink: MeteringSink,
+        max_queue_size: int,
+        batch_size: int,
+        flush_interval_s: float,
+        max_retries: int,
+        retry_backoff_s: float,
+        spool_path: Optional[str]
+    ):
+        self.sink = sink
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.max_retries = max_retries
+        self.retry_backoff_s = retry_backoff_s
+        self.spool_path = spool_path
+
+        self._queue: Deque[_BuiltRecord] = deque()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Whether the worker has exited, and whether stop() stopped waiting
+        # for it so the worker finishes the shutdown itself
+        self._stop_lock = threading.Lock()
+        self._finished = False
+        self._detached = False
+
+        # Written by the exporter's build thread, by the calling threads in
+        # synchronous mode and at shutdown, so sharded like the metrics
+        self._offered = Counter("offered", "Records offered to the sink.", labelnames=())
+        self._dropped = Counter("dropped", "Records dropped for the sink.", labelnames=())
+        # Written by this queue's worker thread only, or under the exporter's
+        # lock in synchronous mode
+        self.handled = 0
+        self._exported = 0
+        self._failed = 0
+        self._retries = 0
+        self._spooled = 0
+        self._spool_backlog = self._count_spooled()
+        # The spool file the backlog was counted in; replay may move it away
+        self._spool_file_id = self._spool_identity()
+        self._bytes_sent = 0
+        self._batches = 0
+        self.export_latency = Histogram(
+            "export_latency", "Enqueue-to-export latency.", EXPORT_LATENCY_BUCKETS, labelnames=()
+        )
+
+    def start(self) -> None:
+        self._stopping.clear()
+        self._finished = self._detached = False
+        self._thread = threading.Thread(
+            target=self._run, name=f"revenium-metering-{self.sink.name}", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def offered(self) -> int:
+        """Records queued for the sink so far."""
+        return int(self._offered.total())
+
+    def offer(self, records: List[_BuiltRecord]) -> None:
+        """Queue built records, dropping those that don't fit."""
+        room = max(self.max_queue_size - len(self._queue), 0)
+        if len(records) > room:
+            self._dropped.inc((), len(records) - room)
+            logger.warning(
+                "Metering queue of sink %s is full, dropping %d records",
+                self.sink.name, len(records) - room
+            )
+            records = records[:room]
+        self._queue.extend(records)
+        self._offered.inc((), len(records))
+        if len(self._queue) >= self.batch_size and not self._wakeup.is_set():
+            self._wakeup.set()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def oldest_enqueued_at(self) -> Optional[float]:
+        try:
+            return self._queue[0][0]
+        except IndexError:
+            return None
+
+    def stop(self, timeout: float) -> None:
+        thread = self._thread
+        if thread is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            thread.join(timeout)
+            with self._stop_lock:
+                if not self._finished:
+                    # Draining inline would export alongside the worker, which
+                    # finishes the queue and closes the sink itself instead
+                    self._detached = True
+                    logger.warning(
+                        "Metering sink %s didn't stop within %.1fs, finishing in the background",
+                        self.sink.name, timeout
+                    )
+                    return
+            self._thread = None
+        self._finish()
+
+    def _finish(self) -> None:
+        leftovers = []
+        while self._queue:
+            leftovers.append(self._queue.popleft())
+        if leftovers:
+            self._give_up([record for _, record in leftovers], "shutdown")
+            self.handled += len(leftovers)
+        try:
+            self.sink.close()
+        except Exception as e:
+            logger.warning(f"Error closing metering sink {self.sink.name}: {str(e)}")
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval_s)
+            self._wakeup.clear()
+            stopping = self._stopping.is_set()
+            self.drain()
+            if not stopping:
+                # Closed by stop() instead
+                try:
+                    self.sink.flush()
+                except Exception as e:
+                    logger.warning(f"Error flushing metering sink {self.sink.name}: {str(e)}")
+            if stopping:
+                with self._stop_lock:
+                    self._finished = True
+                    detached = self._detached
+                if detached:
+                    self._thread = None
+                    self._finish()
+                return
+
+    def drain(self) -> None:
+        """Export the queued records on the calling thread."""
+        while self._queue:
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popleft())
+            self._export(batch)
+            self.handled += len(batch)
+
+    def _export(self, batch: List[_BuiltRecord]) -> None:
+        self._batches += 1
+        pending = [record for _, record in batch]
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._retries += 1
+                if not self._stopping.is_set():
+                    self._stopping.wait(self.retry_backoff_s * 2 ** (attempt - 1))
+            try:
+                sent_bytes = self.sink.export(pending)
+            except SinkError as e:
+                logger.warning(f"Error exporting metering records to {self.sink.name}: {str(e)}")
+                failed = list(e.records)
+                self._exported_part(batch, pending, failed)
+                pending = failed
+                continue
+            except Exception as e:
+                logger.warning(f"Error exporting metering records to {self.sink.name}: {str(e)}")
+                continue
+            self._bytes_sent += sent_bytes or 0
+            self._exported_part(batch, pending, [])
+            return
+        self._give_up(pending, "export failed")
+
+    def _exported_part(
+        self,
+        batch: List[_BuiltRecord],
+        attempted: List[Dict[str, Any]],
+        failed: List[Dict[str, Any]]
+    ) -> None:
+        now = time.monotonic()
+        if not failed and len(attempted) == len(batch):
+            # The whole batch went through on the first attempt
+            self._exported += len(batch)
+            for enqueued_at, _ in batch:
+                self.export_latency.observe((), now - enqueued_at)
+            return
+        exported = {id(record) for record in attempted} - {id(record) for record in failed}
+        if not exported:
+            return
+        self._exported += len(exported)
+        for enqueued_at, record in batch:
+            if id(record) in exported:
+                self.export_latency.observe((), now - enqueued_at)
+
+    def _give_up(self, records: List[Dict[str, Any]], reason: str) -> None:
+        if self.spool_path is None:
+            if reason == "shutdown":
+                self._dropped.inc((), len(records))
+            else:
+                self._failed += len(records)
+            logger.warning("Dropped %d metering records for %s (%s)", len(records), self.sink.name, reason)
+            return
+        if self._spool_identity() != self._spool_file_id:
+            # The spool was moved away for replay; this starts a new one
+            self._spool_backlog = 0
+        try:
+            with open(self.spool_path, "a", encoding="utf-8") as spool:
+                for completion_args in records:
+                    spool.write(json.dumps(completion_args, default=str) + "\n")
+        except OSError as e:
+            logger.warning(f"Error writing metering spool: {str(e)}")
+            self._failed += len(records)
+            return
+        self._spool_file_id = self._spool_identity()
+        self._spooled += len(records)
+        self._spool_backlog += len(records)
+        logger.warning("Spooled %d metering records (%s) to %s", len(records), reason, self.spool_path)
+
+    def _spool_identity(self) -> Optional[Tuple[int, int]]:
+        if self.spool_path is None:
+            return None
+        try:
+            stat = os.stat(self.spool_path)
+        except OSError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def _count_spooled(self) -> int:
+        if self.spool_path is None or not os.path.exists(self.spool_path):
+            return 0
+        with open(self.spool_path, "rb") as spool:
+            return sum(1 for _ in spool)
+
+    def stats(self) -> Dict[str, Any]:
+        spool_backlog = self._spool_backlog
+        if spool_backlog and self._spool_identity() != self._spool_file_id:
+            # The spool was moved away for replay, or removed
+            spool_backlog = 0
+        return {
+            "queue_depth": len(self._queue),
+            "exported": self._exported,
+            "failed": self._failed,
+            "dropped": int(self._dropped.total()),
+            "retries": self._retries,
+            "spooled": self._spooled,
+            "spool_backlog": spool_backlog,
+            "bytes_sent": self._bytes_sent,
+            "batches": self._batches,
+            "export_latency_s": _percentiles(
+                EXPORT_LATENCY_BUCKETS, [self.export_latency.collect().get(())]
+            ),
+        }
+
+
+class MeteringExporter:
+    """
+    Builds metering records on a worker thread and fans them out to sinks.
+
+    Args:
+        max_queue_size: Maximum records waiting in each queue
+        batch_size: Maximum records built or exported per batch
+        flush_interval_s: How long a record can wait for a batch to fill
+        max_retries: Retries of a failed export before the records are
+            spooled or counted as failed
+        retry_backoff_s: Delay before the first retry, doubled for each
+            further retry
+        spool_path: JSONL file receiving records that couldn't be sent to
+            Revenium
+        report_interval_s: How often to report stats (None to disable)
+        reporter: Callable receiving the stats at each report, instead of
+            logging them
+        send: Callable sending one record's ``create_completion``
+            arguments to Revenium, defaults to the Revenium client
+        file_sink: Optional ``FileSink`` receiving every record, added to
+            the other sinks
+        send_to_revenium: Whether to send records to Revenium when
+            ``sinks`` isn't given
+        sinks: Sinks receiving every record, defaults to a ``ReveniumSink``
+        sink_options: Per-sink overrides of ``max_queue_size``,
+            ``batch_size``, ``flush_interval_s``, ``max_retries``,
+            ``retry_backoff_s`` and ``spool_path``, keyed by sink name
+        synchronous: Build and export each record inside ``submit()`` on
+            the calling thread, without starting any thread; for tests
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval_s: float = DEFAULT_FLUSH_INTERVAL_S,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        retry_backoff_s: float = DEFAULT_RETRY_BACKOFF_S,
+        spool_path: Optional[str] = None,
+        report_interval_s: Optional[float] = DEFAULT_REPORT_INTERVAL_S,
+        reporter: Optional[Callable[[Dict[str, Any]], None]] = None,
+        send: Optional[Callable[[Dict[str, Any]], Any]] = None,
+        file_sink: Optional[MeteringSink] = None,
+        send_to_revenium: bool = True,
+        sinks: Optional[Sequence[MeteringSink]] = None,
+        sink_options: Optional[Dict[str, Dict[str, Any]]] = None,
+        synchronous: bool = False
+    ):
+        if sinks is None:
+            sinks = [ReveniumSink(send)] if send_to_revenium else []
+        sinks = list(sinks) + ([file_sink] if file_sink is not None else [])
+        if not sinks:
+            raise ValueError("Records must go to at least one sink")
+        names = [sink.name for sink in sinks]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Metering sink names must be unique: {names}")
+        sink_options = sink_options or {}
+        for name, options in sink_options.items():
+            if name not in names:
+                raise ValueError(f"Options given for unknown metering sink: {name}")
+            unknown = set(options) - set(SINK_OPTIONS)
+            if unknown:
+                raise ValueError(f"Unknown metering sink options: {sorted(unknown)}")
+
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.report_interval_s = report_interval_s
+        self.reporter = reporter
+        self.synchronous = synchronous
+        self.sinks = sinks
+        self._sink_queues = []
+        for sink in sinks:
+            options = {
+                "max_queue_size": max_queue_size,
+                "batch_size": batch_size,
+                "flush_interval_s": flush_interval_s,
+                "max_retries": max_retries,
+                "retry_backoff_s": retry_backoff_s,
+                # The exporter's spool file is for records meant for Revenium,
+                # which the replay tool sends
+                "spool_path": spool_path if isinstance(sink, ReveniumSink) else None,
+            }
+            options.update(sink_options.get(sink.name, {}))
+            self._sink_queues.append(_SinkQueue(sink, **options))
+
+        self._queue: Deque[_QueuedRecord] = deque()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        # Whether the worker has exited, and whether stop() stopped waiting
+        # for it so the worker finishes the shutdown itself
+        self._stop_lock = threading.Lock()
+        self._finished = False
+        self._detached = False
+        self._stop_timeout = DEFAULT_SHUTDOWN_TIMEOUT_S
+        # Serializes synchronous exports, which run on the calling threads
+        self._sync_lock = threading.Lock()
+
+        # Written by calling threads
+        self._enqueued = Counter("enqueued", "Records enqueued.", labelnames=())
+        self._dropped = Counter("dropped", "Records dropped with a full queue.", labelnames=())
+        # Written by the build thread only, or under _sync_lock in synchronous mode
+        self._failed = 0
+        self._batches = 0
+        self._handled = 0
+        self._batch_size = Histogram(
+            "batch_size", "Records per batch.", BATCH_SIZE_BUCKETS, labelnames=()
+        )
+        self._last_report = time.monotonic()
+
+    def submit(
+        self,
+        build: Callable[[], Optional[Dict[str, Any]]],
+        on_done: Optional[Callable[[], None]] = None
+    ) -> bool:
+        """
+        Queue a record for export.
+
+        Args:
+            build: Function returning the record's ``create_completion``
+                arguments, or None to skip it; called on the worker thread
+            on_done: Optional callback run once the record is built and
+                handed to the sinks, or dropped
+
+        Returns:
+            False if the queue was full and the record was dropped
+        """
+        if self.synchronous:
+            self._enqueued.inc(())
+            with self._sync_lock:
+                self._build_batch([(time.monotonic(), build, on_done)])
+                for sink_queue in self._sink_queues:
+                    sink_queue.drain()
+            return True
+        if self._thread is None:
+            self.start()
+        if len(self._queue) >= self.max_queue_size:
+            self._dropped.inc(())
+            logger.warning("Metering queue is full, dropping record")
+            if on_done is not None:
+                on_done()
+            return False
+        self._queue.append((time.monotonic(), build, on_done))
+        self._enqueued.inc(())
+        # Setting an event takes a lock, so skip it while the worker is
+        # already due to wake up
+        if len(self._queue) >= self.batch_size and not self._wakeup.is_set():
+            self._wakeup.set()
+        return True
+
+    def start(self) -> None:
+        """Start the worker threads; called on the first submitted record."""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            for sink_queue in self._sink_queues:
+                sink_queue.start()
+            self._stopping.clear()
+            self._finished = self._detached = False
+            self._thread = threading.Thread(
+                target=self._run, name="revenium-metering-exporter", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout: float = DEFAULT_SHUTDOWN_TIMEOUT_S) -> None:
+        """
+        Export the queued records and stop the workers.
+
+        Records still queued for a sink after ``timeout`` are spooled, or
+        counted as dropped without a spool file. A worker still busy after
+        ``timeout`` is left to finish its queue in the background.
+
+        Args:
+            timeout: Seconds to wait for each queue to drain
+        """
+        thread = self._thread
+        if thread is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            thread.join(timeout)
+            with self._stop_lock:
+                if not self._finished:
+                    # Building inline would race the worker, which stops the
+                    # sinks itself once it is done
+                    self._detached = True
+                    self._stop_timeout = timeout
+                    logger.warning(
+                        "Metering exporter didn't stop within %.1fs, finishing in the background", timeout
+                    )
+                    return
+            self._thread = None
+        self._finish(timeout)
+
+    def _finish(self, timeout: float) -> None:
+        if self._queue:
+            # Build what the worker didn't get to, so the sinks can spool it
+            self._build_batch(self._take(len(self._queue)))
+        for sink_queue in self._sink_queues:
+            sink_queue.stop(timeout)
+
+    def flush(self, timeout: float = DEFAULT_SHUTDOWN_TIMEOUT_S) -> bool:
+        """
+        Wait until every queued record has been handled by every sink.
+
+        Args:
+            timeout: Seconds to wait
+
+        Returns:
+            True if the queues drained within ``timeout``
+        """
+        deadline = time.monotonic() + timeout
+        while self._handled < self._enqueued.total() or any(
+            sink_queue.handled < sink_queue.offered for sink_queue in self._sink_queues
+        ):
+            if time.monotonic() >= deadline:
+                return False
+            self._wakeup.set()
+            for sink_queue in self._sink_queues:
+                sink_queue.wake()
+            time.sleep(0.005)
+        return True
+
+    def _take(self, limit: int) -> List[_QueuedRecord]:
+        batch = []
+        while self._queue and len(batch) < limit:
+            batch.append(self._queue.popleft())
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval_s)
+            self._wakeup.clear()
+            stopping = self._stopping.is_set()
+            while self._queue:
+                self._build_batch(self._take(self.batch_size))
+            self._maybe_report()
+            if stopping:
+                with self._stop_lock:
+                    self._finished = True
+                    detached = self._detached
+                if detached:
+                    self._thread = None
+                    self._finish(self._stop_timeout)
+                return
+
+    def _build_batch(self, batch: List[_QueuedRecord]) -> None:
+        self._batches += 1
+        self._batch_size.observe((), len(batch))
+        records = []
+        with cached_env():
+            for enqueued_at, build, _ in batch:
+                try:
+                    completion_args = build()
+                except Exception as e:
+                    logger.warning(f"Error building metering record: {str(e)}")
+                    self._failed += 1
+                    continue
+                if completion_args is not None:
+                    records.append((enqueued_at, completion_args))
+
+        if records:
+            for sink_queue in self._sink_queues:
+                sink_queue.offer(records)
+
+        for _, _, on_done in batch:
+            if on_done is not None:
+                on_done()
+        self._handled += len(batch)
+
+    def _maybe_report(self) -> None:
+        if self.report_interval_s is None:
+            return
+        now = time.monotonic()
+        if now - self._last_report < self.report_interval_s:
+            return
+        self._last_report = now
+        stats = self.stats()
+        if self.reporter is not None:
+            try:
+                self.reporter(stats)
+            except Exception as e:
+                logger.warning(f"Error in metering stats reporter: {str(e)}")
+            return
+        logger.info(
+            "Metering exporter: %d queued (oldest %.1fs), %d exported, %d retries, "
+            "%d failed, %d dropped, %d spooled, p99 latency %ss",
+            stats["queue_depth"], stats["oldest_queued_s"], stats["exported"],
+            stats["retries"], stats["failed"], stats["dropped"], stats["spooled"],
+            stats["export_latency_s"].get("p99", 0)
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report how metering keeps up with inference.
+
+        Returns:
+            Queue, record, byte and latency statistics; see the module
+            docstring
+        """
+        oldest = [sink_queue.oldest_enqueued_at() for sink_queue in self._sink_queues]
+        try:
+            oldest.append(self._queue[0][0])
+        except IndexError:
+            pass
+        oldest = [enqueued_at for enqueued_at in oldest if enqueued_at is not None]
+        sinks = {sink_queue.sink.name: sink_queue.stats() for sink_queue in self._sink_queues}
+
+        def total(key: str) -> int:
+            return sum(sink_stats[key] for sink_stats in sinks.values())
+
+        return {
+            "queue_depth": len(self._queue),
+            "oldest_queued_s": time.monotonic() - min(oldest) if oldest else 0.0,
+            "enqueued": int(self._enqueued.total()),
+            "exported": total("exported"),
+            "failed": self._failed + total("failed"),
+            "dropped": int(self._dropped.total()) + total("dropped"),
+            "retries": total("retries"),
+            "spooled": total("spooled"),
+            "spool_backlog": total("spool_backlog"),
+            "bytes_sent": total("bytes_sent"),
+            "batches": self._batches,
+            "export_latency_s": _percentiles(
+                EXPORT_LATENCY_BUCKETS,
+                [sink_queue.export_latency.collect().get(()) for sink_queue in self._sink_queues]
+            ),
+            "batch_size": _percentiles(BATCH_SIZE_BUCKETS, [self._batch_size.collect().get(())]),
+            "sinks": sinks,
+        }
+
+
+_exporter: Optional[MeteringExporter] = None
+
+
+def get_metering_exporter() -> Optional[MeteringExporter]:
+    """
+    Get the active metering exporter.
+
+    Returns:
+        The exporter, or None when each record is sent on its own thread
+    """
+    return _exporter
+
+
+def enable_metering_exporter(**options) -> MeteringExporter:
+    """
+    Export metering records through queued sinks.
+
+    Args:
+        **options: ``MeteringExporter`` options
+
+    Returns:
+        The active exporter
+    """
+    global _exporter
+    disable_metering_exporter()
+    _exporter = MeteringExporter(**options)
+    return _exporter
+
+
+def disable_metering_exporter() -> None:
+    """Export the queued records and go back to one thread per record."""
+    global _exporter
+    exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.stop()
+
+
+def metering_stats() -> Dict[str, Any]:
+    """
+    Get the active exporter's stats.
+
+    Returns:
+        The stats, empty when the metering exporter is disabled
+    """
+    exporter = _exporter
+    return exporter.stats() if exporter is not None else {}
+
+
+atexit.register(disable_metering_exporter)
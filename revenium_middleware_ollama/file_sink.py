@@ -0,0 +1,352 @@
+"""
+Local rotating file sink for metering records.
+
+For air-gapped deployments and local cost analytics, the metering exporter
+can write records to files instead of, or alongside, sending them to
+Revenium::
+
+    enable_metering_exporter(sinks=[FileSink("/var/lib/revenium")])
+
+Records are the ``create_completion`` arguments of each call. They are
+buffered and appended to a file in ``directory``, and a new file is started
+once the current one reaches ``max_bytes`` or ``rotate_interval_s``. Files
+are named ``<prefix>-<UTC time>-<pid>-<sequence>.<format>`` so several
+processes can share a directory.
+
+Two formats are supported:
+
+- ``jsonl``: one JSON object per line, readable by the replay tool
+- ``parquet``: columnar files for analytics, which need the optional
+  ``pyarrow`` package. Every file has one column per ``create_completion``
+  field; nested fields (``subscriber``, ``extra_body``) are stored as JSON
+  strings and other fields are dropped with a warning. A Parquet file is only readable once it has been
+  rotated or the sink closed.
+
+Batches of records holding exactly the record fields are written column by
+column in both formats, without a JSON encoder call per record.
+
+The sink runs on its own exporter worker thread, never on the request
+thread.
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from itertools import chain, repeat
+from json.encoder import encode_basestring_ascii
+from operator import itemgetter
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from .sinks import MeteringSink
+
+logger = logging.getLogger(__name__)
+
+FORMAT_JSONL = "jsonl"
+FORMAT_PARQUET = "parquet"
+
+DEFAULT_PREFIX = "metering"
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_ROTATE_INTERVAL_S = 3600.0
+DEFAULT_BUFFER_RECORDS = 1000
+
+# Parquet columns, in the order the middleware builds a record's
+# create_completion arguments
+RECORD_FIELDS = (
+    "cache_creation_token_count", "cache_read_token_count", "input_token_cost",
+    "output_token_cost", "total_cost", "output_token_count", "cost_type", "model",
+    "input_token_count", "provider", "model_source", "reasoning_token_count",
+    "request_time", "response_time", "completion_start_time", "request_duration",
+    "stop_reason", "total_token_count", "transaction_id", "trace_id", "task_type",
+    "subscriber", "organization_id", "subscription_id", "product_id", "agent",
+    "response_quality_score", "is_streamed", "middleware_source", "operation_type",
+    "environment", "region", "credential_alias", "trace_type", "trace_name",
+    "parent_transaction_id", "transaction_name", "retry_number", "extra_body",
+)
+
+# Parquet column types of the numeric and boolean record fields; all other
+# fields are stored as strings
+_INT_FIELDS = frozenset((
+    "cache_creation_token_count", "cache_read_token_count", "output_token_count",
+    "input_token_count", "reasoning_token_count", "request_duration",
+    "total_token_count", "retry_number",
+))
+_FLOAT_FIELDS = frozenset((
+    "input_token_cost", "output_token_cost", "total_cost", "response_quality_score",
+))
+_BOOL_FIELDS = frozenset(("is_streamed",))
+_TYPED_FIELDS = _INT_FIELDS | _FLOAT_FIELDS | _BOOL_FIELDS
+_RECORD_FIELD_SET = frozenset(RECORD_FIELDS)
+_record_values = itemgetter(*RECORD_FIELDS)
+
+# JSONL records with exactly the record fields are encoded column by column:
+# each field's key is encoded once, and each column with a single value
+# type is encoded with one call
+_JSONL_PREFIXES = tuple(
+    ("{" if index == 0 else ",") + encode_basestring_ascii(name) + ":"
+    for index, name in enumerate(RECORD_FIELDS)
+)
+_NONE_TYPE = type(None)
+
+
+def _encode_float(value: float) -> str:
+    # Same output as json.dumps, which allows NaN and infinities by default
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    return float.__repr__(value)
+
+
+_SCALAR_ENCODERS: Dict[type, Callable[[Any], str]] = {
+    str: encode_basestring_ascii,
+    int: int.__repr__,
+    float: _encode_float,
+    bool: lambda value: "true" if value else "false",
+    _NONE_TYPE: lambda value: "null",
+}
+# Nested values (subscriber, extra_body) repeat from record to record, so
+# the encodings of flat ones are cached
+_MAX_CACHED_ENCODINGS = 4096
+
+_file_sequence = 0
+_file_sequence_lock = threading.Lock()
+
+
+def _next_file_sequence() -> int:
+    global _file_sequence
+    with _file_sequence_lock:
+        _file_sequence += 1
+        return _file_sequence
+
+
+class FileSink(MeteringSink):
+    """
+    Appends metering records to rotating local files.
+
+    Args:
+        directory: Directory receiving the files, created if missing
+        format: ``jsonl`` or ``parquet``
+        prefix: File name prefix
+        max_bytes: Start a new file once the current one is about this big
+        rotate_interval_s: Start a new file once the current one is this old
+        buffer_records: Records buffered in memory before they are written
+        name: Name of the sink
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        format: str = FORMAT_JSONL,
+        prefix: str = DEFAULT_PREFIX,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        rotate_interval_s: float = DEFAULT_ROTATE_INTERVAL_S,
+        buffer_records: int = DEFAULT_BUFFER_RECORDS,
+        name: str = "file"
+    ):
+        if format not in (FORMAT_JSONL, FORMAT_PARQUET):
+            raise ValueError(f"Unknown file sink format: {format}")
+        if format == FORMAT_PARQUET:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ImportError(
+                    "Parquet output needs pyarrow: pip install revenium-middleware-ollama[parquet]"
+                ) from None
+        self.name = name
+        self.directory = directory
+        self.format = format
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.rotate_interval_s = rotate_interval_s
+        self.buffer_records = buffer_records
+        os.makedirs(directory, exist_ok=True)
+
+        self._encoder = json.JSONEncoder(default=str, separators=(",", ":"))
+        self._encoded: Dict[tuple, str] = {}
+        self._lock = threading.Lock()
+        self._buffer: List[Dict[str, Any]] = []
+        self._path: Optional[str] = None
+        self._file: Any = None
+        self._opened_at = 0.0
+        self._size = 0
+        # Parquet writer state of the current file
+        self._schema: Any = None
+        self._dropped_columns: set = set()
+
+    @property
+    def current_path(self) -> Optional[str]:
+        """Path of the file being written, if any."""
+        return self._path
+
+    def export(self, records: Sequence[Dict[str, Any]]) -> None:
+        self.write_batch(records)
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """Buffer one record."""
+        self.write_batch([record])
+
+    def write_batch(self, records: Sequence[Dict[str, Any]]) -> None:
+        """
+        Buffer records, writing the buffer out once it is full.
+
+        Args:
+            records: ``create_completion`` arguments of each record
+        """
+        with self._lock:
+            self._buffer.extend(records)
+            if len(self._buffer) >= self.buffer_records:
+                self._write_buffer()
+
+    def flush(self) -> None:
+        """Write the buffered records out."""
+        with self._lock:
+            self._write_buffer()
+
+    def close(self) -> None:
+        """Write the buffered records out and close the current file."""
+        with self._lock:
+            self._write_buffer()
+            self._close_file()
+
+    def _write_buffer(self) -> None:
+        # Called with the lock held
+        if not self._buffer:
+            if self._file is not None and self._rotation_due():
+                self._close_file()
+            return
+        records, self._buffer = self._buffer, []
+        if self._file is not None and self._rotation_due():
+            self._close_file()
+        if self._file is None:
+            self._open_file()
+        if self.format == FORMAT_JSONL:
+            self._write_jsonl(records)
+        else:
+            self._write_parquet(records)
+
+    def _rotation_due(self) -> bool:
+        return (
+            self._size >= self.max_bytes
+            or time.monotonic() - self._opened_at >= self.rotate_interval_s
+        )
+
+    def _open_file(self) -> None:
+        stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        name = f"{self.prefix}-{stamp}-{os.getpid()}-{_next_file_sequence():04d}.{self.format}"
+        self._path = os.path.join(self.directory, name)
+        self._opened_at = time.monotonic()
+        self._size = 0
+        if self.format == FORMAT_JSONL:
+            self._file = open(self._path, "a", encoding="utf-8")
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            if self._schema is None:
+                self._schema = pa.schema([(name, self._column_type(pa, name)) for name in RECORD_FIELDS])
+            self._file = pq.ParquetWriter(self._path, self._schema)
+            # Each file warns about the fields it drops
+            self._dropped_columns = set()
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            logger.debug("Closed metering file %s", self._path)
+        self._file = None
+        self._path = None
+
+    def _write_jsonl(self, records: List[Dict[str, Any]]) -> None:
+        rows = self._record_rows(records)
+        if rows is None:
+            encode = self._encoder.encode
+            data = "\n".join([encode(record) for record in records]) + "\n"
+        else:
+            # Key prefixes and encoded values are interleaved into one join
+            parts: List[Any] = []
+            for prefix, values in zip(_JSONL_PREFIXES, zip(*rows)):
+                parts.append(repeat(prefix))
+                parts.append(self._json_column(values))
+            parts.append(repeat("}\n"))
+            data = "".join(chain.from_iterable(zip(*parts)))
+        self._file.write(data)
+        self._file.flush()
+        # Characters, a close enough measure of size for rotation
+        self._size += len(data)
+
+    def _write_parquet(self, records: List[Dict[str, Any]]) -> None:
+        import pyarrow as pa
+
+        rows = self._record_rows(records)
+        if rows is None:
+            extra = set().union(*records) - _RECORD_FIELD_SET - self._dropped_columns
+            if extra:
+                logger.warning("Dropping fields missing from the Parquet schema: %s", sorted(extra))
+                self._dropped_columns.update(extra)
+            columns = [[record.get(name) for record in records] for name in RECORD_FIELDS]
+        else:
+            columns = [list(values) for values in zip(*rows)]
+        arrays = {}
+        for name, values in zip(RECORD_FIELDS, columns):
+            if name not in _TYPED_FIELDS and not {str, _NONE_TYPE}.issuperset(map(type, values)):
+                values = [
+                    value if value is None or type(value) is str else self._encode_value(value)
+                    for value in values
+                ]
+            arrays[name] = values
+        self._file.write_table(pa.Table.from_pydict(arrays, schema=self._schema))
+        self._size = os.path.getsize(self._path)
+
+    @staticmethod
+    def _record_rows(records: List[Dict[str, Any]]) -> Optional[List[tuple]]:
+        """Get each record's values in field order, if all have exactly the record fields."""
+        field_count = len(RECORD_FIELDS)
+        if any(len(record) != field_count for record in records):
+            return None
+        try:
+            return list(map(_record_values, records))
+        except KeyError:
+            return None
+
+    def _json_column(self, values: Sequence[Any]) -> List[str]:
+        types = set(map(type, values))
+        if len(types) == 1:
+            value_type = types.pop()
+            if value_type is _NONE_TYPE:
+                return ["null"] * len(values)
+            encode = _SCALAR_ENCODERS.get(value_type)
+            if encode is not None:
+                return list(map(encode, values))
+        elif types <= _SCALAR_ENCODERS.keys():
+            return [_SCALAR_ENCODERS[type(value)](value) for value in values]
+        return [self._encode_value(value) for value in values]
+
+    def _encode_value(self, value: Any) -> str:
+        if type(value) is not dict:
+            return self._encoder.encode(value)
+        # Value types are part of the key, so 1 and True aren't confused
+        key = (tuple(value.items()), tuple(map(type, value.values())))
+        try:
+            return self._encoded[key]
+        except KeyError:
+            encoded = self._encoder.encode(value)
+            if _SCALAR_ENCODERS.keys() >= set(key[1]) and all(type(name) is str for name in value):
+                if len(self._encoded) >= _MAX_CACHED_ENCODINGS:
+                    self._encoded.clear()
+                self._encoded[key] = encoded
+            return encoded
+        except TypeError:
+            # Unhashable nested values
+            return self._encoder.encode(value)
+
+    @staticmethod
+    def _column_type(pa, name: str) -> Any:
+        if name in _INT_FIELDS:
+            return pa.int64()
+        if name in _FLOAT_FIELDS:
+            return pa.float64()
+        if name in _BOOL_FIELDS:
+            return pa.bool_()
+        return pa.string()
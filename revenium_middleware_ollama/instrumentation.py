@@ -0,0 +1,235 @@
+"""
+Patching of ollama functions and clients.
+
+By default, importing this package instruments ``ollama.chat``,
+``ollama.generate`` and ``ollama.embed`` as soon as ``ollama`` is imported.
+Set ``REVENIUM_AUTO_INSTRUMENT=false`` to disable that and call
+``instrument()`` explicitly.
+
+``uninstrument()`` restores the original functions, so uninstrumented calls
+have no overhead at all. Metering can also be scoped:
+
+- ``instrument(clients=True)`` meters every ``ollama.Client`` instance, and
+  ``instrument_client()`` meters a single one;
+- ``uninstrument_client()`` opts a client out by binding the original methods
+  on the instance;
+- ``with suppress_metering():`` skips metering for calls made in a block,
+  e.g. health checks.
+
+Callers that kept a reference to a function (``from ollama import chat``)
+keep the object they imported; look functions up on the module to follow
+``instrument()``/``uninstrument()``.
+"""
+
+import contextlib
+import contextvars
+import logging
+import os
+import sys
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import wrapt
+
+logger = logging.getLogger(__name__)
+
+# Environment variable names
+ENV_REVENIUM_AUTO_INSTRUMENT = "REVENIUM_AUTO_INSTRUMENT"
+
+ENDPOINTS = ("chat", "generate", "embed")
+
+_suppressed: "contextvars.ContextVar[bool]" = contextvars.ContextVar(
+    "revenium_ollama_metering_suppressed", default=False
+)
+
+_instrumented = os.getenv(ENV_REVENIUM_AUTO_INSTRUMENT, "true").lower() != "false"
+_instrument_clients = False
+# Original objects replaced by patching, keyed by (owner, name)
+_originals: Dict[Any, Any] = {}
+
+
+def _wrappers() -> Dict[str, Callable]:
+    from .middleware import chat_wrapper, embed_wrapper, generate_wrapper
+    return {"chat": chat_wrapper, "generate": generate_wrapper, "embed": embed_wrapper}
+
+
+def _features() -> Dict[str, Any]:
+    from . import (
+        cache, chunk_merging, coalesce, concurrency, embed_batcher, exporter,
+        keep_alive, metrics, profiling, ratelimit, routing, token_estimator
+    )
+    return {
+        "metrics": (metrics.enable_metrics, metrics.disable_metrics),
+        "response_cache": (cache.enable_response_cache, cache.disable_response_cache),
+        "request_coalescing": (
+            coalesce.enable_request_coalescing, coalesce.disable_request_coalescing
+        ),
+        "embed_batching": (
+            embed_batcher.enable_embed_batching, embed_batcher.disable_embed_batching
+        ),
+        "host_routing": (routing.enable_host_routing, routing.disable_host_routing),
+        "concurrency_limit": (
+            concurrency.enable_concurrency_limit, concurrency.disable_concurrency_limit
+        ),
+        "rate_limit": (ratelimit.enable_rate_limit, ratelimit.disable_rate_limit),
+        "keep_alive_management": (
+            keep_alive.enable_keep_alive_management, keep_alive.disable_keep_alive_management
+        ),
+        "token_estimation": (
+            token_estimator.enable_token_estimation, token_estimator.disable_token_estimation
+        ),
+        "chunk_merging": (
+            chunk_merging.enable_chunk_merging, chunk_merging.disable_chunk_merging
+        ),
+        "stage_profiling": (
+            profiling.enable_stage_profiling, profiling.disable_stage_profiling
+        ),
+        "metering_exporter": (
+            exporter.enable_metering_exporter, exporter.disable_metering_exporter
+        ),
+    }
+
+
+def _patch(owner: Any) -> None:
+    for name, wrapper in _wrappers().items():
+        key = (owner, name)
+        if key in _originals:
+            continue
+        original = vars(owner)[name] if isinstance(owner, type) else getattr(owner, name)
+        _originals[key] = original
+        setattr(owner, name, wrapt.FunctionWrapper(original, wrapper))
+
+
+def _unpatch(owner: Any) -> None:
+    for name in ENDPOINTS:
+        original = _originals.pop((owner, name), None)
+        if original is not None:
+            setattr(owner, name, original)
+
+
+def _apply(module: Any) -> None:
+    _patch(module)
+    if _instrument_clients:
+        _patch(module.Client)
+    else:
+        _unpatch(module.Client)
+
+
+def _on_ollama_import(module):
+    if _instrumented:
+        _apply(module)
+
+
+def install_import_hook() -> None:
+    """
+    Instrument ollama once it is imported.
+
+    Runs the hook immediately if ollama is already imported.
+    """
+    wrapt.register_post_import_hook(_on_ollama_import, "ollama")
+
+
+def instrument(config: Optional[Dict[str, Any]] = None, clients: bool = False) -> None:
+    """
+    Meter ollama calls and configure middleware features.
+
+    Args:
+        config: Features to enable, keyed by name (``metrics``,
+            ``response_cache``, ``request_coalescing``, ``embed_batching``,
+            ``host_routing``, ``concurrency_limit``, ``rate_limit``,
+            ``keep_alive_management``, ``token_estimation``,
+            ``chunk_merging``, ``stage_profiling``, ``metering_exporter``).
+            A value of True enables a feature with its defaults, a dict
+            passes options to its ``enable_*`` function and False disables
+            it.
+        clients: Also meter every ``ollama.Client`` instance
+    """
+    global _instrumented, _instrument_clients
+    features = _features()
+    for name, options in (config or {}).items():
+        if name not in features:
+            raise ValueError(f"Unknown feature: {name}")
+        enable, disable = features[name]
+        if options is False:
+            disable()
+        elif isinstance(options, dict):
+            enable(**options)
+        else:
+            enable()
+
+    _instrumented = True
+    _instrument_clients = clients
+    module = sys.modules.get("ollama")
+    if module is not None:
+        _apply(module)
+
+
+def uninstrument() -> None:
+    """Restore the original ollama functions and client methods."""
+    global _instrumented, _instrument_clients
+    _instrumented = _instrument_clients = False
+    module = sys.modules.get("ollama")
+    if module is not None:
+        _unpatch(module)
+        _unpatch(module.Client)
+
+
+def is_instrumented() -> bool:
+    """Check whether ollama calls are metered."""
+    return _instrumented
+
+
+def _original_method(client: Any, name: str) -> Callable:
+    for owner in type(client).__mro__:
+        if name in vars(owner):
+            # Class-level patching wraps the function; bind the original instead
+            function = _originals.get((owner, name), vars(owner)[name])
+            return function.__get__(client, type(client))
+    raise AttributeError(name)
+
+
+def instrument_client(client: Any) -> Any:
+    """
+    Meter the calls of a single ``ollama.Client``.
+
+    Args:
+        client: The client to meter
+
+    Returns:
+        The client
+    """
+    for name, wrapper in _wrappers().items():
+        setattr(client, name, wrapt.FunctionWrapper(_original_method(client, name), wrapper))
+    return client
+
+
+def uninstrument_client(client: Any) -> Any:
+    """
+    Opt a single ``ollama.Client`` out of metering.
+
+    The original methods are bound on the instance, so its calls have no
+    metering overhead even when every client is instrumented.
+
+    Args:
+        client: The client to opt out
+
+    Returns:
+        The client
+    """
+    for name in ENDPOINTS:
+        setattr(client, name, _original_method(client, name))
+    return client
+
+
+@contextlib.contextmanager
+def suppress_metering() -> Iterator[None]:
+    """Skip metering for ollama calls made in this block."""
+    token = _suppressed.set(True)
+    try:
+        yield
+    finally:
+        _suppressed.reset(token)
+
+
+def metering_suppressed() -> bool:
+    """Check whether metering is suppressed for the current context."""
+    return _suppressed.get()
@@ -0,0 +1,291 @@
+"""
+Model warm-up and keep_alive management driven by observed traffic.
+
+Ollama unloads a model once it has been idle for its ``keep_alive`` period
+(five minutes by default), and the next call pays the cold load reported as
+``load_duration``. When the manager is enabled, it tracks the request rate of
+every model seen by the middleware and:
+
+- sets a ``keep_alive`` hint on calls that don't pass one: a long period for
+  hot models so they stay resident, a short one for rarely used models so
+  they free VRAM soon after use;
+- optionally runs a background thread that checks which models Ollama has
+  loaded (``ollama.ps()``) and pre-warms hot models that were evicted with an
+  empty ``generate`` call, which loads the model without generating tokens.
+
+Warm-up calls go to the unwrapped Ollama client and are not metered.
+"""
+
+import logging
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from .routing import get_host_router
+
+logger = logging.getLogger(__name__)
+
+KeepAlive = Union[str, float]
+
+DEFAULT_WINDOW_SECONDS = 600.0
+DEFAULT_HOT_REQUESTS_PER_MINUTE = 6.0
+DEFAULT_COLD_REQUESTS_PER_MINUTE = 0.2
+DEFAULT_HOT_KEEP_ALIVE = "30m"
+DEFAULT_COLD_KEEP_ALIVE = "1m"
+DEFAULT_WARM_INTERVAL_SECONDS = 30.0
+
+# Position of keep_alive in ollama.embed(model, input, truncate, options, keep_alive)
+EMBED_KEEP_ALIVE_POSITION = 4
+
+
+def normalize_model_name(model: str) -> str:
+    """
+    Normalize a model name the way Ollama reports loaded models.
+
+    Args:
+        model: Model name as passed to a call, e.g. ``llama3.2``
+
+    Returns:
+        The name with an explicit tag, e.g. ``llama3.2:latest``
+    """
+    return model if ":" in model else f"{model}:latest"
+
+
+class _Rate:
+    """Exponentially decayed request count, O(1) per model."""
+
+    __slots__ = ("value", "updated")
+
+    def __init__(self, now: float):
+        self.value = 0.0
+        self.updated = now
+
+    def decay(self, now: float, window_s: float) -> float:
+        self.value *= math.exp(-(now - self.updated) / window_s)
+        self.updated = now
+        return self.value
+
+
+class KeepAliveManager:
+    """
+    Tracks per-model request rates and keeps hot models loaded.
+
+    Args:
+        window_s: Time constant of the request rate average
+        hot_requests_per_minute: Rate at or above which a model is hot
+        cold_requests_per_minute: Rate below which a model is rarely used
+        hot_keep_alive: ``keep_alive`` set on calls for hot models
+        cold_keep_alive: ``keep_alive`` set on calls for rarely used models;
+            models in between keep Ollama's default
+        warm_interval_s: How often the background thread checks loaded
+            models, None to never pre-warm
+        warm: Function called as ``warm(model, keep_alive)`` to load a model,
+            defaults to an empty generate call
+        loaded_models: Function returning the names of loaded models,
+            defaults to ``ollama.ps()``
+    """
+
+    def __init__(
+        self,
+        window_s: float = DEFAULT_WINDOW_SECONDS,
+        hot_requests_per_minute: float = DEFAULT_HOT_REQUESTS_PER_MINUTE,
+        cold_requests_per_minute: float = DEFAULT_COLD_REQUESTS_PER_MINUTE,
+        hot_keep_alive: Optional[KeepAlive] = DEFAULT_HOT_KEEP_ALIVE,
+        cold_keep_alive: Optional[KeepAlive] = DEFAULT_COLD_KEEP_ALIVE,
+        warm_interval_s: Optional[float] = DEFAULT_WARM_INTERVAL_SECONDS,
+        warm: Optional[Callable[[str, Optional[KeepAlive]], Any]] = None,
+        loaded_models: Optional[Callable[[], Iterable[str]]] = None
+    ):
+        self.window_s = window_s
+        self.hot_requests_per_minute = hot_requests_per_minute
+        self.cold_requests_per_minute = cold_requests_per_minute
+        self.hot_keep_alive = hot_keep_alive
+        self.cold_keep_alive = cold_keep_alive
+        self.warm_interval_s = warm_interval_s
+        self._warm = warm or _warm_model
+        self._loaded_models = loaded_models or _loaded_models
+        self._rates: Dict[str, _Rate] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, model: str) -> None:
+        """Record a call for a model."""
+        if not model:
+            return
+        now = time.monotonic()
+        with self._lock:
+            rate = self._rates.get(model)
+            if rate is None:
+                rate = self._rates[model] = _Rate(now)
+            rate.decay(now, self.window_s)
+            rate.value += 1
+
+    def requests_per_minute(self, model: str) -> float:
+        """
+        Get the recent request rate of a model.
+
+        Returns:
+            Requests per minute, averaged over ``window_s``
+        """
+        with self._lock:
+            rate = self._rates.get(model)
+            if rate is None:
+                return 0.0
+            return rate.decay(time.monotonic(), self.window_s) * 60 / self.window_s
+
+    def keep_alive_for(self, model: str) -> Optional[KeepAlive]:
+        """
+        Get the ``keep_alive`` hint for a call.
+
+        Returns:
+            The hint, or None to keep Ollama's default
+        """
+        rate = self.requests_per_minute(model)
+        if rate >= self.hot_requests_per_minute:
+            return self.hot_keep_alive
+        if rate < self.cold_requests_per_minute:
+            return self.cold_keep_alive
+        return None
+
+    def apply(self, endpoint: str, args: tuple, kwargs: Dict[str, Any], model: str) -> None:
+        """
+        Record a call and set its ``keep_alive`` hint unless the caller set one.
+
+        Args:
+            endpoint: The endpoint being called
+            args: Positional arguments of the call
+            kwargs: Keyword arguments of the call, updated in place
+            model: Model the call is made for
+        """
+        self.record(model)
+        if kwargs.get("keep_alive") is not None:
+            return
+        if endpoint == "embed" and len(args) > EMBED_KEEP_ALIVE_POSITION:
+            return
+        keep_alive = self.keep_alive_for(model)
+        if keep_alive is not None:
+            kwargs["keep_alive"] = keep_alive
+
+    def hot_models(self) -> List[str]:
+        """Get the models whose request rate makes them hot."""
+        with self._lock:
+            models = list(self._rates)
+        return [
+            model for model in models
+            if self.requests_per_minute(model) >= self.hot_requests_per_minute
+        ]
+
+    def warm_evicted(self) -> List[str]:
+        """
+        Pre-warm hot models that Ollama doesn't have loaded.
+
+        Returns:
+            The models that were warmed
+        """
+        hot = self.hot_models()
+        if not hot:
+            return []
+        try:
+            loaded = {normalize_model_name(name) for name in self._loaded_models()}
+        except Exception as e:
+            logger.debug("Could not list loaded Ollama models: %s", str(e))
+            return []
+        warmed = []
+        for model in hot:
+            if normalize_model_name(model) in loaded:
+                continue
+            logger.debug("Pre-warming evicted Ollama model %s", model)
+            try:
+                self._warm(model, self.hot_keep_alive)
+                warmed.append(model)
+            except Exception as e:
+                logger.warning(f"Error pre-warming Ollama model {model}: {str(e)}")
+        return warmed
+
+    def start(self) -> None:
+        """Start the background pre-warm thread."""
+        if self.warm_interval_s is None or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="revenium-ollama-keep-alive", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background pre-warm thread."""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.warm_interval_s):
+            self.warm_evicted()
+
+
+def _unwrapped(function):
+    # Warm-up calls must not be metered
+    return getattr(function, "__wrapped__", function)
+
+
+def _warm_model(model: str, keep_alive: Optional[KeepAlive]) -> None:
+    router = get_host_router()
+    if router is not None:
+        router.select(model).client.generate(model=model, prompt="", keep_alive=keep_alive)
+        return
+    import ollama
+    _unwrapped(ollama.generate)(model=model, prompt="", keep_alive=keep_alive)
+
+
+def _loaded_models() -> List[str]:
+    router = get_host_router()
+    if router is not None:
+        # A model counts as loaded if any host in the pool has it
+        return [
+            model.model or model.name or ""
+            for host in router.hosts
+            for model in host.client.ps().models
+        ]
+    import ollama
+    return [model.model or model.name or "" for model in ollama.ps().models]
+
+
+_manager: Optional[KeepAliveManager] = None
+
+
+def get_keep_alive_manager() -> Optional[KeepAliveManager]:
+    """
+    Get the active keep_alive manager.
+
+    Returns:
+        The manager, or None when keep_alive management is disabled
+    """
+    return _manager
+
+
+def enable_keep_alive_management(**options) -> KeepAliveManager:
+    """
+    Manage model ``keep_alive`` and pre-warming based on observed traffic.
+
+    Args:
+        **options: Options passed to ``KeepAliveManager``
+
+    Returns:
+        The active manager
+    """
+    global _manager
+    disable_keep_alive_management()
+    _manager = KeepAliveManager(**options)
+    _manager.start()
+    return _manager
+
+
+def disable_keep_alive_management() -> None:
+    """Stop managing keep_alive and pre-warming models."""
+    global _manager
+    manager, _manager = _manager, None
+    if manager is not None:
+        manager.stop()
@@ -0,0 +1,500 @@
+"""
+In-process metrics for metered Ollama calls.
+
+This module provides an optional metrics registry that records token
+throughput, request latency, time to first token, cold model loads and the
+metering queue depth for every call that passes through the middleware.
+Metrics are labeled by model and operation type and can be rendered in the
+Prometheus text exposition format, either directly with ``render_metrics()``
+or over HTTP with ``start_metrics_server()``.
+
+Recording is lock-free on the hot path: every thread writes to its own shard
+and shards are only merged when the registry is scraped.
+"""
+
+import bisect
+import logging
+import os
+import threading
+import weakref
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Environment variable names
+ENV_REVENIUM_METRICS_ENABLED = "REVENIUM_METRICS_ENABLED"
+ENV_REVENIUM_COLD_LOAD_THRESHOLD_MS = "REVENIUM_COLD_LOAD_THRESHOLD_MS"
+ENV_REVENIUM_METRICS_ADDR = "REVENIUM_METRICS_ADDR"
+
+# Metrics are only reachable from this host unless a wider address is set
+DEFAULT_METRICS_ADDR = "127.0.0.1"
+
+# Prometheus text exposition format version 0.0.4
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TTFT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUEUE_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+# Ollama reports load_duration on every call; only slow loads are cold starts
+DEFAULT_COLD_LOAD_THRESHOLD_MS = 500
+
+LABEL_NAMES = ("model", "operation_type")
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape_label_value(str(value))}"'
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _ShardedMetric:
+    """
+    Base class for metrics whose values are sharded per thread.
+
+    Each thread owns a private dict mapping label values to its local value,
+    so writers never contend. Shards of finished threads are folded into a
+    retired total at scrape time to keep memory bounded.
+    """
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = LABEL_NAMES):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[Any, Dict[LabelValues, Any]]] = []
+        self._retired: Dict[LabelValues, Any] = {}
+
+    def _shard(self) -> Dict[LabelValues, Any]:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard: Dict[LabelValues, Any] = {}
+            with self._lock:
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+            self._local.shard = shard
+            return shard
+
+    def _merge(self, into: Dict[LabelValues, Any], key: LabelValues, value: Any) -> None:
+        raise NotImplementedError
+
+    def collect(self) -> Dict[LabelValues, Any]:
+        """Merge all shards and return a snapshot keyed by label values."""
+        merged: Dict[LabelValues, Any] = {}
+        with self._lock:
+            live = []
+            for thread_ref, shard in self._shards:
+                values = shard.copy()
+                thread = thread_ref()
+                if thread is None or not thread.is_alive():
+                    for key, value in values.items():
+                        self._merge(self._retired, key, value)
+                    continue
+                live.append((thread_ref, shard))
+                for key, value in values.items():
+                    self._merge(merged, key, value)
+            self._shards = live
+            for key, value in self._retired.items():
+                self._merge(merged, key, value)
+        return merged
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self._render_samples(self.collect()))
+        return lines
+
+    def _render_samples(self, snapshot: Dict[LabelValues, Any]) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_ShardedMetric):
+    """Monotonic counter labeled by model and operation type."""
+
+    type_name = "counter"
+
+    def inc(self, labels: LabelValues, amount: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, into, key, value):
+        into[key] = into.get(key, 0) + value
+
+    def total(self) -> float:
+        return sum(self.collect().values())
+
+    def _render_samples(self, snapshot):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(snapshot.items())
+        ]
+
+
+class Histogram(_ShardedMetric):
+    """
+    Fixed-bucket histogram labeled by model and operation type.
+
+    Per label set, a shard holds one count per bucket (plus +Inf) followed
+    by the running sum of observed values.
+    """
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        buckets: Sequence[float],
+        labelnames: Sequence[str] = LABEL_NAMES
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, labels: LabelValues, value: float) -> None:
+        shard = self._shard()
+        entry = shard.get(labels)
+        if entry is None:
+            entry = shard[labels] = [0] * (len(self.buckets) + 2)
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def _merge(self, into, key, value):
+        existing = into.get(key)
+        if existing is None:
+            into[key] = list(value)
+        else:
+            for index, item in enumerate(value):
+                existing[index] += item
+
+    def _render_samples(self, snapshot):
+        lines = []
+        bounds = self.buckets + (float("inf"),)
+        for key, entry in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, entry):
+                cumulative += count
+                labels = _format_labels(
+                    self.labelnames + ("le",), key + (_format_value(bound),)
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(entry[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def bucket_quantile(buckets: Sequence[float], entry: Sequence[float], quantile: float) -> float:
+    """
+    Estimate a quantile from a histogram entry.
+
+    Args:
+        buckets: The histogram's bucket upper bounds
+        entry: Per-bucket counts (plus +Inf), as collected from a histogram
+        quantile: Quantile to estimate, from 0 to 1
+
+    Returns:
+        The upper bound of the bucket the quantile falls in
+    """
+    bounds = tuple(buckets) + (float("inf"),)
+    count = sum(entry[:len(bounds)])
+    cumulative = 0
+    for bound, bucket_count in zip(bounds, entry):
+        cumulative += bucket_count
+        if cumulative >= quantile * count:
+            return bound
+    return bounds[-1]
+
+
+class GaugeFunc:
+    """Unlabeled gauge whose value is computed at scrape time."""
+
+    def __init__(self, name: str, help_text: str, func: Callable[[], float]):
+        self.name = name
+        self.help_text = help_text
+        self._func = func
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {_format_value(self._func())}",
+        ]
+
+
+class MetricsRegistry:
+    """
+    Registry holding all middleware metrics.
+
+    Args:
+        cold_load_threshold_ms: ``load_duration`` above which a call counts
+            as a cold model load
+    """
+
+    def __init__(self, cold_load_threshold_ms: Optional[float] = None):
+        if cold_load_threshold_ms is None:
+            cold_load_threshold_ms = env_float(
+                ENV_REVENIUM_COLD_LOAD_THRESHOLD_MS, DEFAULT_COLD_LOAD_THRESHOLD_MS
+            )
+        self.cold_load_threshold_ns = cold_load_threshold_ms * 1_000_000
+
+        self.requests = Counter(
+            "revenium_ollama_requests_total",
+            "Metered Ollama requests."
+        )
+        self.input_tokens = Counter(
+            "revenium_ollama_input_tokens_total",
+            "Prompt tokens evaluated by Ollama."
+        )
+        self.output_tokens = Counter(
+            "revenium_ollama_output_tokens_total",
+            "Completion tokens generated by Ollama."
+        )
+        self.cache_hits = Counter(
+            "revenium_ollama_cache_hits_total",
+            "Requests served from the response cache."
+        )
+        self.coalesced_requests = Counter(
+            "revenium_ollama_coalesced_requests_total",
+            "Requests that shared another caller's in-flight generation."
+        )
+        self.cold_loads = Counter(
+            "revenium_ollama_cold_loads_total",
+            "Requests that had to load the model into memory."
+        )
+        self.request_duration = Histogram(
+            "revenium_ollama_request_duration_seconds",
+            "End-to-end request latency as seen by the caller.",
+            LATENCY_BUCKETS
+        )
+        self.time_to_first_token = Histogram(
+            "revenium_ollama_time_to_first_token_seconds",
+            "Latency until the first streamed chunk arrived.",
+            TTFT_BUCKETS
+        )
+        self._metering_enqueued = Counter(
+            "revenium_ollama_metering_enqueued_total",
+            "Metering records handed to the exporter.",
+            labelnames=()
+        )
+        self._metering_completed = Counter(
+            "revenium_ollama_metering_completed_total",
+            "Metering records the exporter finished with.",
+            labelnames=()
+        )
+        self.queue_wait = Histogram(
+            "revenium_ollama_queue_wait_seconds",
+            "Time spent waiting for a concurrency slot before reaching Ollama.",
+            QUEUE_WAIT_BUCKETS
+        )
+        self.metering_queue_depth = GaugeFunc(
+            "revenium_ollama_metering_queue_depth",
+            "Metering records waiting to be exported.",
+            self.queue_depth
+        )
+
+    def observe_response(
+        self,
+        model: str,
+        operation_type: str,
+        input_tokens: int,
+        output_tokens: int,
+        duration_s: float,
+        load_duration_ns: Optional[int] = None,
+        time_to_first_token_s: Optional[float] = None,
+        cache_hit: bool = False,
+        coalesced: bool = False,
+        queue_wait_s: Optional[float] = None
+    ) -> None:
+        """Record a completed Ollama call."""
+        labels = (model, operation_type)
+        self.requests.inc(labels)
+        if cache_hit:
+            self.cache_hits.inc(labels)
+        if coalesced:
+            self.coalesced_requests.inc(labels)
+        if queue_wait_s is not None:
+            self.queue_wait.observe(labels, queue_wait_s)
+        if input_tokens:
+            self.input_tokens.inc(labels, input_tokens)
+        if output_tokens:
+            self.output_tokens.inc(labels, output_tokens)
+        self.request_duration.observe(labels, duration_s)
+        if time_to_first_token_s is not None:
+            self.time_to_first_token.observe(labels, time_to_first_token_s)
+        if load_duration_ns and load_duration_ns >= self.cold_load_threshold_ns:
+            self.cold_loads.inc(labels)
+
+    def metering_enqueued(self) -> None:
+        self._metering_enqueued.inc(())
+
+    def metering_completed(self) -> None:
+        self._metering_completed.inc(())
+
+    def queue_depth(self) -> float:
+        return max(self._metering_enqueued.total() - self._metering_completed.total(), 0)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        for metric in (
+            self.requests,
+            self.input_tokens,
+            self.output_tokens,
+            self.cache_hits,
+            self.coalesced_requests,
+            self.cold_loads,
+            self.request_duration,
+            self.time_to_first_token,
+            self.queue_wait,
+            self.metering_queue_depth,
+        ):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def env_float(name: str, default: float) -> float:
+    """
+    Read a float from an environment variable.
+
+    Args:
+        name: Environment variable name
+        default: Value used when the variable is unset or not a number
+
+    Returns:
+        The variable's value, or the default
+    """
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        logger.warning(f"Invalid {name} value, defaulting to {default}")
+        return default
+
+
+_registry: Optional[MetricsRegistry] = None
+
+
+def get_metrics_registry() -> Optional[MetricsRegistry]:
+    """
+    Get the active metrics registry.
+
+    Returns:
+        The registry, or None when metrics are disabled
+    """
+    return _registry
+
+
+def enable_metrics(cold_load_threshold_ms: Optional[float] = None) -> MetricsRegistry:
+    """
+    Enable metrics recording for all metered calls.
+
+    Calling this again returns the already active registry.
+
+    Args:
+        cold_load_threshold_ms: Override for the cold load threshold
+
+    Returns:
+        The active registry
+    """
+    global _registry
+    if _registry is None:
+        _registry = MetricsRegistry(cold_load_threshold_ms)
+    return _registry
+
+
+def disable_metrics() -> None:
+    """Stop recording metrics and drop the active registry."""
+    global _registry
+    _registry = None
+
+
+def render_metrics() -> str:
+    """
+    Render the active registry in the Prometheus text exposition format.
+
+    Returns:
+        Exposition text, empty when metrics are disabled
+    """
+    registry = _registry
+    return registry.render() if registry is not None else ""
+
+
+def start_metrics_server(
+    port: int = 9464,
+    addr: Optional[str] = None,
+    registry: Optional[MetricsRegistry] = None
+) -> "ThreadingHTTPServer":
+    """
+    Serve metrics over HTTP on a daemon thread.
+
+    Enables metrics if they are not enabled yet. The endpoint answers
+    ``GET /metrics``.
+
+    Args:
+        port: Port to listen on (0 picks a free port)
+        addr: Address to bind, defaults to ``REVENIUM_METRICS_ADDR`` or
+            ``127.0.0.1``; pass ``"0.0.0.0"`` to serve other hosts
+        registry: Registry to serve, defaults to the active one
+
+    Returns:
+        The running server; call ``shutdown()`` to stop it
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    registry = registry or enable_metrics()
+    if addr is None:
+        addr = os.getenv(ENV_REVENIUM_METRICS_ADDR) or DEFAULT_METRICS_ADDR
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("Metrics request: " + format, *args)
+
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(
+        target=server.serve_forever, name="revenium-metrics", daemon=True
+    )
+    thread.start()
+    logger.debug("Metrics server listening on %s:%d", addr, server.server_address[1])
+    return server
+
+
+if os.getenv(ENV_REVENIUM_METRICS_ENABLED, "").lower() in ("1", "true", "yes"):
+    enable_metrics()
@@ -1,11 +1,12 @@
 import logging
 import datetime
-import wrapt
+import sys
 import types
+import itertools
+import time
 
 logger = logging.getLogger("revenium_middleware.extension")
 
-from revenium_middleware import client, run_async_in_thread, shutdown_event
 from .trace_fields import (
     get_environment,
     get_region,
@@ -17,6 +18,53 @@ from .trace_fields import (
     get_retry_number,
     detect_operation_type
 )
+from .metrics import get_metrics_registry
+from .otel import activate_span, deactivate_span, emit_span, fail_span, start_span
+from .cache import get_response_cache
+from .coalesce import get_request_coalescer, copy_response
+from .embed_batcher import get_embed_batcher
+from .routing import get_host_router, request_model
+from .concurrency import get_concurrency_limiter
+from .ratelimit import get_rate_limiter
+from .keep_alive import get_keep_alive_manager
+from .context import RequestContext
+from .chunk_merging import get_chunk_merger
+from .instrumentation import metering_suppressed
+from .token_estimator import get_token_estimator, fallback_estimator, estimate_completion_tokens
+from .profiling import start_stage_timer, NULL_TIMER
+from .exporter import get_metering_exporter
+
+# The Revenium client and its exporter threads are created on the first
+# metered call, not at import; see _load_metering()
+client = None
+run_async_in_thread = None
+shutdown_event = None
+
+# Disambiguates transaction IDs of calls made within the same microsecond
+_transaction_sequence = itertools.count()
+
+# Map Ollama's done_reason to Revenium stop reasons
+FINISH_REASON_MAP = {
+    "stop": "END",
+    "length": "TOKEN_LIMIT",
+    "error": "ERROR",
+    "cancelled": "CANCELLED",  # British spelling
+    "canceled": "CANCELLED",   # American spelling (Go standard library uses this)
+    "tool_calls": "END_SEQUENCE"
+}
+
+
+def _load_metering():
+    """Import revenium_middleware on first use, keeping any names already set."""
+    global client, run_async_in_thread, shutdown_event
+    if client is None or run_async_in_thread is None or shutdown_event is None:
+        import revenium_middleware
+        if client is None:
+            client = revenium_middleware.client
+        if run_async_in_thread is None:
+            run_async_in_thread = revenium_middleware.run_async_in_thread
+        if shutdown_event is None:
+            shutdown_event = revenium_middleware.shutdown_event
 
 
 def add_transaction_id_to_response(response, transaction_id):
@@ -46,98 +94,260 @@ def add_transaction_id_to_response(response, transaction_id):
         )
 
 
-@wrapt.patch_function_wrapper('ollama', 'chat')
-def chat_wrapper(wrapped, _, args, kwargs):
+def chat_wrapper(wrapped, instance, args, kwargs):
     """
     Wraps the ollama.chat method to log token usage.
     Handles both streaming and non-streaming responses.
     """
-    logger.debug("Ollama chat wrapper called")
-    usage_metadata = kwargs.pop("usage_metadata", {}) if "usage_metadata" in kwargs else {}
-    is_streaming = kwargs.get("stream", False)
+    return _metered_call(wrapped, args, kwargs, 'chat', instance)
 
-    # If streaming is enabled, add stream_options to include usage information
-    # if is_streaming and "stream_options" not in kwargs:
-    #     kwargs["stream_options"] = {"include_usage": True}
-    # elif is_streaming and isinstance(kwargs.get("stream_options"), dict):
-    #     kwargs["stream_options"]["include_usage"] = True
 
-    request_time_dt = datetime.datetime.now(datetime.timezone.utc)
-    # Generate transaction ID using the same timestamp for consistency
-    transaction_id = f"ollama-{request_time_dt.timestamp()}"
+def generate_wrapper(wrapped, instance, args, kwargs):
+    """
+    Wraps the ollama.generate method to log token usage.
+    Handles both streaming and non-streaming responses.
+    """
+    # Note: ollama.generate() doesn't support stream_options parameter
+    # Token usage is included by default in the final chunk
+    return _metered_call(wrapped, args, kwargs, 'generate', instance)
 
-    logger.debug(f"Calling chat function with args: {args}, kwargs: {kwargs}")
 
-    response = wrapped(*args, **kwargs)
+def embed_wrapper(wrapped, instance, args, kwargs):
+    """
+    Wraps the ollama.embed method to log token usage.
+    Embed calls are only metered while embed batching is enabled.
+    """
+    if get_embed_batcher() is None:
+        return wrapped(*args, **kwargs)
+    return _metered_call(wrapped, args, kwargs, 'embed', instance)
 
-    # Check if response is a generator (streaming response)
-    if is_streaming and isinstance(response, types.GeneratorType):
-        return handle_streaming_response(
-            response, request_time_dt, usage_metadata,
-            transaction_id, 'chat', kwargs
-        )
-    else:
-        # Handle non-streaming response
-        logger.debug("Ollama chat response: %s", response)
 
-        # Add transaction ID to response object
-        add_transaction_id_to_response(response, transaction_id)
+def bound_client_host(instance):
+    """
+    Get the host of the ``ollama.Client`` a call was made through.
 
-        handle_response(
-            response, request_time_dt, usage_metadata,
-            False, transaction_id, 'chat', kwargs
-        )
-        return response
+    Args:
+        instance: The object the wrapped method is bound to
 
+    Returns:
+        The client's base URL, or None for the module-level functions
+        (``ollama.chat`` etc.), which go through ollama's default client
+    """
+    if instance is None:
+        return None
+    ollama_module = sys.modules.get("ollama")
+    if instance is getattr(ollama_module, "_client", None):
+        return None
+    base_url = getattr(getattr(instance, "_client", None), "base_url", None)
+    return str(base_url) if base_url is not None else f"client-{id(instance)}"
 
-@wrapt.patch_function_wrapper('ollama', 'generate')
-def generate_wrapper(wrapped, _, args, kwargs):
+
+def _metered_call(wrapped, args, kwargs, endpoint, instance=None):
     """
-    Wraps the ollama.generate method to log token usage.
-    Handles both streaming and non-streaming responses.
+    Call a wrapped Ollama function and meter its response.
+
+    Args:
+        wrapped: The original Ollama function
+        args: Positional arguments of the call
+        kwargs: Keyword arguments of the call
+        endpoint: The endpoint being called ('chat', 'generate', etc.)
+        instance: The ``ollama.Client`` the call was made through, if any
     """
-    logger.debug("Ollama generate wrapper called")
+    logger.debug("Ollama %s wrapper called", endpoint)
+    timer = start_stage_timer()
     usage_metadata = kwargs.pop("usage_metadata", {}) if "usage_metadata" in kwargs else {}
+    if metering_suppressed():
+        return wrapped(*args, **kwargs)
     is_streaming = kwargs.get("stream", False)
-
-    # Note: ollama.generate() doesn't support stream_options parameter
-    # Token usage is included by default in the final chunk
+    timer.lap("metadata")
 
     request_time_dt = datetime.datetime.now(datetime.timezone.utc)
     # Generate transaction ID using the same timestamp for consistency
-    transaction_id = f"ollama-{request_time_dt.timestamp()}"
+    transaction_id = f"ollama-{request_time_dt.timestamp()}-{next(_transaction_sequence)}"
+
+    request_context = RequestContext(endpoint, request_model(args, kwargs), transaction_id)
+    # Metering only keeps these facts, not the request payload
+    request_context.describe_request(args, kwargs)
+    timer.bind(transaction_id)
+    timer.lap("transaction_id")
+
+    # Calls through a specific ollama.Client keep its host, headers and
+    # timeout: they are not routed or batched with the module-level calls and
+    # only share responses with calls through the same client
+    client_host = bound_client_host(instance)
+
+    response_cache = get_response_cache()
+    cache_key = None
+    if response_cache is not None:
+        cache_key = response_cache.key_for(endpoint, args, kwargs, scope=client_host)
+        cached = response_cache.get(cache_key, endpoint) if cache_key else None
+        if cached is not None:
+            logger.debug("Serving Ollama %s response from cache", endpoint)
+            timer.lap("prepare")
+            if is_streaming:
+                stream = _merge_chunks(handle_streaming_response(
+                    iter(cached), request_time_dt, usage_metadata,
+                    transaction_id, endpoint, None, cache_hit=True,
+                    request_context=request_context, timer=timer
+                ))
+                timer.lap("stream_wrap")
+                return stream
+            add_transaction_id_to_response(cached, transaction_id)
+            handle_response(
+                cached, request_time_dt, usage_metadata,
+                False, transaction_id, endpoint, None, cache_hit=True,
+                request_context=request_context, timer=timer
+            )
+            return cached
+
+    # The prompt is always measured so missing counts can be estimated
+    token_estimator = get_token_estimator()
+    size, parts = (token_estimator or fallback_estimator()).measure(endpoint, args, kwargs)
+    request_context.prompt_size, request_context.prompt_parts = size, parts
+    if token_estimator is not None:
+        request_context.estimated_prompt_tokens = token_estimator.estimate(
+            request_context.model, size, parts
+        )
+
+    # The span is current while the call is dispatched and ends once the
+    # response or stream is metered
+    request_context.span = start_span(endpoint, request_context.model, transaction_id)
+    context_token = request_context.activate()
+    span_token = activate_span(request_context.span)
+    try:
+        rate_limiter = get_rate_limiter()
+        if rate_limiter is not None:
+            rate_limiter.admit(usage_metadata)
 
-    logger.debug(f"Calling generate function with args: {args}, kwargs: {kwargs}")
+        keep_alive_manager = get_keep_alive_manager()
+        if keep_alive_manager is not None:
+            keep_alive_manager.apply(endpoint, args, kwargs, request_context.model)
+
+        # The request itself isn't logged; it may carry megabytes of images
+        logger.debug(
+            "Calling %s for model %s with %d messages and %d images (%d bytes)",
+            endpoint, request_context.model, request_context.message_count,
+            request_context.image_count, request_context.image_bytes
+        )
 
-    response = wrapped(*args, **kwargs)
+        # Fields recorded on the metering record that Revenium has no column for
+        metering_fields = {}
+        timer.lap("prepare")
+
+        router = get_host_router() if client_host is None else None
+        limiter = get_concurrency_limiter()
+        if router is None and limiter is None:
+            call_ollama = wrapped
+        else:
+            def call_ollama(*call_args, **call_kwargs):
+                model = request_model(call_args, call_kwargs)
+                host = router.select(model) if router is not None else None
+                if host is not None:
+                    metering_fields["ollama_host"] = host.url
+                permit = None
+                if limiter is not None:
+                    permit = limiter.acquire(
+                        model,
+                        host.url if host is not None else client_host,
+                        priority=usage_metadata.get("priority", 0)
+                    )
+                    metering_fields["queue_wait_ms"] = round(permit.wait_ms, 3)
+                try:
+                    if host is not None:
+                        response = router.call(host, endpoint, call_args, call_kwargs)
+                    else:
+                        response = wrapped(*call_args, **call_kwargs)
+                except BaseException:
+                    if permit is not None:
+                        permit.release()
+                    raise
+                if permit is not None:
+                    return permit.hold(response, call_kwargs.get("stream", False))
+                return response
+
+        # Identical concurrent requests share a single Ollama generation; only
+        # the caller that ran it is metered for the tokens Ollama evaluated
+        coalescer = get_request_coalescer()
+        flight_key = None
+        if coalescer is not None:
+            flight_scope = f"{client_host}#{id(instance)}" if client_host is not None else None
+            flight_key = coalescer.key_for(endpoint, args, kwargs, scope=flight_scope)
+        embed_batcher = get_embed_batcher() if endpoint == 'embed' and client_host is None else None
+        is_leader = True
+        if embed_batcher is not None:
+            response = embed_batcher.embed(call_ollama, args, kwargs)
+        elif flight_key and is_streaming:
+            response, is_leader = coalescer.stream(flight_key, lambda: call_ollama(*args, **kwargs))
+        elif flight_key:
+            response, is_leader = coalescer.do(flight_key, lambda: call_ollama(*args, **kwargs))
+            if not is_leader:
+                response = copy_response(response)
+        else:
+            response = call_ollama(*args, **kwargs)
+    except BaseException as e:
+        fail_span(request_context.span, e)
+        raise
+    finally:
+        deactivate_span(span_token)
+        RequestContext.deactivate(context_token)
+    timer.lap("call")
 
     # Check if response is a generator (streaming response)
     if is_streaming and isinstance(response, types.GeneratorType):
-        return handle_streaming_response(
+        stream = _merge_chunks(handle_streaming_response(
             response, request_time_dt, usage_metadata,
-            transaction_id, 'generate', kwargs
-        )
+            transaction_id, endpoint, None,
+            on_complete=(
+                (lambda chunks: response_cache.set(cache_key, chunks))
+                if cache_key and is_leader else None
+            ),
+            coalesced=not is_leader,
+            metering_fields=metering_fields,
+            request_context=request_context,
+            timer=timer
+        ))
+        timer.lap("stream_wrap")
+        return stream
     else:
         # Handle non-streaming response
-        logger.debug("Ollama generate response: %s", response)
+        logger.debug("Ollama %s response: %s", endpoint, response)
+
+        if cache_key and is_leader:
+            response_cache.set(cache_key, response)
 
         # Add transaction ID to response object
         add_transaction_id_to_response(response, transaction_id)
 
         handle_response(
             response, request_time_dt, usage_metadata,
-            False, transaction_id, 'generate', kwargs
+            False, transaction_id, endpoint, None,
+            coalesced=not is_leader,
+            metering_fields=metering_fields,
+            request_context=request_context,
+            timer=timer
         )
         return response
 
 
+def _merge_chunks(stream):
+    """Join token chunks into larger frames if chunk merging is enabled."""
+    chunk_merger = get_chunk_merger()
+    return chunk_merger.merge(stream) if chunk_merger is not None else stream
+
+
 def handle_streaming_response(
     generator,
     request_time_dt,
     usage_metadata,
     transaction_id,
     endpoint,
-    request_kwargs
+    request_kwargs,
+    cache_hit=False,
+    on_complete=None,
+    coalesced=False,
+    metering_fields=None,
+    request_context=None,
+    timer=NULL_TIMER
 ):
     """
     Handles streaming responses by collecting all chunks and processing the
@@ -150,36 +360,102 @@ def handle_streaming_response(
         usage_metadata: Metadata for metering
         transaction_id: The transaction ID to add to responses
         endpoint: The endpoint being called ('chat', 'generate', etc.)
-        request_kwargs: The request kwargs for operation type detection
+        request_kwargs: The request kwargs for operation type detection,
+            if ``request_context`` doesn't describe the request; only
+            whether they declare tools is kept
+        cache_hit: Whether the chunks were served from the response cache
+        on_complete: Optional callback receiving all chunks once the stream
+            has been fully consumed
+        coalesced: Whether the chunks are a replay of another caller's stream
+        metering_fields: Additional middleware fields for the metering record
+        request_context: The call's RequestContext
+        timer: The call's stage timer
     """
-    chunks = []
+    # The stream can outlive the call by minutes; don't hold the request
+    # payload meanwhile
+    has_tools = bool(request_kwargs.get("tools")) if request_kwargs else None
+
+    # Only the last chunk is kept unless on_complete needs all of them
+    chunks = [] if on_complete is not None else None
     final_response = None
+    first_chunk_dt = None
+    chunk_count = 0
+    wrapper_time = 0.0
+
+    def finish(cancelled=False):
+        response = final_response
+        if response is None:
+            # Nothing was received; meter the prompt Ollama was sent and end
+            # the span
+            response = types.SimpleNamespace(
+                model=getattr(request_context, "model", None) or "ollama-model"
+            )
+        timer.record("stream_chunks", wrapper_time)
+        timer.restart()
+        if on_complete is not None and not cancelled and final_response is not None:
+            on_complete(chunks)
+        # The last chunk contains the complete response data; a cancelled
+        # stream is metered for the chunks received so far
+        handle_response(
+            response,
+            request_time_dt,
+            usage_metadata,
+            True,
+            transaction_id,
+            endpoint,
+            None,
+            completion_start_dt=first_chunk_dt,
+            streamed_chunks=chunk_count,
+            cache_hit=cache_hit,
+            coalesced=coalesced,
+            metering_fields=metering_fields,
+            request_context=request_context,
+            stop_reason="CANCELLED" if cancelled else None,
+            has_tools=has_tools,
+            timer=timer
+        )
 
     def wrapped_generator():
-        nonlocal chunks, final_response
-
-        # Collect all chunks and add transaction ID to each
-        for chunk in generator:
-            chunks.append(chunk)
-            # Add transaction ID to each chunk
-            add_transaction_id_to_response(chunk, transaction_id)
-            yield chunk
-
-        # After all chunks are processed, construct the final response
-        if chunks:
-            # The last chunk should contain the complete response data
-            final_response = chunks[-1]
-            handle_response(
-                final_response,
-                request_time_dt,
-                usage_metadata,
-                True,
-                transaction_id,
-                endpoint,
-                request_kwargs
-            )
+        nonlocal final_response, first_chunk_dt, chunk_count, wrapper_time
+        timed = timer.sampled
+
+        # Add transaction ID to each chunk
+        try:
+            # Primed below, so closing the stream before its first chunk
+            # still raises GeneratorExit here
+            yield
+            for chunk in generator:
+                if timed:
+                    chunk_started = time.perf_counter()
+                if first_chunk_dt is None:
+                    first_chunk_dt = datetime.datetime.now(datetime.timezone.utc)
+                chunk_count += 1
+                final_response = chunk
+                if chunks is not None:
+                    chunks.append(chunk)
+                add_transaction_id_to_response(chunk, transaction_id)
+                if timed:
+                    wrapper_time += time.perf_counter() - chunk_started
+                yield chunk
+        except GeneratorExit:
+            # The consumer stopped iterating (break, disconnect or garbage
+            # collection); stop the upstream stream and meter what Ollama
+            # generated up to here
+            close = getattr(generator, "close", None)
+            if close is not None:
+                close()
+            finish(cancelled=not getattr(final_response, "done", False))
+            raise
+        except Exception as e:
+            if request_context is not None:
+                fail_span(request_context.span, e)
+            raise
 
-    return wrapped_generator()
+        finish()
+
+    stream = wrapped_generator()
+    next(stream)
+    return stream
 
 
 def handle_response(
@@ -189,7 +465,16 @@ def handle_response(
     is_streaming,
     transaction_id,
     endpoint,
-    request_kwargs
+    request_kwargs,
+    completion_start_dt=None,
+    cache_hit=False,
+    coalesced=False,
+    metering_fields=None,
+    request_context=None,
+    streamed_chunks=0,
+    stop_reason=None,
+    has_tools=None,
+    timer=NULL_TIMER
 ):
     """
     Process a complete response (either streaming or non-streaming) and
@@ -202,24 +487,141 @@ def handle_response(
         is_streaming: Whether this is a streaming response
         transaction_id: The transaction ID for this request
         endpoint: The endpoint being called ('chat', 'generate', etc.)
-        request_kwargs: The request kwargs for operation type detection
+        request_kwargs: The request kwargs for operation type detection,
+            if neither ``has_tools`` nor ``request_context`` describe the
+            request
+        completion_start_dt: When the first streamed chunk arrived, if any
+        cache_hit: Whether the response was served from the response cache.
+            Cached responses are metered as cache reads instead of input and
+            output tokens, since Ollama didn't evaluate anything.
+        coalesced: Whether the response was shared from another caller's
+            in-flight request. Metered like a cache hit.
+        metering_fields: Additional middleware fields for the metering record,
+            such as the Ollama host that served the call. They are sent in
+            the request body alongside the standard completion fields.
+        request_context: The call's RequestContext. It receives the reported
+            prompt tokens and is attached to the response as
+            ``_revenium_request_context``.
+        streamed_chunks: Number of chunks a streamed response was made of,
+            used to count output tokens when Ollama didn't report them
+        stop_reason: Revenium stop reason overriding the response's
+            ``done_reason``, e.g. ``CANCELLED`` for abandoned streams
+        has_tools: Whether the request declared tools
+        timer: The call's stage timer
+
+    Neither the response nor the request kwargs are referenced once this
+    returns; the metering record is built from the values extracted here.
     """
-
-    async def metering_call():
-        response_time_dt = datetime.datetime.now(datetime.timezone.utc)
+    response_time_dt = datetime.datetime.now(datetime.timezone.utc)
+
+    # Extract token counts from Ollama response
+    prompt_tokens = getattr(response, 'prompt_eval_count', 0) or 0
+    completion_tokens = getattr(response, 'eval_count', 0) or 0
+
+    # Ollama omits counts when it reuses a cached prompt prefix or a stream
+    # is cut off; estimate them rather than metering zero tokens
+    prompt_estimated = completion_estimated = False
+    if not prompt_tokens and request_context is not None and request_context.prompt_size:
+        prompt_tokens = fallback_estimator().estimate(
+            request_context.model, request_context.prompt_size, request_context.prompt_parts
+        )
+        prompt_estimated = True
+    if not completion_tokens and endpoint != 'embed':
+        completion_tokens = estimate_completion_tokens(response, streamed_chunks)
+        completion_estimated = completion_tokens > 0
+    tokens_estimated = prompt_estimated or completion_estimated
+    image_count = image_bytes = 0
+
+    if request_context is not None:
+        image_count, image_bytes = request_context.image_count, request_context.image_bytes
+        request_context.tokens_estimated = tokens_estimated
+        if not prompt_estimated:
+            request_context.prompt_tokens = prompt_tokens
+        token_estimator = get_token_estimator()
+        if token_estimator is not None and not (cache_hit or coalesced or prompt_estimated):
+            token_estimator.calibrate(
+                request_context.model, request_context.prompt_size,
+                request_context.prompt_parts, prompt_tokens
+            )
+        try:
+            setattr(response, '_revenium_request_context', request_context)
+        except (TypeError, AttributeError):
+            pass
+    cache_read_tokens = 0
+    if cache_hit or coalesced:
+        cache_read_tokens = prompt_tokens + completion_tokens
+        prompt_tokens = completion_tokens = 0
+    model = getattr(response, 'model', 'ollama-model')
+
+    # Detect operation type
+    if has_tools is None and request_context is not None:
+        has_tools = request_context.has_tools
+    operation_type = detect_operation_type(endpoint, request_kwargs, has_tools=has_tools)
+
+    if stop_reason is None:
+        ollama_finish_reason = getattr(response, 'done_reason', None)
+        stop_reason = FINISH_REASON_MAP.get(ollama_finish_reason, "END")  # type: ignore
+    parent_transaction_id = get_parent_transaction_id()
+
+    rate_limiter = get_rate_limiter()
+    if rate_limiter is not None:
+        rate_limiter.charge(usage_metadata, prompt_tokens + completion_tokens)
+
+    metrics_registry = get_metrics_registry()
+    if metrics_registry is not None:
+        metrics_registry.observe_response(
+            model,
+            operation_type,
+            prompt_tokens,
+            completion_tokens,
+            (response_time_dt - request_time_dt).total_seconds(),
+            load_duration_ns=getattr(response, 'load_duration', None),
+            time_to_first_token_s=(
+                (completion_start_dt - request_time_dt).total_seconds()
+                if completion_start_dt is not None else None
+            ),
+            cache_hit=cache_hit,
+            coalesced=coalesced,
+            queue_wait_s=(
+                metering_fields["queue_wait_ms"] / 1000
+                if metering_fields and "queue_wait_ms" in metering_fields else None
+            )
+        )
+        metrics_registry.metering_enqueued()
+
+    emit_span(
+        endpoint,
+        model,
+        operation_type,
+        request_time_dt,
+        response_time_dt,
+        prompt_tokens,
+        completion_tokens,
+        stop_reason,
+        transaction_id,
+        parent_transaction_id=parent_transaction_id,
+        is_streaming=is_streaming,
+        completion_start_dt=completion_start_dt,
+        span=request_context.span if request_context is not None else None
+    )
+
+    def build_completion_args():
+        # Runs on the metering thread while the caller's laps go on
+        started = timer.mark()
         response_time = response_time_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
         request_duration = (
             (response_time_dt - request_time_dt).total_seconds() * 1000
         )
         request_time = request_time_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+        completion_start_time = (
+            completion_start_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+            if completion_start_dt is not None else response_time
+        )
 
         # Use the provided transaction ID
         response_id = transaction_id
 
-        # Extract token counts from Ollama response
-        prompt_tokens = getattr(response, 'prompt_eval_count', 0)
-        completion_tokens = getattr(response, 'eval_count', 0)
-        total_tokens = prompt_tokens + completion_tokens
+        total_tokens = prompt_tokens + completion_tokens + cache_read_tokens
         cached_tokens = 0  # Ollama doesn't provide cached tokens info
 
         logger.debug(
@@ -227,103 +629,103 @@ def handle_response(
             prompt_tokens, completion_tokens, total_tokens
         )
 
-        ollama_finish_reason = getattr(response, 'done_reason', None)
-
-        finish_reason_map = {
-            "stop": "END",
-            "length": "TOKEN_LIMIT",
-            "error": "ERROR",
-            "cancelled": "CANCELLED",  # British spelling
-            "canceled": "CANCELLED",   # American spelling (Go standard library uses this)
-            "tool_calls": "END_SEQUENCE"
+        logger.debug("Metering call to Revenium for completion %s", response_id)
+
+        # Create subscriber object from usage metadata
+        subscriber = {}
+
+        # Handle nested subscriber object
+        if "subscriber" in usage_metadata and isinstance(usage_metadata["subscriber"], dict):
+            nested_subscriber = usage_metadata["subscriber"]
+
+            if nested_subscriber.get("id"):
+                subscriber["id"] = nested_subscriber["id"]
+            if nested_subscriber.get("email"):
+                subscriber["email"] = nested_subscriber["email"]
+            if nested_subscriber.get("credential") and isinstance(nested_subscriber["credential"], dict):
+                # Maintain nested credential structure
+                subscriber["credential"] = {
+                    "name": nested_subscriber["credential"].get("name"),
+                    "value": nested_subscriber["credential"].get("value")
+                }
+
+        # Capture trace visualization fields
+        environment = get_environment()
+        region = get_region()
+        credential_alias = get_credential_alias()
+        trace_type = get_trace_type()
+        trace_name = get_trace_name()
+        transaction_name = get_transaction_name(usage_metadata)
+        retry_number = get_retry_number()
+
+        # Prepare arguments for create_completion
+        completion_args = {
+            "cache_creation_token_count": cached_tokens,
+            "cache_read_token_count": cache_read_tokens,
+            "input_token_cost": None,
+            "output_token_cost": None,
+            "total_cost": None,
+            "output_token_count": completion_tokens,
+            "cost_type": "AI",
+            "model": model,
+            "input_token_count": prompt_tokens,
+            "provider": "OLLAMA",
+            "model_source": "OLLAMA",
+            "reasoning_token_count": 0,
+            "request_time": request_time,
+            "response_time": response_time,
+            "completion_start_time": completion_start_time,
+            "request_duration": int(request_duration),
+            "stop_reason": stop_reason,
+            "total_token_count": total_tokens,
+            "transaction_id": response_id,
+            "trace_id": usage_metadata.get("trace_id"),
+            "task_type": usage_metadata.get("task_type"),
+            "subscriber": subscriber if subscriber else None,
+            "organization_id": usage_metadata.get("organization_id"),
+            "subscription_id": usage_metadata.get("subscription_id"),
+            "product_id": usage_metadata.get("product_id"),
+            "agent": usage_metadata.get("agent"),
+            "response_quality_score": usage_metadata.get("response_quality_score"),
+            "is_streamed": is_streaming,
+            "middleware_source": "PYTHON",
+            # Trace visualization fields
+            "operation_type": operation_type,
+            "environment": environment,
+            "region": region,
+            "credential_alias": credential_alias,
+            "trace_type": trace_type,
+            "trace_name": trace_name,
+            "parent_transaction_id": parent_transaction_id,
+            "transaction_name": transaction_name,
+            "retry_number": retry_number
         }
-        stop_reason = finish_reason_map.get(ollama_finish_reason, "END")  # type: ignore
 
+        completion_args["extra_body"] = dict(
+            metering_fields or {},
+            token_count_source="estimated" if tokens_estimated else "exact"
+        )
+        if image_count:
+            completion_args["extra_body"]["image_count"] = image_count
+            completion_args["extra_body"]["image_bytes"] = image_bytes
+
+        timer.since("payload", started)
+
+        # Log the arguments at debug level
+        logger.debug("Arguments for create_completion: %s", completion_args)
+        return completion_args
+
+    async def metering_call():
         try:
             if shutdown_event.is_set():
                 logger.warning("Skipping metering call during shutdown")
                 return
-            logger.debug("Metering call to Revenium for completion %s", response_id)
-
-            # Create subscriber object from usage metadata
-            subscriber = {}
-
-            # Handle nested subscriber object
-            if "subscriber" in usage_metadata and isinstance(usage_metadata["subscriber"], dict):
-                nested_subscriber = usage_metadata["subscriber"]
-
-                if nested_subscriber.get("id"):
-                    subscriber["id"] = nested_subscriber["id"]
-                if nested_subscriber.get("email"):
-                    subscriber["email"] = nested_subscriber["email"]
-                if nested_subscriber.get("credential") and isinstance(nested_subscriber["credential"], dict):
-                    # Maintain nested credential structure
-                    subscriber["credential"] = {
-                        "name": nested_subscriber["credential"].get("name"),
-                        "value": nested_subscriber["credential"].get("value")
-                    }
-
-            # Detect operation type
-            operation_type = detect_operation_type(endpoint, request_kwargs)
-
-            # Capture trace visualization fields
-            environment = get_environment()
-            region = get_region()
-            credential_alias = get_credential_alias()
-            trace_type = get_trace_type()
-            trace_name = get_trace_name()
-            parent_transaction_id = get_parent_transaction_id()
-            transaction_name = get_transaction_name(usage_metadata)
-            retry_number = get_retry_number()
-
-            # Prepare arguments for create_completion
-            completion_args = {
-                "cache_creation_token_count": cached_tokens,
-                "cache_read_token_count": 0,
-                "input_token_cost": None,
-                "output_token_cost": None,
-                "total_cost": None,
-                "output_token_count": completion_tokens,
-                "cost_type": "AI",
-                "model": getattr(response, 'model', 'ollama-model'),
-                "input_token_count": prompt_tokens,
-                "provider": "OLLAMA",
-                "model_source": "OLLAMA",
-                "reasoning_token_count": 0,
-                "request_time": request_time,
-                "response_time": response_time,
-                "completion_start_time": response_time,
-                "request_duration": int(request_duration),
-                "stop_reason": stop_reason,
-                "total_token_count": total_tokens,
-                "transaction_id": response_id,
-                "trace_id": usage_metadata.get("trace_id"),
-                "task_type": usage_metadata.get("task_type"),
-                "subscriber": subscriber if subscriber else None,
-                "organization_id": usage_metadata.get("organization_id"),
-                "subscription_id": usage_metadata.get("subscription_id"),
-                "product_id": usage_metadata.get("product_id"),
-                "agent": usage_metadata.get("agent"),
-                "response_quality_score": usage_metadata.get("response_quality_score"),
-                "is_streamed": is_streaming,
-                "middleware_source": "PYTHON",
-                # Trace visualization fields
-                "operation_type": operation_type,
-                "environment": environment,
-                "region": region,
-                "credential_alias": credential_alias,
-                "trace_type": trace_type,
-                "trace_name": trace_name,
-                "parent_transaction_id": parent_transaction_id,
-                "transaction_name": transaction_name,
-                "retry_number": retry_number
-            }
-
-            # Log the arguments at debug level
-            logger.debug("Arguments for create_completion: %s", completion_args)
+            completion_args = build_completion_args()
+            started = timer.mark()
 
             # The client.ai.create_completion method is not async, so don't use await
             result = client.ai.create_completion(**completion_args)
+            timer.since("export", started)
             logger.debug("Metering call result: %s", result)
         except Exception as e:
             if not shutdown_event.is_set():
@@ -331,6 +733,20 @@ def handle_response(
                 # Log the full traceback for better debugging
                 import traceback
                 logger.warning(f"Traceback: {traceback.format_exc()}")
-
+        finally:
+            if metrics_registry is not None:
+                metrics_registry.metering_completed()
+
+    timer.lap("accounting")
+    metering_exporter = get_metering_exporter()
+    if metering_exporter is not None:
+        metering_exporter.submit(
+            build_completion_args,
+            metrics_registry.metering_completed if metrics_registry is not None else None
+        )
+        timer.lap("enqueue")
+        return
+    _load_metering()
     thread = run_async_in_thread(metering_call())
+    timer.lap("enqueue")
     logger.debug("Metering thread started: %s", thread)
@@ -0,0 +1,222 @@
+"""
+OpenTelemetry span emission for metered Ollama calls.
+
+Each metered ``chat``/``generate`` call is reported as a client span carrying
+the OpenTelemetry GenAI semantic-convention attributes together with the
+Revenium ``transaction_id`` and ``parent_transaction_id``, so spans can be
+joined with metering records.
+
+The span is started before the call is dispatched and is the current span
+while it is, so spans of the HTTP request to Ollama are its children. It
+ends once the response (or the whole stream) is metered, and calls that
+raise end it with the exception recorded.
+
+OpenTelemetry is an optional dependency. Spans are only created when the
+application has imported the ``opentelemetry`` API and configured an SDK
+tracer provider; otherwise ``emit_span()`` returns immediately. The API is
+never imported by this module, so it adds nothing to import time.
+"""
+
+import logging
+import sys
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+INSTRUMENTATION_NAME = "revenium_middleware_ollama"
+
+# GenAI semantic-convention operation names per Ollama endpoint
+OPERATION_NAMES = {
+    "chat": "chat",
+    "generate": "text_completion",
+    "embed": "embeddings",
+    "embeddings": "embeddings",
+}
+
+_cached_provider = None
+_cached_tracer = None
+
+
+def _get_tracer():
+    """
+    Get a tracer from the configured provider.
+
+    Returns:
+        A tracer, or None when OpenTelemetry is missing or no SDK tracer
+        provider is configured
+    """
+    global _cached_provider, _cached_tracer
+    # A provider can only have been configured if the application imported
+    # the API
+    otel_trace = sys.modules.get("opentelemetry.trace")
+    if otel_trace is None:
+        return None
+    provider = otel_trace.get_tracer_provider()
+    if provider is _cached_provider:
+        return _cached_tracer
+    if isinstance(provider, (otel_trace.ProxyTracerProvider, otel_trace.NoOpTracerProvider)):
+        tracer = None
+    else:
+        tracer = provider.get_tracer(INSTRUMENTATION_NAME)
+    _cached_provider, _cached_tracer = provider, tracer
+    return tracer
+
+
+def _to_ns(dt) -> int:
+    return int(dt.timestamp() * 1_000_000_000)
+
+
+def start_span(endpoint: str, model: str, transaction_id: str) -> Any:
+    """
+    Start the client span of a call about to be dispatched.
+
+    Args:
+        endpoint: The endpoint being called ('chat', 'generate', etc.)
+        model: Model the call is made for
+        transaction_id: Revenium transaction ID of the call
+
+    Returns:
+        The span, or None when no tracer provider is configured
+    """
+    tracer = _get_tracer()
+    if tracer is None:
+        return None
+    operation_name = OPERATION_NAMES.get(endpoint, endpoint)
+    try:
+        return tracer.start_span(
+            f"{operation_name} {model}",
+            kind=sys.modules["opentelemetry.trace"].SpanKind.CLIENT,
+            attributes={
+                "gen_ai.system": "ollama",
+                "gen_ai.operation.name": operation_name,
+                "gen_ai.request.model": model,
+                "revenium.transaction_id": transaction_id,
+            }
+        )
+    except Exception as e:
+        logger.warning(f"Error starting OpenTelemetry span: {str(e)}")
+        return None
+
+
+def activate_span(span: Any) -> Any:
+    """
+    Make a span current; pass the token to ``deactivate_span()``.
+
+    Args:
+        span: Span from ``start_span()``, or None
+
+    Returns:
+        A context token, or None without a span
+    """
+    if span is None:
+        return None
+    from opentelemetry import context as otel_context
+    return otel_context.attach(sys.modules["opentelemetry.trace"].set_span_in_context(span))
+
+
+def deactivate_span(token: Any) -> None:
+    """Restore the span that was current before ``activate_span()``."""
+    if token is not None:
+        from opentelemetry import context as otel_context
+        otel_context.detach(token)
+
+
+def fail_span(span: Any, error: BaseException) -> None:
+    """
+    End a span whose call raised, recording the exception.
+
+    Args:
+        span: Span from ``start_span()``, or None
+        error: The exception the call raised
+    """
+    if span is None:
+        return
+    otel_trace = sys.modules["opentelemetry.trace"]
+    try:
+        span.record_exception(error)
+        span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, str(error)))
+        span.end()
+    except Exception as e:
+        logger.warning(f"Error ending OpenTelemetry span: {str(e)}")
+
+
+def emit_span(
+    endpoint: str,
+    model: str,
+    operation_type: str,
+    request_time_dt,
+    response_time_dt,
+    input_tokens: int,
+    output_tokens: int,
+    stop_reason: str,
+    transaction_id: str,
+    parent_transaction_id: Optional[str] = None,
+    is_streaming: bool = False,
+    completion_start_dt=None,
+    span: Any = None
+) -> None:
+    """
+    Complete the client span of an Ollama call.
+
+    Ends ``span`` with the response attributes. Without one, for example
+    for responses served from the cache, a span parented to the caller's
+    current OpenTelemetry context is emitted, backdated to the request time.
+
+    Args:
+        endpoint: The endpoint that was called ('chat', 'generate', etc.)
+        model: Model reported by Ollama
+        operation_type: Revenium operation type of the call
+        request_time_dt: When the request was made
+        response_time_dt: When the response completed
+        input_tokens: Prompt tokens evaluated
+        output_tokens: Completion tokens generated
+        stop_reason: Revenium stop reason mapped from Ollama's done_reason
+        transaction_id: Revenium transaction ID of the metering record
+        parent_transaction_id: Parent transaction ID, if any
+        is_streaming: Whether the response was streamed
+        completion_start_dt: When the first streamed chunk arrived, if any
+        span: Span from ``start_span()``, if the call had one
+    """
+    tracer = _get_tracer() if span is None else None
+    if span is None and tracer is None:
+        return
+
+    operation_name = OPERATION_NAMES.get(endpoint, endpoint)
+    attributes = {
+        "gen_ai.system": "ollama",
+        "gen_ai.operation.name": operation_name,
+        "gen_ai.request.model": model,
+        "gen_ai.response.model": model,
+        "gen_ai.response.id": transaction_id,
+        "gen_ai.response.finish_reasons": (stop_reason,),
+        "gen_ai.usage.input_tokens": input_tokens,
+        "gen_ai.usage.output_tokens": output_tokens,
+        "revenium.transaction_id": transaction_id,
+        "revenium.operation_type": operation_type,
+        "revenium.is_streamed": is_streaming,
+    }
+    if parent_transaction_id:
+        attributes["revenium.parent_transaction_id"] = parent_transaction_id
+    if completion_start_dt is not None:
+        attributes["revenium.time_to_first_token_ms"] = (
+            (completion_start_dt - request_time_dt).total_seconds() * 1000
+        )
+
+    otel_trace = sys.modules["opentelemetry.trace"]
+    try:
+        if span is None:
+            span = tracer.start_span(
+                f"{operation_name} {model}",
+                kind=otel_trace.SpanKind.CLIENT,
+                attributes=attributes,
+                start_time=_to_ns(request_time_dt)
+            )
+            end_time = _to_ns(response_time_dt)
+        else:
+            span.set_attributes(attributes)
+            end_time = None
+        if stop_reason == "ERROR":
+            span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR))
+        span.end(end_time=end_time)
+    except Exception as e:
+        logger.warning(f"Error emitting OpenTelemetry span: {str(e)}")
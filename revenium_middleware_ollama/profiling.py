@@ -0,0 +1,254 @@
+"""
+Per-stage timing of the middleware's own work.
+
+When stage profiling is enabled, a sample of metered calls is timed stage by
+stage and each duration is recorded in a per-stage histogram:
+
+- ``metadata``: extracting ``usage_metadata`` from the call
+- ``transaction_id``: generating the transaction ID and request context
+- ``prepare``: cache lookup, prompt measurement, rate limits and keep-alive
+- ``call``: the Ollama call itself, including routing and queueing
+- ``stream_wrap``: wrapping a streamed response
+- ``stream_chunks``: the wrapper's total time spent on a stream's chunks,
+  excluding the time the consumer holds each chunk
+- ``accounting``: token accounting, metrics and spans once the response is
+  complete
+- ``enqueue``: handing the metering record to the exporter
+- ``payload``: building the metering record
+- ``export``: sending the record to Revenium
+
+Unsampled calls only pay for one random draw. The histogram is sharded per
+thread like the metrics registry, so recording doesn't take a lock. A
+callback can be attached to forward every sampled timing to a custom
+profiler.
+"""
+
+import logging
+import os
+import random
+import time
+from typing import Callable, Dict, Optional
+
+from .metrics import Histogram, bucket_quantile, env_float
+
+logger = logging.getLogger(__name__)
+
+# Environment variable names
+ENV_REVENIUM_PROFILE_SAMPLE_RATE = "REVENIUM_PROFILE_SAMPLE_RATE"
+
+STAGES = (
+    "metadata", "transaction_id", "prepare", "call", "stream_wrap",
+    "stream_chunks", "accounting", "enqueue", "payload", "export"
+)
+
+# Bucket upper bounds, in seconds; the middleware's own stages take
+# microseconds, the Ollama call and export can take minutes
+STAGE_BUCKETS = (
+    0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001,
+    0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+    0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+
+DEFAULT_SAMPLE_RATE = 0.01
+
+# Receives the stage name, its duration in seconds and the transaction ID
+# (None for stages that run before the ID is generated)
+ProfilerCallback = Callable[[str, float, Optional[str]], None]
+
+
+class StageTimer:
+    """Times the stages of one sampled call."""
+
+    __slots__ = ("_profiler", "_last", "transaction_id")
+
+    sampled = True
+
+    def __init__(self, profiler: "StageProfiler"):
+        self._profiler = profiler
+        self._last = time.perf_counter()
+        self.transaction_id: Optional[str] = None
+
+    def bind(self, transaction_id: str) -> None:
+        """Set the transaction ID passed to the profiler callback."""
+        self.transaction_id = transaction_id
+
+    def lap(self, stage: str) -> None:
+        """Record the time since the previous lap as ``stage``."""
+        now = time.perf_counter()
+        self._profiler.record(stage, now - self._last, self.transaction_id)
+        self._last = now
+
+    def restart(self) -> None:
+        """Start the next lap now, leaving the time since the last one out."""
+        self._last = time.perf_counter()
+
+    def record(self, stage: str, duration_s: float) -> None:
+        """Record a duration measured by the caller."""
+        self._profiler.record(stage, duration_s, self.transaction_id)
+
+    def mark(self) -> float:
+        """Get a start time for ``since()``, independent of the laps."""
+        return time.perf_counter()
+
+    def since(self, stage: str, started: float) -> None:
+        """Record the time since ``mark()`` returned ``started`` as ``stage``."""
+        self.record(stage, time.perf_counter() - started)
+
+
+class _NullTimer:
+    """Timer of unsampled calls; records nothing."""
+
+    __slots__ = ()
+
+    sampled = False
+
+    def bind(self, transaction_id: str) -> None:
+        pass
+
+    def lap(self, stage: str) -> None:
+        pass
+
+    def restart(self) -> None:
+        pass
+
+    def record(self, stage: str, duration_s: float) -> None:
+        pass
+
+    def mark(self) -> float:
+        return 0.0
+
+    def since(self, stage: str, started: float) -> None:
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class StageProfiler:
+    """
+    Records per-stage durations of sampled calls.
+
+    Args:
+        sample_rate: Fraction of calls to time, from 0 to 1
+        callback: Optional callable receiving ``(stage, duration_s,
+            transaction_id)`` for every recorded stage
+    """
+
+    def __init__(self, sample_rate: float = DEFAULT_SAMPLE_RATE, callback: Optional[ProfilerCallback] = None):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        self.sample_rate = sample_rate
+        self.callback = callback
+        self.histogram = Histogram(
+            "revenium_ollama_stage_duration_seconds",
+            "Time spent in each stage of the middleware for sampled calls.",
+            STAGE_BUCKETS,
+            labelnames=("stage",)
+        )
+
+    def start(self):
+        """
+        Start timing a call if it is sampled.
+
+        Returns:
+            A ``StageTimer``, or a timer that records nothing
+        """
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            return StageTimer(self)
+        return NULL_TIMER
+
+    def record(self, stage: str, duration_s: float, transaction_id: Optional[str] = None) -> None:
+        """Record one stage duration."""
+        self.histogram.observe((stage,), duration_s)
+        callback = self.callback
+        if callback is not None:
+            try:
+                callback(stage, duration_s, transaction_id)
+            except Exception as e:
+                logger.warning(f"Error in profiler callback: {str(e)}")
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """
+        Summarize the recorded durations per stage.
+
+        Percentiles are the upper bound of the bucket they fall in.
+
+        Returns:
+            ``count``, ``sum_s``, ``mean_s``, ``p50_s``, ``p90_s`` and
+            ``p99_s`` keyed by stage
+        """
+        summary = {}
+        for (stage,), entry in self.histogram.collect().items():
+            count = sum(entry[:-1])
+            if not count:
+                continue
+            summary[stage] = {
+                "count": count,
+                "sum_s": entry[-1],
+                "mean_s": entry[-1] / count,
+                "p50_s": bucket_quantile(self.histogram.buckets, entry, 0.5),
+                "p90_s": bucket_quantile(self.histogram.buckets, entry, 0.9),
+                "p99_s": bucket_quantile(self.histogram.buckets, entry, 0.99),
+            }
+        return summary
+
+    def render(self) -> str:
+        """Render the stage histogram in the Prometheus text exposition format."""
+        return "\n".join(self.histogram.render()) + "\n"
+
+
+_profiler: Optional[StageProfiler] = None
+
+
+def get_stage_profiler() -> Optional[StageProfiler]:
+    """
+    Get the active stage profiler.
+
+    Returns:
+        The profiler, or None when stage profiling is disabled
+    """
+    return _profiler
+
+
+def start_stage_timer():
+    """
+    Start timing a call with the active profiler.
+
+    Returns:
+        A ``StageTimer`` for sampled calls, otherwise a timer that records
+        nothing
+    """
+    profiler = _profiler
+    return profiler.start() if profiler is not None else NULL_TIMER
+
+
+def enable_stage_profiling(
+    sample_rate: float = DEFAULT_SAMPLE_RATE,
+    callback: Optional[ProfilerCallback] = None
+) -> StageProfiler:
+    """
+    Time the middleware's stages for a sample of calls.
+
+    Args:
+        sample_rate: Fraction of calls to time, from 0 to 1
+        callback: Optional callable receiving ``(stage, duration_s,
+            transaction_id)`` for every recorded stage
+
+    Returns:
+        The active profiler
+    """
+    global _profiler
+    _profiler = StageProfiler(sample_rate, callback)
+    return _profiler
+
+
+def disable_stage_profiling() -> None:
+    """Stop timing stages and drop the recorded durations."""
+    global _profiler
+    _profiler = None
+
+
+if os.getenv(ENV_REVENIUM_PROFILE_SAMPLE_RATE):
+    enable_stage_profiling(
+        min(max(env_float(ENV_REVENIUM_PROFILE_SAMPLE_RATE, DEFAULT_SAMPLE_RATE), 0.0), 1.0)
+    )
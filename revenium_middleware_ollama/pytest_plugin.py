@@ -0,0 +1,32 @@
+"""
+Pytest plugin providing the ``revenium_metering`` fixture.
+
+The plugin isn't registered as a ``pytest11`` entry point: loading it imports
+the package, which instruments ``ollama``, so it would patch the test suites
+of every project that merely has this package installed. Enable it in
+``conftest.py`` instead::
+
+    pytest_plugins = ["revenium_middleware_ollama.pytest_plugin"]
+
+    def test_chat_is_metered(revenium_metering):
+        ollama.chat(model="qwen2.5:0.5b", messages=messages)
+        (record,) = revenium_metering.records
+        assert record["operation_type"] == "CHAT"
+"""
+
+import pytest
+
+from .testing import capture_metering
+
+
+@pytest.fixture
+def revenium_metering():
+    """
+    Capture the test's metering records inline, without threads.
+
+    Yields:
+        A ``CollectorSink`` whose ``records`` holds one record per metered
+        call, in call order
+    """
+    with capture_metering() as collector:
+        yield collector
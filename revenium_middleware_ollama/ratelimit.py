@@ -0,0 +1,231 @@
+"""
+Local per-tenant rate limiting of Ollama calls.
+
+Tenants are identified by the ``organization_id``, ``subscriber.id`` and
+``product_id`` fields of ``usage_metadata``. Each tenant gets two token
+buckets: one for requests per second, checked before a call reaches Ollama,
+and one for tokens per minute. Since the token cost of a call is only known
+afterwards, the prompt and completion tokens Ollama reports are charged back
+once the call completes; a tenant that overdraws its token bucket is refused
+until the bucket refills.
+
+Admission and charging are O(1). Tenant state is kept in an LRU bounded by
+``max_tenants``, so memory stays bounded as tenants come and go.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_TENANTS = 10000
+
+TenantKey = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a tenant exceeded its request or token rate.
+
+    Attributes:
+        tenant: The tenant key (organization_id, subscriber id, product_id)
+        retry_after: Seconds until the call would be admitted
+    """
+
+    def __init__(self, tenant: TenantKey, retry_after: float, reason: str):
+        super().__init__(
+            f"Rate limit exceeded for tenant {tenant}: {reason}, retry after {retry_after:.2f}s"
+        )
+        self.tenant = tenant
+        self.retry_after = retry_after
+
+
+def tenant_key(usage_metadata: Optional[Mapping[str, Any]]) -> TenantKey:
+    """
+    Get the tenant key of a call from its usage metadata.
+
+    Args:
+        usage_metadata: Metadata passed with the call
+
+    Returns:
+        Tuple of organization_id, subscriber id and product_id
+    """
+    usage_metadata = usage_metadata or {}
+    subscriber = usage_metadata.get("subscriber")
+    subscriber_id = subscriber.get("id") if isinstance(subscriber, dict) else None
+    return (
+        usage_metadata.get("organization_id"),
+        subscriber_id,
+        usage_metadata.get("product_id"),
+    )
+
+
+class _TenantBuckets:
+    __slots__ = ("requests", "tokens", "updated")
+
+    def __init__(self, request_burst: float, token_burst: float, now: float):
+        self.requests = request_burst
+        self.tokens = token_burst
+        self.updated = now
+
+
+class TenantRateLimiter:
+    """
+    Token-bucket limiter for requests per second and tokens per minute.
+
+    Args:
+        requests_per_second: Sustained request rate per tenant (None for no
+            limit)
+        tokens_per_minute: Sustained token rate per tenant (None for no limit)
+        request_burst: Request bucket size, defaults to one second of requests
+        overrides: Limits for specific organizations, mapping
+            ``organization_id`` to a dict with ``requests_per_second`` and/or
+            ``tokens_per_minute``
+        max_wait_s: Wait up to this long for capacity instead of raising
+            immediately
+        max_tenants: Number of tenants whose state is kept
+
+    Raises:
+        ValueError: If a request or token rate isn't positive; leave it as
+            None for no limit
+    """
+
+    def __init__(
+        self,
+        requests_per_second: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        request_burst: Optional[float] = None,
+        overrides: Optional[Dict[str, Dict[str, float]]] = None,
+        max_wait_s: float = 0.0,
+        max_tenants: int = DEFAULT_MAX_TENANTS
+    ):
+        # A rate of 0 would never refill its bucket
+        limits = {"": {"requests_per_second": requests_per_second, "tokens_per_minute": tokens_per_minute}}
+        limits.update((f" for {organization}", override) for organization, override in (overrides or {}).items())
+        for scope, values in limits.items():
+            for name in ("requests_per_second", "tokens_per_minute"):
+                if values.get(name) is not None and values[name] <= 0:
+                    raise ValueError(f"{name}{scope} must be positive, got {values[name]}")
+        self.requests_per_second = requests_per_second
+        self.tokens_per_minute = tokens_per_minute
+        self.request_burst = request_burst
+        self.overrides = dict(overrides or {})
+        self.max_wait_s = max_wait_s
+        self.max_tenants = max_tenants
+        self._tenants: "OrderedDict[TenantKey, _TenantBuckets]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _limits(self, tenant: TenantKey) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+        override = self.overrides.get(tenant[0], {})
+        rps = override.get("requests_per_second", self.requests_per_second)
+        tpm = override.get("tokens_per_minute", self.tokens_per_minute)
+        burst = override.get("request_burst", self.request_burst)
+        if rps is not None and burst is None:
+            burst = max(rps, 1.0)
+        return rps, tpm, burst
+
+    def _buckets(self, tenant: TenantKey, now: float) -> _TenantBuckets:
+        rps, tpm, burst = self._limits(tenant)
+        buckets = self._tenants.get(tenant)
+        if buckets is None:
+            buckets = _TenantBuckets(burst or 0.0, tpm or 0.0, now)
+            self._tenants[tenant] = buckets
+            if len(self._tenants) > self.max_tenants:
+                self._tenants.popitem(last=False)
+            return buckets
+        self._tenants.move_to_end(tenant)
+        elapsed = now - buckets.updated
+        buckets.updated = now
+        if rps is not None:
+            buckets.requests = min(burst, buckets.requests + elapsed * rps)
+        if tpm is not None:
+            buckets.tokens = min(tpm, buckets.tokens + elapsed * tpm / 60)
+        return buckets
+
+    def _try_admit(self, tenant: TenantKey) -> Tuple[float, str]:
+        """Take a request slot, or return how long to wait for one."""
+        rps, tpm, _ = self._limits(tenant)
+        with self._lock:
+            buckets = self._buckets(tenant, time.monotonic())
+            if tpm is not None and buckets.tokens <= 0:
+                return (1 - buckets.tokens) * 60 / tpm, "tokens per minute"
+            if rps is not None:
+                if buckets.requests < 1:
+                    return (1 - buckets.requests) / rps, "requests per second"
+                buckets.requests -= 1
+        return 0.0, ""
+
+    def admit(self, usage_metadata: Optional[Mapping[str, Any]]) -> None:
+        """
+        Admit a call for the tenant in ``usage_metadata``.
+
+        Raises:
+            RateLimitExceeded: If the tenant is over its limits and no
+                capacity frees up within ``max_wait_s``
+        """
+        tenant = tenant_key(usage_metadata)
+        deadline = time.monotonic() + self.max_wait_s
+        while True:
+            retry_after, reason = self._try_admit(tenant)
+            if not retry_after:
+                return
+            if time.monotonic() + retry_after > deadline:
+                raise RateLimitExceeded(tenant, retry_after, reason)
+            time.sleep(retry_after)
+
+    def charge(self, usage_metadata: Optional[Mapping[str, Any]], tokens: int) -> None:
+        """
+        Charge the tokens a completed call used to its tenant.
+
+        The token bucket may go negative; the tenant is refused until it has
+        refilled.
+        """
+        tenant = tenant_key(usage_metadata)
+        _, tpm, _ = self._limits(tenant)
+        if tpm is None or not tokens:
+            return
+        with self._lock:
+            self._buckets(tenant, time.monotonic()).tokens -= tokens
+
+
+_limiter: Optional[TenantRateLimiter] = None
+
+
+def get_rate_limiter() -> Optional[TenantRateLimiter]:
+    """
+    Get the active tenant rate limiter.
+
+    Returns:
+        The limiter, or None when rate limiting is disabled
+    """
+    return _limiter
+
+
+def enable_rate_limit(
+    requests_per_second: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+    **options
+) -> TenantRateLimiter:
+    """
+    Enable local per-tenant rate limiting.
+
+    Args:
+        requests_per_second: Sustained request rate per tenant
+        tokens_per_minute: Sustained token rate per tenant
+        **options: Other ``TenantRateLimiter`` options
+
+    Returns:
+        The active limiter
+    """
+    global _limiter
+    _limiter = TenantRateLimiter(requests_per_second, tokens_per_minute, **options)
+    return _limiter
+
+
+def disable_rate_limit() -> None:
+    """Disable per-tenant rate limiting."""
+    global _limiter
+    _limiter = None
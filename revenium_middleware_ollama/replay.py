@@ -0,0 +1,512 @@
+"""
+Replay of spooled or exported metering records.
+
+After an outage, records spooled by the metering exporter (or exported to
+JSONL files by other means) can be sent to Revenium with::
+
+    python -m revenium_middleware_ollama.replay spool/ --index replay.sqlite --rate 200
+
+Each line of the input files is one record's ``create_completion``
+arguments. Files are streamed line by line, so millions of records replay in
+constant memory; directories are replayed file by file in name order, and
+``.gz`` files are decompressed on the fly.
+
+Records are deduplicated by ``transaction_id``. An ID is only added to the
+index once its record was sent, so records of a run that crashed, was
+interrupted or failed to send are sent by the next run. With ``--index``,
+sent IDs are kept in a SQLite file, so an interrupted replay can be re-run
+without sending anything twice. Without it, an in-memory SQLite index dedupes
+within the run. ``--bloom`` uses a Bloom filter instead, which needs less
+memory for very large backlogs but can skip a record that was never sent, at
+the rate set with ``--false-positive-rate``; every record it skips is logged.
+
+Records are sent in batches by a pool of worker threads, under an optional
+cap in records per second. Records that still fail after retries are written
+to ``--failed``, to be replayed later.
+
+With ``--rotate``, each JSONL file is first renamed to
+``<name>.replaying-<UTC time>.jsonl``, so the metering exporter starts a new
+spool file (and resets its ``spool_backlog``) while the old one is replayed.
+The renamed files are removed once the run completes, unless records failed
+without ``--failed`` to keep them. An interrupted run leaves them in place
+for the next run over the directory.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import IO, Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF_S = 0.5
+DEFAULT_EXPECTED_RECORDS = 10_000_000
+DEFAULT_FALSE_POSITIVE_RATE = 0.001
+PROGRESS_INTERVAL_S = 10.0
+# Marks input files moved aside by --rotate
+REPLAYING_MARKER = ".replaying-"
+
+Record = Dict[str, Any]
+
+
+class SQLiteIndex:
+    """
+    Transaction IDs already replayed, kept in a SQLite file.
+
+    Args:
+        path: Path of the index file, or ``:memory:`` for an index that
+            only lasts for the run
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        import sqlite3
+
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS replayed (transaction_id TEXT PRIMARY KEY)")
+
+    def contains(self, transaction_ids: Sequence[str]) -> List[bool]:
+        """
+        Check which transaction IDs were replayed.
+
+        Args:
+            transaction_ids: IDs to check
+
+        Returns:
+            Per ID, whether it is in the index
+        """
+        return [
+            self._conn.execute(
+                "SELECT 1 FROM replayed WHERE transaction_id = ?", (transaction_id,)
+            ).fetchone() is not None
+            for transaction_id in transaction_ids
+        ]
+
+    def add(self, transaction_ids: Sequence[str]) -> None:
+        """Record transaction IDs whose records were sent."""
+        if not transaction_ids:
+            return
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO replayed VALUES (?)", ((tid,) for tid in transaction_ids)
+            )
+        finally:
+            self._conn.execute("COMMIT")
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class BloomIndex:
+    """
+    Transaction IDs seen in this run, kept in a Bloom filter.
+
+    Args:
+        expected_records: Number of records the filter is sized for
+        false_positive_rate: Rate of new IDs reported as seen, at
+            ``expected_records``
+    """
+
+    def __init__(
+        self,
+        expected_records: int = DEFAULT_EXPECTED_RECORDS,
+        false_positive_rate: float = DEFAULT_FALSE_POSITIVE_RATE
+    ):
+        bits = max(int(-expected_records * math.log(false_positive_rate) / math.log(2) ** 2), 8)
+        self.size = bits
+        self.hashes = max(round(bits / expected_records * math.log(2)), 1)
+        self._bits = bytearray((bits + 7) // 8)
+
+    def _positions(self, transaction_id: str) -> Iterator[int]:
+        digest = hashlib.blake2b(transaction_id.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for index in range(self.hashes):
+            yield (first + index * second) % self.size
+
+    def contains(self, transaction_ids: Sequence[str]) -> List[bool]:
+        """
+        Check which transaction IDs may have been replayed.
+
+        Args:
+            transaction_ids: IDs to check
+
+        Returns:
+            Per ID, whether it may be in the filter; False is certain
+        """
+        bits = self._bits
+        return [
+            all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(transaction_id))
+            for transaction_id in transaction_ids
+        ]
+
+    def add(self, transaction_ids: Sequence[str]) -> None:
+        """Record transaction IDs whose records were sent."""
+        bits = self._bits
+        for transaction_id in transaction_ids:
+            for position in self._positions(transaction_id):
+                bits[position >> 3] |= 1 << (position & 7)
+
+    def close(self) -> None:
+        pass
+
+
+class ReplayStats:
+    """Counts of a replay run."""
+
+    __slots__ = ("read", "invalid", "duplicates", "sent", "failed", "retries")
+
+    def __init__(self):
+        self.read = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class _RateCap:
+    """Token bucket capping records per second; used by the reader thread only."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+
+    def acquire(self, count: int) -> None:
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, max(self.rate, count))
+            self._updated = now
+            if self._tokens >= count:
+                self._tokens -= count
+                return
+            time.sleep((count - self._tokens) / self.rate)
+
+
+def _open(path: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def _input_files(paths: Iterable[str]) -> Iterator[str]:
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith((".jsonl", ".jsonl.gz")):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def _rotate(paths: Iterable[str]) -> List[str]:
+    """Move JSONL files aside for replay, so nothing appends to them meanwhile."""
+    rotated = []
+    stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    for path in _input_files(paths):
+        if REPLAYING_MARKER in os.path.basename(path) or not path.endswith(".jsonl"):
+            # Left by an interrupted run, or not a spool file
+            rotated.append(path)
+            continue
+        target = f"{path[:-len('.jsonl')]}{REPLAYING_MARKER}{stamp}.jsonl"
+        os.replace(path, target)
+        logger.info("Moved %s to %s for replay", path, target)
+        rotated.append(target)
+    return rotated
+
+
+def iter_records(paths: Iterable[str], stats: Optional[ReplayStats] = None) -> Iterator[Record]:
+    """
+    Stream records from JSONL files and directories of them.
+
+    Args:
+        paths: Files or directories to read
+        stats: Optional stats counting read and invalid lines
+
+    Returns:
+        Iterator of records that have a ``transaction_id``
+    """
+    stats = stats or ReplayStats()
+    for path in _input_files(paths):
+        with _open(path) as lines:
+            for line_number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                stats.read += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if not isinstance(record, dict) or not record.get("transaction_id"):
+                    stats.invalid += 1
+                    logger.warning("Skipping invalid record at %s:%d", path, line_number)
+                    continue
+                yield record
+
+
+def _batches(records: Iterator[Record], batch_size: int) -> Iterator[List[Record]]:
+    batch: List[Record] = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _claim_new(
+    batch: List[Record],
+    index: Any,
+    index_lock: threading.Lock,
+    in_flight_ids: set,
+    bloom: bool
+) -> List[Record]:
+    """Get the records of a batch that weren't replayed and mark them in flight."""
+    transaction_ids = [record["transaction_id"] for record in batch]
+    new_records = []
+    with index_lock:
+        for record, transaction_id, seen in zip(batch, transaction_ids, index.contains(transaction_ids)):
+            if seen and bloom:
+                logger.warning(
+                    "Skipping %s as already replayed; with the Bloom filter this may be a false positive",
+                    transaction_id
+                )
+            if seen or transaction_id in in_flight_ids:
+                continue
+            in_flight_ids.add(transaction_id)
+            new_records.append(record)
+    return new_records
+
+
+def _release(records: List[Record], index: Any, index_lock: threading.Lock, in_flight_ids: set) -> None:
+    """Index records without sending them, for dry runs."""
+    transaction_ids = [record["transaction_id"] for record in records]
+    with index_lock:
+        index.add(transaction_ids)
+        in_flight_ids.difference_update(transaction_ids)
+
+
+def _default_send(record: Record) -> None:
+    from .sinks import _send_to_revenium
+    _send_to_revenium(record)
+
+
+def replay(
+    paths: Sequence[str],
+    index_path: Optional[str] = None,
+    rate: Optional[float] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = DEFAULT_WORKERS,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    retry_backoff_s: float = DEFAULT_RETRY_BACKOFF_S,
+    failed_path: Optional[str] = None,
+    expected_records: int = DEFAULT_EXPECTED_RECORDS,
+    false_positive_rate: float = DEFAULT_FALSE_POSITIVE_RATE,
+    dry_run: bool = False,
+    send: Optional[Callable[[Record], Any]] = None,
+    bloom: bool = False,
+    rotate: bool = False
+) -> ReplayStats:
+    """
+    Send the records of JSONL files to Revenium, skipping duplicates.
+
+    Args:
+        paths: Files or directories of records
+        index_path: SQLite file of replayed transaction IDs; without it,
+            duplicates are detected within the run only
+        rate: Maximum records sent per second (None for no cap)
+        batch_size: Records per batch handed to a worker
+        workers: Number of worker threads
+        max_retries: Retries of a failed record
+        retry_backoff_s: Delay before the first retry, doubled for each
+            further retry
+        failed_path: JSONL file receiving records that still failed
+        expected_records: Records the Bloom filter is sized for
+        false_positive_rate: Bloom filter false positive rate
+        dry_run: Count records and duplicates without sending anything or
+            writing the index
+        send: Callable sending one record, defaults to the Revenium client
+        bloom: Dedupe within the run with a Bloom filter instead of an
+            in-memory SQLite index when ``index_path`` isn't set; false
+            positives skip records that were never sent
+        rotate: Move each JSONL file aside before replaying it and remove
+            it once the run completes
+
+    Returns:
+        Counts of read, invalid, duplicate, sent and failed records
+    """
+    send = send or _default_send
+    stats = ReplayStats()
+    if index_path is not None and not dry_run:
+        index: Any = SQLiteIndex(index_path)
+    elif bloom:
+        index = BloomIndex(expected_records, false_positive_rate)
+    else:
+        index = SQLiteIndex()
+    rate_cap = _RateCap(rate) if rate else None
+    stats_lock = threading.Lock()
+    # Guards the index and the IDs handed to workers but not sent yet, which
+    # are skipped as duplicates without being indexed
+    index_lock = threading.Lock()
+    in_flight_ids = set()
+    failed_file: Optional[IO[str]] = None
+    rotated = _rotate(paths) if rotate and not dry_run else None
+    if rotated is not None:
+        paths = rotated
+
+    def send_batch(batch: List[Record]) -> List[Record]:
+        failed, sent_ids, retries = [], [], 0
+        try:
+            for record in batch:
+                for attempt in range(max_retries + 1):
+                    if attempt:
+                        retries += 1
+                        time.sleep(retry_backoff_s * 2 ** (attempt - 1))
+                    try:
+                        send(record)
+                    except Exception as e:
+                        logger.warning(f"Error sending record {record['transaction_id']}: {str(e)}")
+                        continue
+                    sent_ids.append(record["transaction_id"])
+                    break
+                else:
+                    failed.append(record)
+        finally:
+            # Only records that were sent are indexed, even if the batch was
+            # interrupted; the others are sent by the next run
+            with index_lock:
+                index.add(sent_ids)
+                in_flight_ids.difference_update(record["transaction_id"] for record in batch)
+            with stats_lock:
+                stats.sent += len(sent_ids)
+                stats.retries += retries
+        return failed
+
+    def handle_failed(future: "Future[List[Record]]") -> None:
+        nonlocal failed_file
+        failed = future.result()
+        if not failed:
+            return
+        stats.failed += len(failed)
+        if failed_path is not None:
+            if failed_file is None:
+                failed_file = open(failed_path, "a", encoding="utf-8")
+            for record in failed:
+                failed_file.write(json.dumps(record, default=str) + "\n")
+
+    last_progress = time.monotonic()
+    in_flight: Deque["Future[List[Record]]"] = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="revenium-replay") as executor:
+            try:
+                for batch in _batches(iter_records(paths, stats), batch_size):
+                    new_records = _claim_new(batch, index, index_lock, in_flight_ids, bloom)
+                    stats.duplicates += len(batch) - len(new_records)
+                    if not new_records:
+                        continue
+                    if dry_run:
+                        _release(new_records, index, index_lock, in_flight_ids)
+                        continue
+                    if rate_cap is not None:
+                        rate_cap.acquire(len(new_records))
+                    # Bound the batches in flight so memory stays constant
+                    while len(in_flight) >= workers * 2:
+                        handle_failed(in_flight.popleft())
+                    in_flight.append(executor.submit(send_batch, new_records))
+
+                    now = time.monotonic()
+                    if now - last_progress >= PROGRESS_INTERVAL_S:
+                        last_progress = now
+                        logger.info("Replay progress: %s", stats.as_dict())
+                while in_flight:
+                    handle_failed(in_flight.popleft())
+            finally:
+                # Interrupted: don't start the batches still queued; batches
+                # being sent index what they sent before the executor exits
+                for future in in_flight:
+                    future.cancel()
+    finally:
+        index.close()
+        if failed_file is not None:
+            failed_file.close()
+    if rotated is not None and (not stats.failed or failed_path is not None):
+        for path in rotated:
+            if REPLAYING_MARKER in os.path.basename(path):
+                os.remove(path)
+    return stats
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m revenium_middleware_ollama.replay",
+        description="Send spooled or exported metering records to Revenium."
+    )
+    parser.add_argument("paths", nargs="+", help="JSONL files or directories of them")
+    parser.add_argument("--index", help="SQLite file of replayed transaction IDs, kept across runs")
+    parser.add_argument("--rate", type=float, help="maximum records sent per second")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES)
+    parser.add_argument(
+        "--retry-backoff", type=float, default=DEFAULT_RETRY_BACKOFF_S,
+        help="seconds before the first retry, doubled for each further retry"
+    )
+    parser.add_argument("--failed", help="JSONL file receiving records that still failed")
+    parser.add_argument(
+        "--expected-records", type=int, default=DEFAULT_EXPECTED_RECORDS,
+        help="records the Bloom filter is sized for with --bloom"
+    )
+    parser.add_argument(
+        "--bloom", action="store_true",
+        help="dedupe with a Bloom filter when --index isn't set; may skip unsent records"
+    )
+    parser.add_argument("--false-positive-rate", type=float, default=DEFAULT_FALSE_POSITIVE_RATE)
+    parser.add_argument("--dry-run", action="store_true", help="count records without sending them")
+    parser.add_argument(
+        "--rotate", action="store_true",
+        help="move JSONL files aside before replaying them and remove them once done"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    stats = replay(
+        args.paths,
+        index_path=args.index,
+        rate=args.rate,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        max_retries=args.max_retries,
+        retry_backoff_s=args.retry_backoff,
+        failed_path=args.failed,
+        expected_records=args.expected_records,
+        false_positive_rate=args.false_positive_rate,
+        dry_run=args.dry_run,
+        bloom=args.bloom,
+        rotate=args.rotate
+    )
+    print(json.dumps(stats.as_dict()))
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
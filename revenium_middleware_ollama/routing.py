@@ -0,0 +1,313 @@
+"""
+Routing of Ollama calls across a pool of hosts.
+
+When a host pool is configured, the middleware sends each ``chat``,
+``generate`` and ``embed`` call to one of several Ollama hosts instead of the
+default client. Hosts are selected by least outstanding requests or by
+power-of-two-choices, weighted by their observed latency. With model
+affinity enabled, a model is preferably routed to hosts that served it
+recently, where it is most likely still loaded, to avoid cold loads.
+
+Health checks are passive: hosts that fail repeatedly (connection errors,
+timeouts and 5xx responses) are ejected for a cool-down period, and slow hosts are deprioritized through their latency
+average. The chosen host is recorded on each metering record.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from .instrumentation import uninstrument_client
+
+logger = logging.getLogger(__name__)
+
+# Environment variable names
+ENV_REVENIUM_OLLAMA_HOSTS = "REVENIUM_OLLAMA_HOSTS"
+ENV_REVENIUM_OLLAMA_ROUTING_STRATEGY = "REVENIUM_OLLAMA_ROUTING_STRATEGY"
+
+STRATEGY_LEAST_OUTSTANDING = "least_outstanding"
+STRATEGY_POWER_OF_TWO = "power_of_two"
+
+# Ollama unloads idle models after five minutes by default
+DEFAULT_AFFINITY_TTL_SECONDS = 300.0
+DEFAULT_MAX_FAILURES = 3
+DEFAULT_EJECTION_SECONDS = 30.0
+# Weight of the newest sample in the latency moving average
+LATENCY_EWMA_ALPHA = 0.2
+# Latency assumed for hosts without samples, so new hosts get traffic
+DEFAULT_LATENCY_S = 1.0
+
+
+def request_model(args: tuple, kwargs: Dict[str, Any]) -> str:
+    """
+    Get the model a call is made for.
+
+    Args:
+        args: Positional arguments of the call
+        kwargs: Keyword arguments of the call
+
+    Returns:
+        Model name, empty if not given
+    """
+    # model is the first parameter of ollama.chat, generate and embed
+    if "model" in kwargs:
+        return kwargs["model"] or ""
+    return args[0] if args else ""
+
+
+def is_host_failure(error: BaseException) -> bool:
+    """
+    Check whether an error says the host is unhealthy.
+
+    Errors about the request itself, such as a 404 for an unknown model or a
+    400 for a bad parameter, don't count against the host.
+
+    Args:
+        error: Exception raised by a call to the host
+
+    Returns:
+        True for connection errors, timeouts and 5xx responses
+    """
+    import httpx
+    from ollama import ResponseError
+    if isinstance(error, ResponseError):
+        return error.status_code >= 500
+    return isinstance(error, (ConnectionError, TimeoutError, httpx.TransportError))
+
+
+class OllamaHost:
+    """
+    State of a single Ollama host.
+
+    Args:
+        url: Base URL of the host, e.g. ``http://gpu-1:11434``
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.latency_s: Optional[float] = None
+        self.failures = 0
+        self.ejected_until = 0.0
+        self._served: Dict[str, float] = {}
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            from ollama import Client
+            # Calls to the host are made from inside an already metered call
+            self._client = uninstrument_client(Client(host=self.url))
+        return self._client
+
+    def is_available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def has_warm(self, model: str, now: float, ttl_s: float) -> bool:
+        served_at = self._served.get(model)
+        return served_at is not None and now - served_at < ttl_s
+
+    def score(self) -> float:
+        latency = self.latency_s if self.latency_s is not None else DEFAULT_LATENCY_S
+        return (self.outstanding + 1) * latency
+
+    def acquire(self) -> None:
+        with self._lock:
+            self.outstanding += 1
+
+    def abandon(self) -> None:
+        """End a call that failed for reasons unrelated to the host's health."""
+        with self._lock:
+            self.outstanding -= 1
+
+    def release(
+        self,
+        model: str,
+        elapsed_s: float,
+        error: bool,
+        max_failures: int,
+        ejection_s: float
+    ) -> None:
+        with self._lock:
+            self.outstanding -= 1
+            if error:
+                self.failures += 1
+                self._served.pop(model, None)
+                if self.failures >= max_failures:
+                    self.ejected_until = time.monotonic() + ejection_s
+                    self.failures = 0
+                    logger.warning(
+                        "Ejecting Ollama host %s for %.0fs after repeated failures",
+                        self.url, ejection_s
+                    )
+                return
+            self.failures = 0
+            self._served[model] = time.monotonic()
+            if self.latency_s is None:
+                self.latency_s = elapsed_s
+            else:
+                self.latency_s += LATENCY_EWMA_ALPHA * (elapsed_s - self.latency_s)
+
+
+class HostRouter:
+    """
+    Selects an Ollama host for every call and tracks host health.
+
+    Args:
+        hosts: Base URLs of the Ollama hosts
+        strategy: ``least_outstanding`` or ``power_of_two``
+        model_affinity: Prefer hosts that recently served the model
+        affinity_ttl_s: How long a served model is assumed to stay loaded
+        max_failures: Consecutive failures before a host is ejected
+        ejection_s: How long an ejected host receives no traffic
+    """
+
+    def __init__(
+        self,
+        hosts: Sequence[str],
+        strategy: str = STRATEGY_LEAST_OUTSTANDING,
+        model_affinity: bool = True,
+        affinity_ttl_s: float = DEFAULT_AFFINITY_TTL_SECONDS,
+        max_failures: int = DEFAULT_MAX_FAILURES,
+        ejection_s: float = DEFAULT_EJECTION_SECONDS
+    ):
+        if not hosts:
+            raise ValueError("At least one Ollama host is required")
+        if strategy not in (STRATEGY_LEAST_OUTSTANDING, STRATEGY_POWER_OF_TWO):
+            raise ValueError(f"Unknown routing strategy: {strategy}")
+        self.hosts: List[OllamaHost] = [OllamaHost(url) for url in hosts]
+        self.strategy = strategy
+        self.model_affinity = model_affinity
+        self.affinity_ttl_s = affinity_ttl_s
+        self.max_failures = max_failures
+        self.ejection_s = ejection_s
+
+    def select(self, model: str) -> OllamaHost:
+        """
+        Pick the host for a call.
+
+        Args:
+            model: Model the call is made for
+
+        Returns:
+            The selected host
+        """
+        now = time.monotonic()
+        candidates = [host for host in self.hosts if host.is_available(now)] or self.hosts
+        if self.model_affinity and model:
+            warm = [
+                host for host in candidates
+                if host.has_warm(model, now, self.affinity_ttl_s)
+            ]
+            candidates = warm or candidates
+        if self.strategy == STRATEGY_POWER_OF_TWO and len(candidates) > 2:
+            candidates = random.sample(candidates, 2)
+        return min(candidates, key=OllamaHost.score)
+
+    def call(self, host: OllamaHost, endpoint: str, args: tuple, kwargs: Dict[str, Any]):
+        """
+        Run a call on a host, tracking outstanding requests and health.
+
+        Streamed responses keep the host busy until the stream is exhausted
+        or closed.
+
+        Args:
+            host: Host returned by ``select()``
+            endpoint: The endpoint being called ('chat', 'generate', 'embed')
+            args: Positional arguments of the call
+            kwargs: Keyword arguments of the call
+
+        Returns:
+            The host client's response
+        """
+        model = request_model(args, kwargs)
+        host.acquire()
+        started = time.monotonic()
+        try:
+            response = getattr(host.client, endpoint)(*args, **kwargs)
+        except Exception as e:
+            self._release(host, model, started, e)
+            raise
+        if kwargs.get("stream") and hasattr(response, "__next__"):
+            return self._track_stream(response, host, model, started)
+        self._release(host, model, started, None)
+        return response
+
+    def _track_stream(self, stream: Iterator[Any], host: OllamaHost, model: str, started: float):
+        # A stream's latency is its time to first chunk, not its length
+        elapsed_s = None
+        error = None
+        try:
+            for chunk in stream:
+                if elapsed_s is None:
+                    elapsed_s = time.monotonic() - started
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # Closing early must release the host's connection too
+            if hasattr(stream, "close"):
+                stream.close()
+            self._release(host, model, started, error, elapsed_s)
+
+    def _release(
+        self,
+        host: OllamaHost,
+        model: str,
+        started: float,
+        error: Optional[BaseException],
+        elapsed_s: Optional[float] = None
+    ) -> None:
+        if error is not None and not is_host_failure(error):
+            host.abandon()
+            return
+        if elapsed_s is None:
+            elapsed_s = time.monotonic() - started
+        host.release(model, elapsed_s, error is not None, self.max_failures, self.ejection_s)
+
+
+_router: Optional[HostRouter] = None
+
+
+def get_host_router() -> Optional[HostRouter]:
+    """
+    Get the active host router.
+
+    Returns:
+        The router, or None when calls go to the default Ollama client
+    """
+    return _router
+
+
+def enable_host_routing(hosts: Sequence[str], **options) -> HostRouter:
+    """
+    Route metered Ollama calls across a pool of hosts.
+
+    Args:
+        hosts: Base URLs of the Ollama hosts
+        **options: Options passed to ``HostRouter``
+
+    Returns:
+        The active router
+    """
+    global _router
+    _router = HostRouter(hosts, **options)
+    return _router
+
+
+def disable_host_routing() -> None:
+    """Send calls to the default Ollama client again."""
+    global _router
+    _router = None
+
+
+if os.getenv(ENV_REVENIUM_OLLAMA_HOSTS):
+    enable_host_routing(
+        [host.strip() for host in os.environ[ENV_REVENIUM_OLLAMA_HOSTS].split(",") if host.strip()],
+        strategy=os.getenv(ENV_REVENIUM_OLLAMA_ROUTING_STRATEGY, STRATEGY_LEAST_OUTSTANDING)
+    )
@@ -0,0 +1,164 @@
+"""
+Destinations of metering records.
+
+The metering exporter fans every record out to one or more sinks. Each sink
+gets its own queue and worker thread, so a slow or failing sink doesn't
+stall the others. Available sinks:
+
+- ``ReveniumSink``: sends records to Revenium (the default)
+- ``FileSink`` (``file_sink.py``): rotating local JSONL or Parquet files
+- ``CallbackSink``: hands batches to a function, e.g. a Kafka producer
+- ``CollectorSink``: keeps records in memory, for tests
+
+A custom sink subclasses ``MeteringSink`` and implements ``export()``.
+Records are the ``create_completion`` arguments of each call.
+"""
+
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+Record = Dict[str, Any]
+
+
+class SinkError(Exception):
+    """
+    Raised by a sink that exported part of a batch.
+
+    Attributes:
+        records: The records that were not exported; only these are retried
+    """
+
+    def __init__(self, message: str, records: Sequence[Record]):
+        super().__init__(message)
+        self.records = records
+
+
+class MeteringSink:
+    """
+    Base class of metering record destinations.
+
+    Attributes:
+        name: Name of the sink in stats and ``sink_options``; unique per
+            exporter
+    """
+
+    name = "sink"
+
+    def export(self, records: Sequence[Record]) -> Optional[int]:
+        """
+        Export a batch of records.
+
+        Raising retries the whole batch, unless a ``SinkError`` names the
+        records that were not exported.
+
+        Args:
+            records: The records to export
+
+        Returns:
+            Optionally, the number of bytes sent
+        """
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Push out anything the sink buffers; called when its queue is idle."""
+
+    def close(self) -> None:
+        """Flush and release resources; called when the exporter stops."""
+        self.flush()
+
+
+def _send_to_revenium(completion_args: Record) -> None:
+    from . import middleware
+    middleware._load_metering()
+    middleware.client.ai.create_completion(**completion_args)
+
+
+class ReveniumSink(MeteringSink):
+    """
+    Sends records to Revenium.
+
+    Args:
+        send: Callable sending one record, defaults to the Revenium client
+    """
+
+    name = "revenium"
+
+    def __init__(self, send: Optional[Callable[[Record], Any]] = None):
+        self._send = send or _send_to_revenium
+
+    def export(self, records: Sequence[Record]) -> int:
+        sent_bytes = 0
+        for index, record in enumerate(records):
+            try:
+                self._send(record)
+            except Exception as e:
+                raise SinkError(str(e), records[index:]) from e
+            sent_bytes += len(json.dumps(record, default=str))
+        return sent_bytes
+
+
+class CallbackSink(MeteringSink):
+    """
+    Hands batches of records to a function.
+
+    Args:
+        callback: Function receiving a list of records
+        name: Name of the sink
+    """
+
+    def __init__(self, callback: Callable[[List[Record]], Any], name: str = "callback"):
+        self._callback = callback
+        self.name = name
+
+    def export(self, records: Sequence[Record]) -> None:
+        self._callback(list(records))
+
+
+class CollectorSink(MeteringSink):
+    """
+    Keeps exported records in memory, for tests.
+
+    Args:
+        name: Name of the sink
+    """
+
+    def __init__(self, name: str = "collector"):
+        self.name = name
+        self.records: List[Record] = []
+        self._condition = threading.Condition()
+
+    def export(self, records: Sequence[Record]) -> None:
+        with self._condition:
+            self.records.extend(records)
+            self._condition.notify_all()
+
+    def wait_for(self, count: int, timeout: float = 5.0) -> bool:
+        """
+        Wait until at least ``count`` records were collected.
+
+        Returns:
+            True if they were collected within ``timeout``
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while len(self.records) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def find(self, transaction_id: str) -> Optional[Record]:
+        """Get the collected record of a transaction, if any."""
+        with self._condition:
+            for record in self.records:
+                if record.get("transaction_id") == transaction_id:
+                    return record
+        return None
+
+    def clear(self) -> None:
+        """Forget the collected records."""
+        with self._condition:
+            self.records.clear()
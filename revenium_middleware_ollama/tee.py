@@ -0,0 +1,238 @@
+"""
+Fan-out of one metered stream to several concurrent consumers.
+
+``tee_stream()`` splits the stream returned by ``ollama.chat(stream=True)``
+or ``ollama.generate(stream=True)`` into independent iterators, for example
+one for a client websocket, one for a moderation checker and one for a
+transcript logger. Consumers can run in different threads. The underlying
+stream is read once, so the call is metered exactly once no matter how many
+consumers there are.
+
+Each consumer has a bounded buffer. Whichever consumer is ahead reads the
+next chunk from the stream; when another consumer's buffer is full, the
+slow-consumer policy decides what happens:
+
+- ``block``: wait until the slow consumer catches up, for at most
+  ``max_block_s`` (30 seconds by default), after which it is disconnected;
+- ``disconnect``: detach the slow consumer, whose next read raises
+  ``SlowConsumerError``.
+
+Closing a consumer detaches it. Once every consumer is closed, the stream is
+closed and metered as cancelled, like any abandoned stream.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+POLICY_BLOCK = "block"
+POLICY_DISCONNECT = "disconnect"
+
+DEFAULT_BUFFER_SIZE = 256
+# A consumer that stops reading without closing would otherwise stall the
+# others for good
+DEFAULT_MAX_BLOCK_S = 30.0
+
+
+class SlowConsumerError(Exception):
+    """Raised to a tee consumer that fell too far behind and was detached."""
+
+
+class _Consumer:
+    __slots__ = ("buffer", "active", "error")
+
+    def __init__(self):
+        self.buffer: Deque[Any] = deque()
+        self.active = True
+        self.error: Optional[BaseException] = None
+
+
+class StreamTee:
+    """
+    Splits one stream into several bounded consumers.
+
+    Args:
+        stream: The stream to split
+        consumers: Number of consumers
+        buffer_size: Maximum chunks buffered per consumer
+        policy: ``block`` or ``disconnect``
+        max_block_s: With ``block``, how long to wait for a slow consumer
+            before disconnecting it. None waits indefinitely, which
+            deadlocks the other consumers if one stops reading without
+            closing its iterator
+    """
+
+    def __init__(
+        self,
+        stream: Iterator[Any],
+        consumers: int = 2,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        policy: str = POLICY_BLOCK,
+        max_block_s: Optional[float] = DEFAULT_MAX_BLOCK_S
+    ):
+        if policy not in (POLICY_BLOCK, POLICY_DISCONNECT):
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        if consumers < 1 or buffer_size < 1:
+            raise ValueError("consumers and buffer_size must be at least 1")
+        self.buffer_size = buffer_size
+        self.policy = policy
+        self.max_block_s = max_block_s
+        self._stream = iter(stream)
+        self._consumers = [_Consumer() for _ in range(consumers)]
+        self._condition = threading.Condition()
+        self._pulling = False
+        self._finished = False
+        self._error: Optional[BaseException] = None
+
+    def iterators(self) -> List["TeeIterator"]:
+        """Get one iterator per consumer."""
+        return [TeeIterator(self, consumer) for consumer in self._consumers]
+
+    def _next(self, consumer: _Consumer) -> Any:
+        with self._condition:
+            while True:
+                if consumer.buffer:
+                    chunk = consumer.buffer.popleft()
+                    self._condition.notify_all()
+                    return chunk
+                if consumer.error is not None:
+                    raise consumer.error
+                if not consumer.active:
+                    raise StopIteration
+                if self._finished:
+                    if self._error is not None:
+                        raise self._error
+                    raise StopIteration
+                if self._pulling:
+                    self._condition.wait()
+                    continue
+                if self._wait_for_slow_consumers(consumer):
+                    continue
+                self._pulling = True
+                break
+
+        finished = False
+        error = None
+        try:
+            chunk = next(self._stream)
+        except StopIteration:
+            finished = True
+        except BaseException as e:
+            finished, error = True, e
+
+        with self._condition:
+            self._pulling = False
+            if finished:
+                self._finished = True
+                self._error = error
+            else:
+                for other in self._consumers:
+                    if other.active:
+                        other.buffer.append(chunk)
+            # Every consumer may have left while the chunk was read
+            abandoned = not self._finished and not any(other.active for other in self._consumers)
+            if abandoned:
+                self._finished = True
+            self._condition.notify_all()
+        if abandoned:
+            self._close_stream()
+        return self._next(consumer)
+
+    def _wait_for_slow_consumers(self, puller: _Consumer) -> bool:
+        """
+        Apply the slow-consumer policy; called with the condition held.
+
+        Returns:
+            True if the caller waited and must re-check its state
+        """
+        slow = [
+            other for other in self._consumers
+            if other is not puller and other.active and len(other.buffer) >= self.buffer_size
+        ]
+        if not slow:
+            return False
+        if self.policy == POLICY_BLOCK:
+            deadline = time.monotonic() + self.max_block_s if self.max_block_s is not None else None
+            while any(len(other.buffer) >= self.buffer_size and other.active for other in slow):
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            else:
+                return True
+        for other in slow:
+            if other.active and len(other.buffer) >= self.buffer_size:
+                logger.warning("Disconnecting slow stream consumer after %d buffered chunks", len(other.buffer))
+                other.active = False
+                other.buffer.clear()
+                other.error = SlowConsumerError(
+                    f"Consumer fell more than {self.buffer_size} chunks behind"
+                )
+        return True
+
+    def _close(self, consumer: _Consumer) -> None:
+        with self._condition:
+            consumer.active = False
+            consumer.buffer.clear()
+            self._condition.notify_all()
+            if self._finished or self._pulling or any(other.active for other in self._consumers):
+                return
+            self._finished = True
+        self._close_stream()
+
+    def _close_stream(self) -> None:
+        # The last consumer left; stop the stream so it is metered as cancelled
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+
+
+class TeeIterator:
+    """One consumer's view of a teed stream."""
+
+    def __init__(self, tee: StreamTee, consumer: _Consumer):
+        self._tee = tee
+        self._consumer = consumer
+
+    def __iter__(self) -> "TeeIterator":
+        return self
+
+    def __next__(self) -> Any:
+        return self._tee._next(self._consumer)
+
+    def close(self) -> None:
+        """Stop consuming; the other consumers continue."""
+        self._tee._close(self._consumer)
+
+    def __del__(self):
+        self.close()
+
+
+def tee_stream(
+    stream: Iterator[Any],
+    consumers: int = 2,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    policy: str = POLICY_BLOCK,
+    max_block_s: Optional[float] = DEFAULT_MAX_BLOCK_S
+) -> List[TeeIterator]:
+    """
+    Split a metered stream into several concurrent consumers.
+
+    Args:
+        stream: Stream returned by ``ollama.chat(stream=True)`` or
+            ``ollama.generate(stream=True)``
+        consumers: Number of consumers
+        buffer_size: Maximum chunks buffered per consumer
+        policy: ``block`` or ``disconnect``
+        max_block_s: With ``block``, how long to wait for a slow consumer
+            before disconnecting it; None waits indefinitely and deadlocks
+            the other consumers if one stops reading without closing
+
+    Returns:
+        One iterator per consumer
+    """
+    return StreamTee(stream, consumers, buffer_size, policy, max_block_s).iterators()
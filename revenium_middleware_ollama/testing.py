@@ -0,0 +1,52 @@
+"""
+Deterministic capture of metering records for tests.
+
+Metering normally runs on a background thread, so a test asserting on what
+was metered has to wait for it. ``capture_metering()`` swaps in a
+synchronous exporter feeding a ``CollectorSink``: every record is built and
+collected before the metered call (or the end of the stream) returns, and
+no thread is started::
+
+    from revenium_middleware_ollama.testing import capture_metering
+
+    with capture_metering() as metering:
+        ollama.chat(model="qwen2.5:0.5b", messages=messages)
+    assert metering.records[0]["input_token_count"] > 0
+
+The same collector is available as the ``revenium_metering`` pytest fixture
+(see ``pytest_plugin.py``). Records are the ``create_completion`` arguments
+of each call; nothing is sent to Revenium.
+"""
+
+from contextlib import contextmanager
+from typing import Iterator
+
+from . import exporter
+from .exporter import MeteringExporter
+from .sinks import CollectorSink
+
+
+@contextmanager
+def capture_metering() -> Iterator[CollectorSink]:
+    """
+    Collect metering records synchronously for the duration of the block.
+
+    The active metering exporter, if any, is set aside and restored
+    afterwards.
+
+    Yields:
+        The ``CollectorSink`` receiving the records
+    """
+    collector = CollectorSink()
+    capture = MeteringExporter(
+        sinks=[collector],
+        synchronous=True,
+        max_retries=0,
+        report_interval_s=None
+    )
+    previous, exporter._exporter = exporter._exporter, capture
+    try:
+        yield collector
+    finally:
+        exporter._exporter = previous
+        capture.stop()
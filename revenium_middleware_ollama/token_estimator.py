@@ -0,0 +1,223 @@
+"""
+Pre-flight prompt token estimation.
+
+Ollama only reports ``prompt_eval_count`` once a call completes, but rate
+limits, routing and context-overflow checks need the prompt size up front.
+The estimator measures the prompt text of a call (``messages``, ``prompt``,
+``system``, ``suffix`` or embed ``input``) in UTF-8 bytes and divides it by a
+bytes-per-token ratio learned per model from the counts Ollama reports, plus
+a fixed overhead per message for the chat template. For ASCII text a byte is
+a character, so the ratio is the familiar chars-per-token figure; measuring
+bytes keeps the ratio stable for scripts that tokenize densely.
+
+Measuring is a ``len()`` per message. Long texts that aren't ASCII are
+encoded once and their size kept in an LRU cache, so repeated system prompts
+cost a dictionary lookup.
+"""
+
+import functools
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from .cache import request_params
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BYTES_PER_TOKEN = 4.0
+DEFAULT_MESSAGE_OVERHEAD_TOKENS = 4
+DEFAULT_CALIBRATION_ALPHA = 0.1
+DEFAULT_TEXT_CACHE_SIZE = 256
+# Texts shorter than this are measured directly instead of cached
+MIN_CACHED_TEXT_LENGTH = 256
+# Calibration samples outside these ratios are ignored as outliers, e.g. when
+# Ollama reports only the part of a prompt it didn't have cached
+MIN_BYTES_PER_TOKEN = 0.5
+MAX_BYTES_PER_TOKEN = 16.0
+
+
+def _utf8_size(text: str) -> int:
+    return len(text.encode("utf-8", "surrogatepass"))
+
+
+class PromptTokenEstimator:
+    """
+    Estimates prompt tokens with per-model ratios calibrated online.
+
+    Args:
+        default_bytes_per_token: Ratio used for models without samples
+        message_overhead_tokens: Template tokens added per message or input
+        alpha: Weight of a new sample in the per-model ratio average
+        text_cache_size: Number of long texts whose size is cached
+    """
+
+    def __init__(
+        self,
+        default_bytes_per_token: float = DEFAULT_BYTES_PER_TOKEN,
+        message_overhead_tokens: int = DEFAULT_MESSAGE_OVERHEAD_TOKENS,
+        alpha: float = DEFAULT_CALIBRATION_ALPHA,
+        text_cache_size: int = DEFAULT_TEXT_CACHE_SIZE
+    ):
+        self.default_bytes_per_token = default_bytes_per_token
+        self.message_overhead_tokens = message_overhead_tokens
+        self.alpha = alpha
+        self._ratios: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._cached_size = functools.lru_cache(maxsize=text_cache_size)(_utf8_size)
+
+    def text_size(self, text: Any) -> int:
+        """Get the size of a text in UTF-8 bytes."""
+        if not isinstance(text, str):
+            return 0
+        if text.isascii():
+            return len(text)
+        if len(text) < MIN_CACHED_TEXT_LENGTH:
+            return _utf8_size(text)
+        return self._cached_size(text)
+
+    def measure(self, endpoint: str, args: tuple, kwargs: Dict[str, Any]) -> Tuple[int, int]:
+        """
+        Measure the prompt text of a call.
+
+        Args:
+            endpoint: The endpoint being called ('chat', 'generate', 'embed')
+            args: Positional arguments of the call
+            kwargs: Keyword arguments of the call
+
+        Returns:
+            Prompt size in bytes and the number of messages or inputs
+        """
+        if endpoint == "chat":
+            messages = request_params(endpoint, args, kwargs).get("messages") or ()
+            size = 0
+            for message in messages:
+                size += self.text_size(message.get("content"))
+            return size, len(messages)
+        if endpoint == "generate":
+            params = request_params(endpoint, args, kwargs)
+            size = sum(self.text_size(params.get(key)) for key in ("prompt", "system", "suffix"))
+            return size, 1
+        if endpoint == "embed":
+            inputs = kwargs.get("input", args[1] if len(args) > 1 else "")
+            if isinstance(inputs, str):
+                return self.text_size(inputs), 1
+            return sum(self.text_size(text) for text in inputs), len(inputs)
+        return 0, 0
+
+    def bytes_per_token(self, model: str) -> float:
+        """Get the calibrated ratio of a model."""
+        return self._ratios.get(model, self.default_bytes_per_token)
+
+    def estimate(self, model: str, size: int, parts: int) -> int:
+        """
+        Estimate the prompt tokens of a measured prompt.
+
+        Args:
+            model: Model the call is made for
+            size: Prompt size from ``measure()``
+            parts: Number of messages or inputs from ``measure()``
+
+        Returns:
+            Estimated prompt tokens
+        """
+        return round(size / self.bytes_per_token(model)) + parts * self.message_overhead_tokens
+
+    def calibrate(self, model: str, size: int, parts: int, prompt_tokens: int) -> None:
+        """
+        Update a model's ratio from the prompt tokens Ollama reported.
+
+        Args:
+            model: Model the call was made for
+            size: Prompt size from ``measure()``
+            parts: Number of messages or inputs from ``measure()``
+            prompt_tokens: ``prompt_eval_count`` reported by Ollama
+        """
+        text_tokens = prompt_tokens - parts * self.message_overhead_tokens
+        if not model or size <= 0 or text_tokens <= 0:
+            return
+        sample = size / text_tokens
+        if not MIN_BYTES_PER_TOKEN <= sample <= MAX_BYTES_PER_TOKEN:
+            logger.debug("Ignoring token calibration outlier for %s: %.2f bytes/token", model, sample)
+            return
+        with self._lock:
+            ratio = self._ratios.get(model)
+            self._ratios[model] = sample if ratio is None else ratio + self.alpha * (sample - ratio)
+
+
+def _response_text(response: Any) -> Any:
+    message = getattr(response, "message", None)
+    if message is not None:
+        return getattr(message, "content", None)
+    return getattr(response, "response", None)
+
+
+_estimator: Optional[PromptTokenEstimator] = None
+# Uncalibrated estimator for missing counts when estimation isn't enabled
+_default_estimator = PromptTokenEstimator()
+
+
+def get_token_estimator() -> Optional[PromptTokenEstimator]:
+    """
+    Get the active prompt token estimator.
+
+    Returns:
+        The estimator, or None when token estimation is disabled
+    """
+    return _estimator
+
+
+def enable_token_estimation(**options) -> PromptTokenEstimator:
+    """
+    Estimate prompt tokens of every call before it is sent.
+
+    The estimate is available as ``current_request().estimated_prompt_tokens``
+    while the call is dispatched, and with its error on
+    ``response._revenium_request_context`` once the response is metered.
+
+    Args:
+        **options: Options passed to ``PromptTokenEstimator``
+
+    Returns:
+        The active estimator
+    """
+    global _estimator
+    _estimator = PromptTokenEstimator(**options)
+    return _estimator
+
+
+def disable_token_estimation() -> None:
+    """Stop estimating prompt tokens."""
+    global _estimator
+    _estimator = None
+
+
+def fallback_estimator() -> PromptTokenEstimator:
+    """
+    Get the estimator used for counts Ollama didn't report.
+
+    Returns:
+        The active estimator, or an uncalibrated default
+    """
+    return _estimator or _default_estimator
+
+
+def estimate_completion_tokens(response: Any, streamed_chunks: int = 0) -> int:
+    """
+    Estimate output tokens of a response that has no ``eval_count``.
+
+    Streamed responses are counted by chunk, since Ollama streams one token
+    per chunk; other responses are estimated from their text.
+
+    Args:
+        response: The response, or the last chunk of a stream
+        streamed_chunks: Number of chunks the stream was made of
+
+    Returns:
+        Estimated output tokens
+    """
+    if streamed_chunks:
+        # The closing chunk carries the stats, not a token
+        return streamed_chunks - 1 if getattr(response, "done", False) else streamed_chunks
+    estimator = fallback_estimator()
+    size = estimator.text_size(_response_text(response))
+    return estimator.estimate(getattr(response, "model", None) or "", size, 0)
@@ -8,7 +8,9 @@ environment variables and validate them according to the specification.
 import os
 import re
 import logging
-from typing import Optional, Dict, Any
+import contextlib
+import threading
+from typing import Optional, Dict, Any, Iterator
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +38,37 @@ TRACE_TYPE_MAX_LENGTH = 128
 TRACE_NAME_MAX_LENGTH = 256
 TRACE_TYPE_PATTERN = re.compile(r'^[a-zA-Z0-9_-]+$')
 
+_env_cache = threading.local()
+
+
+def _getenv(name: str, default: Optional[str] = None) -> Optional[str]:
+    cache = getattr(_env_cache, "values", None)
+    if cache is None:
+        return os.getenv(name, default)
+    if name not in cache:
+        cache[name] = os.getenv(name)
+    value = cache[name]
+    return default if value is None else value
+
+
+@contextlib.contextmanager
+def cached_env() -> Iterator[None]:
+    """
+    Read each environment variable once within this block, on this thread.
+
+    Used when building many metering records at once, where reading the
+    environment for every record would dominate.
+    """
+    outer = getattr(_env_cache, "values", None)
+    if outer is not None:
+        yield
+        return
+    _env_cache.values = {}
+    try:
+        yield
+    finally:
+        _env_cache.values = None
+
 
 def get_environment() -> Optional[str]:
     """
@@ -50,9 +83,9 @@ def get_environment() -> Optional[str]:
         Environment name (e.g., 'production', 'staging') or None
     """
     return (
-        os.getenv(ENV_REVENIUM_ENVIRONMENT) or
-        os.getenv(ENV_ENVIRONMENT) or
-        os.getenv(ENV_DEPLOYMENT_ENV)
+        _getenv(ENV_REVENIUM_ENVIRONMENT) or
+        _getenv(ENV_ENVIRONMENT) or
+        _getenv(ENV_DEPLOYMENT_ENV)
     )
 
 
@@ -70,22 +103,22 @@ def get_region() -> Optional[str]:
         Region name (e.g., 'us-east-1', 'eastus') or None
     """
     # Try Revenium-specific env var first
-    region = os.getenv(ENV_REVENIUM_REGION)
+    region = _getenv(ENV_REVENIUM_REGION)
     if region:
         return region
     
     # Try AWS region
-    region = os.getenv(ENV_AWS_REGION) or os.getenv(ENV_AWS_DEFAULT_REGION)
+    region = _getenv(ENV_AWS_REGION) or _getenv(ENV_AWS_DEFAULT_REGION)
     if region:
         return region
     
     # Try Azure region
-    region = os.getenv(ENV_AZURE_REGION)
+    region = _getenv(ENV_AZURE_REGION)
     if region:
         return region
     
     # Try GCP region
-    region = os.getenv(ENV_GCP_REGION) or os.getenv(ENV_GOOGLE_CLOUD_REGION)
+    region = _getenv(ENV_GCP_REGION) or _getenv(ENV_GOOGLE_CLOUD_REGION)
     if region:
         return region
     
@@ -99,7 +132,7 @@ def get_credential_alias() -> Optional[str]:
     Returns:
         Credential alias (e.g., 'prod-api-key', 'staging-key') or None
     """
-    return os.getenv(ENV_REVENIUM_CREDENTIAL_ALIAS)
+    return _getenv(ENV_REVENIUM_CREDENTIAL_ALIAS)
 
 
 def get_trace_type() -> Optional[str]:
@@ -109,7 +142,7 @@ def get_trace_type() -> Optional[str]:
     Returns:
         Validated trace type or None if invalid/not set
     """
-    trace_type = os.getenv(ENV_REVENIUM_TRACE_TYPE)
+    trace_type = _getenv(ENV_REVENIUM_TRACE_TYPE)
     if trace_type:
         return validate_trace_type(trace_type)
     return None
@@ -122,7 +155,7 @@ def get_trace_name() -> Optional[str]:
     Returns:
         Validated trace name (truncated if needed) or None if not set
     """
-    trace_name = os.getenv(ENV_REVENIUM_TRACE_NAME)
+    trace_name = _getenv(ENV_REVENIUM_TRACE_NAME)
     if trace_name:
         return validate_trace_name(trace_name)
     return None
@@ -135,7 +168,7 @@ def get_parent_transaction_id() -> Optional[str]:
     Returns:
         Parent transaction ID or None
     """
-    return os.getenv(ENV_REVENIUM_PARENT_TRANSACTION_ID)
+    return _getenv(ENV_REVENIUM_PARENT_TRANSACTION_ID)
 
 
 def get_transaction_name(usage_metadata: Optional[Dict[str, Any]] = None) -> Optional[str]:
@@ -154,7 +187,7 @@ def get_transaction_name(usage_metadata: Optional[Dict[str, Any]] = None) -> Opt
         Transaction name or None
     """
     # First priority: env var
-    transaction_name = os.getenv(ENV_REVENIUM_TRANSACTION_NAME)
+    transaction_name = _getenv(ENV_REVENIUM_TRANSACTION_NAME)
     if transaction_name:
         return transaction_name
 
@@ -186,7 +219,7 @@ def get_retry_number() -> int:
         Retry number (0 for first attempt, 1+ for retries)
     """
     try:
-        return int(os.getenv(ENV_REVENIUM_RETRY_NUMBER, '0'))
+        return int(_getenv(ENV_REVENIUM_RETRY_NUMBER, '0'))
     except ValueError:
         logger.warning(
             "Invalid REVENIUM_RETRY_NUMBER value, defaulting to 0"
@@ -264,7 +297,8 @@ def validate_trace_name(trace_name: str) -> Optional[str]:
 
 def detect_operation_type(
     endpoint: str,
-    request_body: Optional[Dict[str, Any]] = None
+    request_body: Optional[Dict[str, Any]] = None,
+    has_tools: Optional[bool] = None
 ) -> str:
     """
     Auto-detect operation type from endpoint and request.
@@ -272,6 +306,8 @@ def detect_operation_type(
     Args:
         endpoint: API endpoint (e.g., 'chat', 'generate', 'embeddings')
         request_body: Optional request body to check for tools
+        has_tools: Whether the request declared tools, instead of checking
+            ``request_body``
 
     Returns:
         Operation type string ('CHAT', 'GENERATE', 'EMBED', 'TOOL_CALL')
@@ -281,7 +317,8 @@ def detect_operation_type(
     # Chat endpoint
     if endpoint == 'chat':
         # Check for tools in request
-        has_tools = request_body.get('tools')
+        if has_tools is None:
+            has_tools = request_body.get('tools')
         if has_tools:
             return 'TOOL_CALL'
         return 'CHAT'
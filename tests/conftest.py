@@ -2,9 +2,38 @@
 Pytest configuration and shared fixtures for Revenium Ollama middleware tests.
 """
 
+import asyncio
 import os
+import threading
+from unittest import mock
+
 import pytest
 
+from revenium_middleware_ollama import middleware
+
+pytest_plugins = ["revenium_middleware_ollama.pytest_plugin"]
+
+
+@pytest.fixture
+def metering_client(monkeypatch):
+    """
+    Run metering inline against a mock Revenium client.
+
+    Stubs every name ``middleware`` would otherwise import from
+    ``revenium_middleware``, so unit tests don't need that package.
+    """
+    client = mock.MagicMock()
+    monkeypatch.setattr(middleware, "client", client)
+    monkeypatch.setattr(middleware, "run_async_in_thread", lambda coro: asyncio.run(coro))
+    monkeypatch.setattr(middleware, "shutdown_event", threading.Event())
+    return client
+
+
+@pytest.fixture
+def create_completion(metering_client):
+    """The mock ``create_completion`` receiving each metering record."""
+    return metering_client.ai.create_completion
+
 
 @pytest.fixture(scope="function")
 def setup_integration_test():
@@ -0,0 +1,159 @@
+"""
+Tests for the exact-match response cache.
+"""
+
+import time
+from unittest import mock
+
+import pytest
+from ollama import ChatResponse, GenerateResponse
+
+from revenium_middleware_ollama import middleware
+from revenium_middleware_ollama.cache import (
+    MemoryCacheBackend,
+    ResponseCache,
+    SQLiteCacheBackend,
+    disable_response_cache,
+    enable_response_cache,
+    make_cache_key
+)
+
+DETERMINISTIC = {"temperature": 0}
+
+
+@pytest.fixture
+def response_cache():
+    """Enable an in-memory cache for the duration of a test."""
+    yield enable_response_cache()
+    disable_response_cache()
+
+
+def _chat_response(**overrides):
+    fields = dict(
+        model="qwen2.5:0.5b", done=True, done_reason="stop",
+        prompt_eval_count=12, eval_count=30,
+        message={"role": "assistant", "content": "positive"},
+    )
+    fields.update(overrides)
+    return ChatResponse(**fields)
+
+
+class TestCacheKey:
+    """Test canonical request hashing."""
+
+    def test_key_ignores_argument_style_and_order(self):
+        """Test that positional and keyword arguments hash the same."""
+        messages = [{"role": "user", "content": "Classify: great"}]
+        key_a = make_cache_key("chat", ("m", messages), {"options": {"temperature": 0, "seed": 1}})
+        key_b = make_cache_key("chat", (), {"options": {"seed": 1, "temperature": 0}, "messages": messages, "model": "m"})
+        assert key_a == key_b
+
+    def test_key_ignores_keep_alive(self):
+        """Test that non-semantic parameters don't affect the key."""
+        assert make_cache_key("generate", ("m", "p"), {}) == make_cache_key("generate", ("m", "p"), {"keep_alive": "5m"})
+
+    def test_key_depends_on_endpoint_and_format(self):
+        """Test that endpoint and format are part of the key."""
+        base = make_cache_key("generate", ("m", "p"), {})
+        assert base != make_cache_key("chat", ("m", "p"), {})
+        assert base != make_cache_key("generate", ("m", "p"), {"format": "json"})
+
+    def test_unhashable_request(self):
+        """Test that requests with unsupported values aren't cacheable."""
+        assert make_cache_key("generate", ("m", "p"), {"options": object()}) is None
+
+    def test_non_deterministic_requests_skipped(self):
+        """Test that only deterministic requests are cached by default."""
+        cache = ResponseCache()
+        assert cache.key_for("chat", ("m", []), {}) is None
+        assert cache.key_for("chat", ("m", []), {"options": {"temperature": 0.7}}) is None
+        assert cache.key_for("chat", ("m", []), {"options": {"seed": 42}}) is not None
+        assert ResponseCache(deterministic_only=False).key_for("chat", ("m", []), {}) is not None
+
+
+class TestBackends:
+    """Test LRU and TTL eviction for both backends."""
+
+    @pytest.fixture(params=["memory", "sqlite"])
+    def backend(self, request, tmp_path):
+        if request.param == "memory":
+            return MemoryCacheBackend(max_entries=2)
+        return SQLiteCacheBackend(str(tmp_path / "cache.db"), max_entries=2)
+
+    def test_lru_eviction(self, backend):
+        """Test that the least recently used entry is evicted."""
+        expires_at = time.time() + 60
+        backend.set("a", {"v": 1}, expires_at)
+        backend.set("b", {"v": 2}, expires_at)
+        time.sleep(0.01)
+        assert backend.get("a") == {"v": 1}
+        backend.set("c", {"v": 3}, expires_at)
+
+        assert backend.get("b") is None
+        assert backend.get("a") == {"v": 1}
+        assert backend.get("c") == {"v": 3}
+        assert len(backend) == 2
+
+    def test_ttl_expiry(self, backend):
+        """Test that expired entries are not returned."""
+        backend.set("a", {"v": 1}, time.time() - 1)
+        assert backend.get("a") is None
+        assert len(backend) == 0
+
+
+class TestCachedCalls:
+    """Test cache hits through the wrapper."""
+
+    def test_hit_skips_ollama_and_meters_cache_reads(self, metering_client, response_cache):
+        """Test that a repeated call is served from cache and metered as cached."""
+        wrapped = mock.Mock(side_effect=lambda *a, **kw: _chat_response())
+        kwargs = {"model": "qwen2.5:0.5b", "messages": [{"role": "user", "content": "x"}], "options": DETERMINISTIC}
+
+        first = middleware._metered_call(wrapped, (), dict(kwargs), "chat")
+        second = middleware._metered_call(wrapped, (), dict(kwargs), "chat")
+
+        assert wrapped.call_count == 1
+        assert second.message.content == "positive"
+        assert second is not first
+
+        miss, hit = [call.kwargs for call in metering_client.ai.create_completion.call_args_list]
+        assert miss["input_token_count"] == 12
+        assert miss["cache_read_token_count"] == 0
+        assert hit["input_token_count"] == 0
+        assert hit["output_token_count"] == 0
+        assert hit["cache_read_token_count"] == 42
+        assert hit["total_token_count"] == 42
+
+    def test_streaming_hit_replays_chunks(self, metering_client, response_cache):
+        """Test that streamed responses are cached as chunk lists."""
+        def stream(*args, **kwargs):
+            yield GenerateResponse(model="m", done=False, response="a")
+            yield GenerateResponse(model="m", done=True, done_reason="stop", response="b",
+                                   prompt_eval_count=3, eval_count=2)
+
+        wrapped = mock.Mock(side_effect=stream)
+        kwargs = {"model": "m", "prompt": "p", "stream": True, "options": DETERMINISTIC}
+
+        first = [chunk.response for chunk in middleware._metered_call(wrapped, (), dict(kwargs), "generate")]
+        second = [chunk.response for chunk in middleware._metered_call(wrapped, (), dict(kwargs), "generate")]
+
+        assert first == second == ["a", "b"]
+        assert wrapped.call_count == 1
+        hit = metering_client.ai.create_completion.call_args_list[-1].kwargs
+        assert hit["cache_read_token_count"] == 5
+        assert hit["is_streamed"] is True
+
+    def test_sqlite_backend_round_trip(self, metering_client, tmp_path):
+        """Test that the on-disk backend rebuilds response objects."""
+        enable_response_cache(path=str(tmp_path / "cache.db"))
+        try:
+            wrapped = mock.Mock(side_effect=lambda *a, **kw: _chat_response())
+            kwargs = {"model": "qwen2.5:0.5b", "messages": [], "options": {"seed": 7}}
+            middleware._metered_call(wrapped, (), dict(kwargs), "chat")
+            cached = middleware._metered_call(wrapped, (), dict(kwargs), "chat")
+        finally:
+            disable_response_cache()
+
+        assert wrapped.call_count == 1
+        assert isinstance(cached, ChatResponse)
+        assert cached.eval_count == 30
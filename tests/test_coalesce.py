@@ -0,0 +1,248 @@
+"""
+Tests for single-flight coalescing of identical concurrent requests.
+"""
+
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import pytest
+from ollama import ChatResponse, GenerateResponse
+
+from revenium_middleware_ollama import middleware
+from revenium_middleware_ollama.coalesce import (
+    SingleFlight,
+    disable_request_coalescing,
+    enable_request_coalescing
+)
+
+DETERMINISTIC = {"temperature": 0}
+
+
+@pytest.fixture
+def coalescing():
+    """Enable coalescing for the duration of a test."""
+    yield enable_request_coalescing()
+    disable_request_coalescing()
+
+
+def _run_concurrently(target, count):
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(index):
+        barrier.wait()
+        results[index] = target()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestSingleFlight:
+    """Test the coalescing primitive."""
+
+    def test_concurrent_calls_run_once(self):
+        """Test that concurrent callers share one execution."""
+        flight = SingleFlight()
+        calls = []
+
+        def work():
+            calls.append(1)
+            time.sleep(0.1)
+            return "result"
+
+        results = _run_concurrently(lambda: flight.do("k", work), 5)
+
+        assert len(calls) == 1
+        assert sorted(is_leader for _, is_leader in results) == [False] * 4 + [True]
+        assert {result for result, _ in results} == {"result"}
+
+    def test_exceptions_propagate_to_all_callers(self):
+        """Test that a failing leader fails its followers."""
+        flight = SingleFlight()
+
+        def work():
+            time.sleep(0.1)
+            raise ValueError("boom")
+
+        def call():
+            try:
+                flight.do("k", work)
+            except ValueError as e:
+                return str(e)
+
+        assert _run_concurrently(call, 3) == ["boom"] * 3
+
+    def test_stream_subscribers_each_get_all_chunks(self):
+        """Test that every subscriber replays the full stream once."""
+        flight = SingleFlight()
+        pulled = []
+
+        def source():
+            for i in range(3):
+                pulled.append(i)
+                yield GenerateResponse(model="m", response=str(i))
+
+        first, first_leads = flight.stream("k", source)
+        second, second_leads = flight.stream("k", source)
+
+        assert (first_leads, second_leads) == (True, False)
+        assert [c.response for c in first] == ["0", "1", "2"]
+        assert [c.response for c in second] == ["0", "1", "2"]
+        assert pulled == [0, 1, 2]
+
+    def test_abandoned_stream_is_closed(self):
+        """Test that the source is closed once every subscriber stops."""
+        flight = SingleFlight()
+        closed = []
+
+        def source():
+            try:
+                yield GenerateResponse(model="m", response="a")
+                yield GenerateResponse(model="m", response="b")
+            finally:
+                closed.append(True)
+
+        stream, _ = flight.stream("k", source)
+        next(stream)
+        stream.close()
+
+        assert closed == [True]
+        assert flight._flights == {}
+
+    def test_leader_starts_stream_eagerly(self):
+        """Test that the stream is started, and fails, inside stream()."""
+        flight = SingleFlight()
+        started = []
+
+        def source():
+            started.append(threading.current_thread())
+            return iter([GenerateResponse(model="m", response="a")])
+
+        stream, _ = flight.stream("k", source)
+        assert started == [threading.current_thread()]
+        assert [c.response for c in stream] == ["a"]
+
+        def refused():
+            raise ConnectionError("refused")
+
+        with pytest.raises(ConnectionError):
+            flight.stream("k", refused)
+        assert flight._flights == {}
+
+    def test_joiner_during_abandonment_keeps_stream(self):
+        """Test that a caller joining as the last one leaves isn't handed a dead flight."""
+        flight = SingleFlight()
+        joined = []
+
+        def source():
+            for i in range(3):
+                yield GenerateResponse(model="m", response=str(i))
+
+        stream, _ = flight.stream("k", source)
+        stream_flight = flight._flights["k"]
+        forget = stream_flight._on_finish
+
+        def join_then_forget():
+            if not joined:
+                joined.append(flight.stream("k", source))
+            forget()
+
+        stream_flight._on_finish = join_then_forget
+        next(stream)
+        stream.close()
+
+        (joiner, joiner_leads), = joined
+        assert not joiner_leads
+        assert [c.response for c in joiner] == ["0", "1", "2"]
+        assert flight._flights == {}
+
+    def test_asyncio_callers_share_thread_flights(self):
+        """Test that coroutines lead and follow flights alongside threads."""
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def work():
+            calls.append(threading.current_thread())
+            started.set()
+            release.wait(5)
+            return "shared"
+
+        async def main():
+            leader = asyncio.ensure_future(flight.do_async("k", work))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait)
+            followers = [asyncio.ensure_future(flight.do_async("k", work)) for _ in range(3)]
+            thread_result = []
+            thread = threading.Thread(target=lambda: thread_result.append(flight.do("k", work)))
+            thread.start()
+            await asyncio.sleep(0.1)
+            leader.cancel()
+            await asyncio.sleep(0.05)
+            release.set()
+            results = await asyncio.gather(*followers)
+            thread.join()
+            return results + thread_result
+
+        results = asyncio.run(main())
+        assert results == [("shared", False)] * 4
+        assert len(calls) == 1 and calls[0] is not threading.main_thread()
+
+
+class TestCoalescedCalls:
+    """Test coalescing through the wrapper."""
+
+    def test_followers_metered_separately(self, metering_client, coalescing):
+        """Test that each caller gets its own transaction ID and record."""
+        def generate(*args, **kwargs):
+            time.sleep(0.1)
+            return ChatResponse(model="m", done=True, done_reason="stop",
+                                prompt_eval_count=10, eval_count=20,
+                                message={"role": "assistant", "content": "ok"})
+
+        wrapped = mock.Mock(side_effect=generate)
+
+        def call():
+            return middleware._metered_call(
+                wrapped, (), {"model": "m", "messages": [], "options": DETERMINISTIC}, "chat"
+            )
+
+        responses = _run_concurrently(call, 4)
+
+        assert wrapped.call_count == 1
+        transaction_ids = {r._revenium_transaction_id for r in responses}
+        assert len(transaction_ids) == 4
+
+        records = [c.kwargs for c in metering_client.ai.create_completion.call_args_list]
+        assert {r["transaction_id"] for r in records} == transaction_ids
+        assert sorted(r["input_token_count"] for r in records) == [0, 0, 0, 10]
+        assert sorted(r["cache_read_token_count"] for r in records) == [0, 30, 30, 30]
+
+    def test_streaming_followers_receive_teed_chunks(self, metering_client, coalescing):
+        """Test that concurrent streaming callers share one stream."""
+        def stream(*args, **kwargs):
+            time.sleep(0.1)
+            yield GenerateResponse(model="m", done=False, response="a")
+            yield GenerateResponse(model="m", done=True, done_reason="stop", response="b",
+                                   prompt_eval_count=3, eval_count=2)
+
+        wrapped = mock.Mock(side_effect=stream)
+
+        def call():
+            chunks = middleware._metered_call(
+                wrapped, (), {"model": "m", "prompt": "p", "stream": True, "options": DETERMINISTIC},
+                "generate"
+            )
+            return [chunk.response for chunk in chunks]
+
+        assert _run_concurrently(call, 3) == [["a", "b"]] * 3
+        assert wrapped.call_count == 1
+        records = [c.kwargs for c in metering_client.ai.create_completion.call_args_list]
+        assert sorted(r["input_token_count"] for r in records) == [0, 0, 3]
+        assert len({r["transaction_id"] for r in records}) == 3
@@ -0,0 +1,122 @@
+"""
+Tests for per-model and per-host concurrency limits.
+"""
+
+import threading
+import time
+from unittest import mock
+
+import pytest
+from ollama import ChatResponse
+
+from revenium_middleware_ollama import middleware
+from revenium_middleware_ollama.concurrency import (
+    ConcurrencyLimiter,
+    ConcurrencyLimitTimeout,
+    FairSemaphore,
+    disable_concurrency_limit,
+    enable_concurrency_limit
+)
+
+
+class TestFairSemaphore:
+    """Test queue ordering of the fair semaphore."""
+
+    def _admission_order(self, semaphore, priorities):
+        order = []
+        threads = []
+        for index, priority in enumerate(priorities):
+            def wait(index=index, priority=priority):
+                semaphore.acquire(priority)
+                order.append(index)
+                semaphore.release()
+            thread = threading.Thread(target=wait)
+            thread.start()
+            threads.append(thread)
+            # Make sure waiters queue up in index order
+            while semaphore.waiting < index + 1:
+                time.sleep(0.001)
+        semaphore.release()
+        for thread in threads:
+            thread.join()
+        return order
+
+    def test_fifo_order(self):
+        """Test that waiters are admitted first come, first served."""
+        semaphore = FairSemaphore(1)
+        assert semaphore.acquire()
+        assert self._admission_order(semaphore, [0, 5, 1]) == [0, 1, 2]
+
+    def test_priority_order(self):
+        """Test that higher priorities are admitted first."""
+        semaphore = FairSemaphore(1, policy="priority")
+        assert semaphore.acquire()
+        assert self._admission_order(semaphore, [0, 5, 1, 5]) == [1, 3, 2, 0]
+
+    def test_timeout(self):
+        """Test that a waiter gives up and leaves the queue on timeout."""
+        semaphore = FairSemaphore(1)
+        assert semaphore.acquire()
+        assert semaphore.acquire(timeout=0.01) is False
+        assert semaphore.waiting == 0
+        semaphore.release()
+        assert semaphore.active == 0
+
+
+class TestConcurrencyLimiter:
+    """Test model and host caps."""
+
+    def test_model_limits_override_default(self):
+        """Test that per-model caps override the default cap."""
+        limiter = ConcurrencyLimiter(max_per_model=4, model_limits={"llama3:70b": 1}, timeout_s=0.01)
+        limiter.acquire("llama3:70b")
+        with pytest.raises(ConcurrencyLimitTimeout):
+            limiter.acquire("llama3:70b")
+        for _ in range(4):
+            limiter.acquire("qwen2.5:0.5b")
+
+    def test_host_cap_releases_model_slot_on_timeout(self):
+        """Test that a host timeout gives back the model slot."""
+        limiter = ConcurrencyLimiter(max_per_model=2, max_per_host=1, timeout_s=0.01)
+        limiter.acquire("a", "http://gpu-1")
+        with pytest.raises(ConcurrencyLimitTimeout):
+            limiter.acquire("a", "http://gpu-1")
+        assert limiter._models["a"].active == 1
+
+    def test_wait_time_is_measured(self):
+        """Test that permits report how long they queued."""
+        limiter = ConcurrencyLimiter(max_per_model=1)
+        permit = limiter.acquire("m")
+        threading.Timer(0.05, permit.release).start()
+        assert limiter.acquire("m").wait_ms >= 40
+
+    def test_stream_holds_slot_until_closed(self):
+        """Test that streaming calls keep their slot until closed."""
+        limiter = ConcurrencyLimiter(max_per_model=1)
+        permit = limiter.acquire("m")
+        stream = permit.hold(iter(["a", "b"]), is_streaming=True)
+        assert next(stream) == "a"
+        assert limiter._models["m"].active == 1
+        stream.close()
+        assert limiter._models["m"].active == 0
+
+
+class TestLimitedMetering:
+    """Test that queue wait is reported on the metering record."""
+
+    def test_queue_wait_in_metering_record(self, metering_client):
+        """Test that queue wait is metered separately from inference time."""
+        limiter = enable_concurrency_limit(max_per_model=1)
+        wrapped = mock.Mock(return_value=ChatResponse(
+            model="m", done=True, prompt_eval_count=1, eval_count=1,
+            message={"role": "assistant", "content": "ok"}
+        ))
+        try:
+            held = limiter.acquire("m")
+            threading.Timer(0.05, held.release).start()
+            middleware._metered_call(wrapped, ("m", []), {}, "chat")
+        finally:
+            disable_concurrency_limit()
+
+        record = metering_client.ai.create_completion.call_args.kwargs
+        assert record["extra_body"]["queue_wait_ms"] >= 40
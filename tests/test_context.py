@@ -0,0 +1,80 @@
+"""
+Tests for the per-call request context.
+"""
+
+import base64
+import tracemalloc
+from unittest import mock
+
+from ollama import ChatResponse, GenerateResponse, Image, Message
+
+from revenium_middleware_ollama import middleware
+from revenium_middleware_ollama.context import RequestContext, image_size
+
+
+class TestImageAccounting:
+    """Test counting and sizing request images without decoding them."""
+
+    def test_image_size(self, tmp_path):
+        """Test the decoded size of every image representation Ollama accepts."""
+        data = bytes(range(256)) * 4
+        path = tmp_path / "photo.png"
+        path.write_bytes(data)
+        encoded = base64.b64encode(data).decode()
+        assert encoded.endswith("==")
+
+        assert image_size(data) == image_size(bytearray(data)) == image_size(memoryview(data)) == len(data)
+        assert image_size(encoded) == len(data)
+        assert image_size(base64.b64encode(data[:-1]).decode()) == len(data) - 1
+        assert image_size(base64.b64encode(data[:-2]).decode()) == len(data) - 2
+        assert image_size(Image(value=data)) == len(data)
+        assert image_size(path) == image_size(str(path)) == len(data)
+        assert image_size(str(tmp_path / "missing.jpg")) == 0
+        assert image_size(None) == 0
+
+    def test_chat_images_are_metered(self, revenium_metering):
+        """Test that images across chat messages are counted on the record."""
+        messages = [
+            {"role": "user", "content": "what is this?", "images": [b"a" * 300, base64.b64encode(b"b" * 30).decode()]},
+            {"role": "assistant", "content": "a cat"},
+            Message(role="user", content="and this?", images=[Image(value=b"c" * 7)]),
+        ]
+        wrapped = mock.Mock(return_value=ChatResponse(
+            model="llava", done=True, prompt_eval_count=12, eval_count=3,
+            message={"role": "assistant", "content": "a dog"}
+        ))
+        response = middleware._metered_call(wrapped, ("llava", messages), {}, "chat")
+
+        (record,) = revenium_metering.records
+        assert (record["extra_body"]["image_count"], record["extra_body"]["image_bytes"]) == (3, 337)
+        request_context = response._revenium_request_context
+        assert (request_context.message_count, request_context.image_count) == (3, 3)
+
+    def test_generate_images_are_metered(self, revenium_metering):
+        """Test that generate images are counted and text-only calls have no image fields."""
+        wrapped = mock.Mock(return_value=GenerateResponse(model="llava", done=True, response="ok"))
+        middleware._metered_call(
+            wrapped, (), {"model": "llava", "prompt": "describe", "images": [b"a" * 10]}, "generate"
+        )
+        middleware._metered_call(wrapped, (), {"model": "llava", "prompt": "hello"}, "generate")
+
+        first, second = revenium_metering.records
+        assert (first["extra_body"]["image_count"], first["extra_body"]["image_bytes"]) == (1, 10)
+        assert "image_count" not in second["extra_body"]
+
+    def test_large_images_are_not_copied(self):
+        """Test that sizing large images allocates next to nothing."""
+        raw = b"\0" * (8 * 1024 * 1024)
+        encoded = base64.b64encode(raw).decode()
+        messages = [{"role": "user", "content": "", "images": [raw, encoded]} for _ in range(10)]
+        request_context = RequestContext("chat", "llava", "tx")
+
+        tracemalloc.start()
+        try:
+            request_context.describe_request(("llava", messages), {})
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        assert (request_context.image_count, request_context.image_bytes) == (20, 20 * len(raw))
+        assert peak < 64 * 1024
@@ -0,0 +1,171 @@
+"""
+Tests for micro-batching of concurrent embed calls.
+"""
+
+import threading
+from unittest import mock
+
+import pytest
+from ollama import EmbedResponse
+
+from revenium_middleware_ollama import middleware
+from revenium_middleware_ollama.embed_batcher import (
+    EmbedBatcher,
+    disable_embed_batching,
+    enable_embed_batching,
+    split_proportionally
+)
+
+
+def _fake_embed(model="", input=(), **kwargs):
+    inputs = [input] if isinstance(input, str) else list(input)
+    return EmbedResponse(
+        model=model,
+        embeddings=[[float(len(text))] for text in inputs],
+        prompt_eval_count=sum(len(text) for text in inputs)
+    )
+
+
+def _run_concurrently(targets):
+    barrier = threading.Barrier(len(targets))
+    results = [None] * len(targets)
+
+    def run(index):
+        barrier.wait()
+        results[index] = targets[index]()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(targets))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestSplitProportionally:
+    """Test proportional token sharing."""
+
+    def test_parts_sum_to_total(self):
+        """Test that shares always add up to the total."""
+        assert split_proportionally(10, [1, 1, 1]) == [4, 3, 3]
+        assert sum(split_proportionally(97, [5, 13, 2, 40])) == 97
+
+    def test_zero_weights(self):
+        """Test that zero weights fall back to an even split."""
+        assert split_proportionally(4, [0, 0]) == [2, 2]
+
+
+class TestEmbedBatcher:
+    """Test batching of concurrent calls."""
+
+    def test_concurrent_calls_share_one_request(self):
+        """Test that concurrent calls are sent as one batch and split back."""
+        batcher = EmbedBatcher(max_batch_size=16, max_wait_ms=100)
+        wrapped = mock.Mock(side_effect=_fake_embed)
+        texts = ["a", "bb", "cccc"]
+
+        results = _run_concurrently([
+            (lambda text=text: batcher.embed(wrapped, (), {"model": "nomic", "input": text}))
+            for text in texts
+        ])
+
+        assert wrapped.call_count == 1
+        assert sorted(wrapped.call_args.kwargs["input"]) == sorted(texts)
+        for text, result in zip(texts, results):
+            assert result.embeddings == [[float(len(text))]]
+            assert result.prompt_eval_count == len(text)
+
+    def test_full_batch_dispatches_early(self):
+        """Test that a full batch doesn't wait for the window."""
+        batcher = EmbedBatcher(max_batch_size=2, max_wait_ms=10_000)
+        wrapped = mock.Mock(side_effect=_fake_embed)
+
+        results = _run_concurrently([
+            lambda: batcher.embed(wrapped, ("nomic", "x"), {}),
+            lambda: batcher.embed(wrapped, ("nomic", "y"), {}),
+        ])
+
+        assert wrapped.call_count == 1
+        assert [r.embeddings for r in results] == [[[1.0]], [[1.0]]]
+
+    def test_models_are_batched_separately(self):
+        """Test that calls for different models never share a batch."""
+        batcher = EmbedBatcher(max_wait_ms=50)
+        wrapped = mock.Mock(side_effect=_fake_embed)
+
+        _run_concurrently([
+            lambda: batcher.embed(wrapped, (), {"model": "a", "input": "x"}),
+            lambda: batcher.embed(wrapped, (), {"model": "b", "input": "x"}),
+        ])
+
+        assert sorted(c.kwargs["model"] for c in wrapped.call_args_list) == ["a", "b"]
+
+    def test_errors_reach_every_caller(self):
+        """Test that a failed batch fails all of its calls."""
+        batcher = EmbedBatcher(max_wait_ms=50)
+        wrapped = mock.Mock(side_effect=RuntimeError("down"))
+
+        def call():
+            with pytest.raises(RuntimeError):
+                batcher.embed(wrapped, (), {"model": "m", "input": "x"})
+            return True
+
+        assert _run_concurrently([call, call]) == [True, True]
+
+    def test_split_errors_reach_every_caller(self):
+        """Test that a failure after the request still releases every call."""
+        batcher = EmbedBatcher(max_wait_ms=50)
+        wrapped = mock.Mock(side_effect=_fake_embed)
+
+        def call():
+            with pytest.raises(ValueError):
+                batcher.embed(wrapped, (), {"model": "m", "input": "x"})
+            return True
+
+        with mock.patch("revenium_middleware_ollama.embed_batcher.split_proportionally", side_effect=ValueError):
+            assert _run_concurrently([call, call]) == [True, True]
+
+    def test_batches_never_exceed_the_cap(self):
+        """Test that a call that doesn't fit starts a new batch."""
+        batcher = EmbedBatcher(max_batch_size=3, max_wait_ms=100)
+        wrapped = mock.Mock(side_effect=_fake_embed)
+
+        results = _run_concurrently([
+            (lambda: batcher.embed(wrapped, (), {"model": "m", "input": ["a", "b"]}))
+            for _ in range(3)
+        ])
+
+        assert wrapped.call_count == 3
+        assert all(len(c.kwargs["input"]) <= 3 for c in wrapped.call_args_list)
+        assert [r.embeddings for r in results] == [[[1.0], [1.0]]] * 3
+
+
+class TestBatchedEmbedMetering:
+    """Test metering of batched embed calls through the wrapper."""
+
+    def test_each_caller_metered_for_its_share(self, metering_client):
+        """Test that every caller gets its own record with its token share."""
+        enable_embed_batching(max_wait_ms=100)
+        wrapped = mock.Mock(side_effect=_fake_embed)
+        try:
+            _run_concurrently([
+                lambda: middleware._metered_call(wrapped, (), {"model": "m", "input": "abc"}, "embed"),
+                lambda: middleware._metered_call(wrapped, (), {"model": "m", "input": "a"}, "embed"),
+            ])
+        finally:
+            disable_embed_batching()
+
+        assert wrapped.call_count == 1
+        records = [c.kwargs for c in metering_client.ai.create_completion.call_args_list]
+        assert sorted(r["input_token_count"] for r in records) == [1, 3]
+        assert {r["operation_type"] for r in records} == {"EMBED"}
+        assert len({r["transaction_id"] for r in records}) == 2
+
+    def test_unbatched_embed_is_not_metered(self, metering_client):
+        """Test that embed calls pass through unmetered while batching is disabled."""
+        wrapped = mock.Mock(side_effect=_fake_embed)
+        response = middleware.embed_wrapper(wrapped, None, (), {"model": "m", "input": "abc"})
+
+        assert response.embeddings == [[3.0]]
+        assert not hasattr(response, "_revenium_transaction_id")
+        assert not metering_client.ai.create_completion.called
@@ -0,0 +1,342 @@
+"""
+Tests for the queued metering exporter and its stats.
+"""
+
+import gc
+import json
+import threading
+import weakref
+from unittest import mock
+
+import pytest
+from ollama import ChatResponse
+
+from revenium_middleware_ollama import middleware
+from revenium_middleware_ollama.exporter import (
+    MeteringExporter,
+    disable_metering_exporter,
+    enable_metering_exporter,
+    metering_stats
+)
+from revenium_middleware_ollama.file_sink import RECORD_FIELDS, FileSink
+from revenium_middleware_ollama.replay import iter_records, replay
+from revenium_middleware_ollama.sinks import MeteringSink
+
+
+def _record(transaction_id="tx"):
+    return lambda: {"transaction_id": transaction_id, "model": "m"}
+
+
+class TestMeteringExporter:
+    """Test queueing, retries, spooling and stats."""
+
+    def test_exports_in_batches(self):
+        """Test that queued records are exported and counted."""
+        send = mock.Mock()
+        exporter = MeteringExporter(batch_size=10, flush_interval_s=0.01, send=send)
+        on_done = mock.Mock()
+        for index in range(25):
+            exporter.submit(_record(f"tx-{index}"), on_done)
+        assert exporter.flush(5)
+        exporter.stop()
+
+        assert send.call_count == 25
+        assert on_done.call_count == 25
+        stats = exporter.stats()
+        assert stats["enqueued"] == stats["exported"] == 25
+        assert stats["queue_depth"] == 0
+        assert stats["batches"] >= 3
+        assert stats["batch_size"]["p99"] <= 10
+        assert stats["bytes_sent"] == sum(len(json.dumps(call.args[0])) for call in send.call_args_list)
+        assert stats["export_latency_s"]["p50"] > 0
+
+    def test_retries_then_spools(self, tmp_path):
+        """Test that records failing every retry are spooled."""
+        spool_path = tmp_path / "spool.jsonl"
+
+        def send(completion_args):
+            if completion_args["transaction_id"] == "lost":
+                raise ConnectionError
+
+        exporter = MeteringExporter(
+            flush_interval_s=0.01, max_retries=1, retry_backoff_s=0, spool_path=str(spool_path), send=send
+        )
+        exporter.submit(_record("ok"))
+        exporter.submit(_record("lost"))
+        assert exporter.flush(5)
+        exporter.stop()
+
+        stats = exporter.stats()
+        assert (stats["exported"], stats["retries"], stats["spooled"], stats["spool_backlog"]) == (1, 1, 1, 1)
+        assert [json.loads(line)["transaction_id"] for line in spool_path.read_text().splitlines()] == ["lost"]
+        assert MeteringExporter(spool_path=str(spool_path)).stats()["spool_backlog"] == 1
+        spool_path.unlink()
+        assert exporter.stats()["spool_backlog"] == 0
+
+    def test_replay_rotation_clears_spool_backlog(self, tmp_path):
+        """Test that the backlog restarts once replay moves the spool away."""
+        spool_path = tmp_path / "spool.jsonl"
+
+        def send(completion_args):
+            if completion_args["transaction_id"].startswith("lost"):
+                raise ConnectionError
+
+        exporter = MeteringExporter(
+            flush_interval_s=0.01, max_retries=0, report_interval_s=None, spool_path=str(spool_path), send=send
+        )
+        exporter.submit(_record("lost-1"))
+        assert exporter.flush(5)
+        replay([str(tmp_path)], send=mock.Mock(), rotate=True)
+        assert list(tmp_path.iterdir()) == []
+        assert exporter.stats()["spool_backlog"] == 0
+
+        exporter.submit(_record("lost-2"))
+        assert exporter.flush(5)
+        exporter.stop()
+        assert exporter.stats()["spool_backlog"] == 1
+
+    def test_stop_leaves_busy_worker_running(self):
+        """Test that a timed-out stop doesn't export alongside the worker."""
+        release = threading.Event()
+        exported = []
+
+        class SlowSink(MeteringSink):
+            name = "slow"
+            closed = False
+
+            def export(self, records):
+                release.wait(5)
+                exported.extend(record["transaction_id"] for record in records)
+
+            def close(self):
+                self.closed = True
+
+        sink = SlowSink()
+        exporter = MeteringExporter(sinks=[sink], batch_size=1, flush_interval_s=0.01, report_interval_s=None)
+        exporter.submit(_record("a"))
+        exporter.submit(_record("b"))
+        exporter.flush(0.1)
+        exporter.stop(timeout=0.05)
+
+        (sink_queue,) = exporter._sink_queues
+        assert sink_queue._thread is not None and sink_queue._thread.is_alive()
+        assert not sink.closed
+        release.set()
+        sink_queue._thread.join(5)
+        assert exported == ["a", "b"]
+        assert sink.closed
+        assert exporter.stats()["dropped"] == 0
+
+    def test_full_queue_drops(self):
+        """Test that records beyond the queue size are dropped."""
+        exporter = MeteringExporter(max_queue_size=2, flush_interval_s=60, report_interval_s=None, send=mock.Mock())
+        results = [exporter.submit(_record()) for _ in range(3)]
+        assert results == [True, True, False]
+        stats = exporter.stats()
+        assert (stats["queue_depth"], stats["dropped"]) == (2, 1)
+        assert stats["oldest_queued_s"] >= 0
+        exporter.stop()
+        assert exporter.stats()["exported"] == 2
+
+    def test_periodic_report(self):
+        """Test that the worker passes its stats to the reporter."""
+        reporter = mock.Mock()
+        exporter = MeteringExporter(flush_interval_s=0.01, report_interval_s=0, reporter=reporter, send=mock.Mock())
+        exporter.submit(_record())
+        assert exporter.flush(5)
+        exporter.stop()
+        assert reporter.called
+        assert "queue_depth" in reporter.call_args.args[0]
+
+
+class TestMiddlewareExport:
+    """Test that metered calls go through the exporter."""
+
+    def test_metered_call_is_queued(self, monkeypatch):
+        """Test that the record is built and sent by the exporter."""
+        send = mock.Mock()
+        run_async_in_thread = mock.Mock()
+        monkeypatch.setattr(middleware, "run_async_in_thread", run_async_in_thread)
+        exporter = enable_metering_exporter(flush_interval_s=0.01, send=send)
+        try:
+            response = ChatResponse(model="m", done=True, done_reason="stop", prompt_eval_count=3,
+                                    eval_count=2, message={"role": "assistant", "content": "ok"})
+            middleware._metered_call(mock.Mock(return_value=response), ("m", []), {}, "chat")
+            assert exporter.flush(5)
+            assert metering_stats()["exported"] == 1
+        finally:
+            disable_metering_exporter()
+
+        assert not run_async_in_thread.called
+        completion_args = send.call_args.args[0]
+        assert (completion_args["input_token_count"], completion_args["output_token_count"]) == (3, 2)
+        assert metering_stats() == {}
+
+    def test_request_is_not_retained_by_open_stream(self):
+        """Test that a stream being consumed doesn't keep the request payload alive."""
+        class Image:
+            pass
+
+        def responses():
+            yield ChatResponse(model="m", done=False, message={"role": "assistant", "content": "a"})
+            yield ChatResponse(model="m", done=True, done_reason="stop", prompt_eval_count=3, eval_count=2,
+                               message={"role": "assistant", "content": ""})
+
+        exporter = enable_metering_exporter(flush_interval_s=60, report_interval_s=None, send=mock.Mock())
+        try:
+            image = Image()
+            kwargs = {"messages": [{"role": "user", "content": "hi", "images": [image]}],
+                      "tools": [{"type": "function"}], "stream": True}
+            wrapped = mock.Mock(return_value=responses())
+            stream = middleware._metered_call(wrapped, ("m",), kwargs, "chat")
+            next(stream)
+            image_ref = weakref.ref(image)
+            del image, kwargs, wrapped
+            gc.collect()
+            assert image_ref() is None
+
+            list(stream)
+            assert exporter.flush(5)
+        finally:
+            disable_metering_exporter()
+
+        assert exporter.sinks[0]._send.call_args.args[0]["operation_type"] == "TOOL_CALL"
+
+    def test_response_is_not_retained_by_queued_record(self):
+        """Test that a record waiting for export doesn't keep the response alive."""
+        class Response(ChatResponse):
+            pass
+
+        exporter = enable_metering_exporter(flush_interval_s=60, report_interval_s=None, send=mock.Mock())
+        try:
+            response = Response(model="m", done=True, done_reason="stop", prompt_eval_count=3, eval_count=2,
+                                message={"role": "assistant", "content": "ok"})
+            middleware._metered_call(mock.Mock(return_value=response), ("m", []), {}, "chat")
+            response_ref = weakref.ref(response)
+            del response
+            gc.collect()
+
+            assert exporter.stats()["queue_depth"] == 1
+            assert response_ref() is None
+        finally:
+            disable_metering_exporter()
+
+
+class TestFileSink:
+    """Test writing records to local files."""
+
+    def test_exporter_writes_to_file_only(self, tmp_path):
+        """Test that records can go to a file instead of Revenium."""
+        sink = FileSink(str(tmp_path), buffer_records=1000)
+        exporter = MeteringExporter(flush_interval_s=0.01, file_sink=sink, send_to_revenium=False)
+        for index in range(5):
+            exporter.submit(_record(f"tx-{index}"))
+        assert exporter.flush(5)
+        exporter.stop()
+
+        stats = exporter.stats()
+        assert stats["exported"] == stats["sinks"]["file"]["exported"] == 5
+        assert list(stats["sinks"]) == ["file"]
+        assert stats["export_latency_s"]["p50"] > 0
+        (path,) = tmp_path.iterdir()
+        assert [record["transaction_id"] for record in iter_records([str(path)])] == [
+            f"tx-{index}" for index in range(5)
+        ]
+
+    def test_exporter_needs_a_destination(self):
+        """Test that disabling Revenium requires a file sink."""
+        with pytest.raises(ValueError):
+            MeteringExporter(send_to_revenium=False)
+
+    def test_rotation(self, tmp_path):
+        """Test that files rotate by size and are appended to in order."""
+        sink = FileSink(str(tmp_path), max_bytes=100, buffer_records=2)
+        for index in range(10):
+            sink.write({"transaction_id": f"tx-{index}", "model": "m"})
+        sink.close()
+
+        paths = sorted(tmp_path.iterdir())
+        assert len(paths) > 1
+        records = list(iter_records([str(tmp_path)]))
+        assert [record["transaction_id"] for record in records] == [f"tx-{index}" for index in range(10)]
+        assert sink.current_path is None
+
+    def test_complete_records_are_encoded_like_json(self, tmp_path):
+        """Test that records encoded column by column match json.dumps."""
+        records = []
+        for index, (value, extra_body) in enumerate([
+            (1, {"flag": 1}), (True, {"flag": True}), (None, {"flag": 1.5}), ("é\n", {"nested": {"a": [1]}}),
+        ]):
+            record = dict.fromkeys(RECORD_FIELDS, value)
+            record.update(transaction_id=f"tx-{index}", extra_body=extra_body, total_cost=float("nan"))
+            records.append(record)
+        sink = FileSink(str(tmp_path))
+        sink.write_batch(records)
+        sink.write_batch(records[:1])
+        sink.close()
+
+        (path,) = tmp_path.iterdir()
+        assert path.read_text(encoding="utf-8").splitlines() == [
+            json.dumps(record, default=str, separators=(",", ":")) for record in records + records[:1]
+        ]
+
+    def test_parquet(self, tmp_path):
+        """Test that Parquet files hold typed columns and JSON for nested fields."""
+        pq = pytest.importorskip("pyarrow.parquet")
+        sink = FileSink(str(tmp_path), format="parquet")
+        sink.write_batch([
+            {"transaction_id": "a", "input_token_count": 3, "trace_id": None, "subscriber": {"id": "s"}},
+            {"transaction_id": "b", "input_token_count": 4, "trace_id": "t", "subscriber": None},
+        ])
+        sink.close()
+
+        (path,) = tmp_path.iterdir()
+        table = pq.read_table(str(path)).to_pylist()
+        assert {name: table[0][name] for name in ("transaction_id", "input_token_count", "trace_id",
+                                                  "subscriber")} == {
+            "transaction_id": "a", "input_token_count": 3, "trace_id": None, "subscriber": '{"id":"s"}'
+        }
+        assert table[1]["trace_id"] == "t"
+
+    def test_parquet_complete_records(self, tmp_path):
+        """Test that complete records are written column by column."""
+        pq = pytest.importorskip("pyarrow.parquet")
+        records = [dict.fromkeys(RECORD_FIELDS) for _ in range(2)]
+        records[0].update(transaction_id="a", input_token_count=3, subscriber={"id": "s"}, is_streamed=True)
+        records[1].update(transaction_id="b", trace_id="t", extra_body={"image_count": 1})
+        sink = FileSink(str(tmp_path), format="parquet")
+        sink.write_batch(records)
+        sink.close()
+
+        (path,) = tmp_path.iterdir()
+        first, second = pq.read_table(str(path)).to_pylist()
+        assert first == dict(records[0], subscriber='{"id":"s"}')
+        assert second == dict(records[1], extra_body='{"image_count":1}')
+
+    def test_parquet_schema_has_every_field(self, tmp_path, caplog):
+        """Test that fields missing from the first record aren't dropped from the file."""
+        pq = pytest.importorskip("pyarrow.parquet")
+        sink = FileSink(str(tmp_path), format="parquet", buffer_records=1, max_bytes=0)
+        sink.write({"transaction_id": "a", "unknown": 1})
+        sink.write({"transaction_id": "b", "trace_id": "t", "extra_body": {"ollama_host": "h"}, "unknown": 2})
+        sink.close()
+
+        first, second = sorted(tmp_path.iterdir())
+        assert pq.read_table(str(first)).column_names == list(RECORD_FIELDS)
+        (record,) = pq.read_table(str(second)).to_pylist()
+        assert (record["trace_id"], record["extra_body"]) == ("t", '{"ollama_host":"h"}')
+        # Every file reports the fields it drops
+        assert caplog.text.count("Dropping fields missing from the Parquet schema") == 2
+
+    def test_record_fields_match_metered_records(self, revenium_metering):
+        """Test that the Parquet columns cover every field the middleware meters."""
+        response = ChatResponse(model="m", done=True, done_reason="stop", prompt_eval_count=3, eval_count=2,
+                                message={"role": "assistant", "content": "ok"})
+        middleware._metered_call(mock.Mock(return_value=response), ("m", []), {}, "chat")
+        (record,) = revenium_metering.records
+        assert list(record) == list(RECORD_FIELDS)
+
+    def test_unknown_format(self, tmp_path):
+        """Test that unknown formats are rejected."""
+        with pytest.raises(ValueError):
+            FileSink(str(tmp_path), format="csv")
@@ -0,0 +1,157 @@
+"""
+Tests for instrument()/uninstrument() and metering scopes.
+"""
+
+from unittest import mock
+
+import ollama
+import pytest
+from ollama import ChatResponse
+
+from revenium_middleware_ollama import middleware
+from revenium_middleware_ollama.cache import disable_response_cache, enable_response_cache
+from revenium_middleware_ollama.coalesce import disable_request_coalescing, enable_request_coalescing
+from revenium_middleware_ollama.routing import disable_host_routing, enable_host_routing
+from revenium_middleware_ollama.instrumentation import (
+    instrument,
+    instrument_client,
+    suppress_metering,
+    uninstrument,
+    uninstrument_client
+)
+from revenium_middleware_ollama.metrics import get_metrics_registry, disable_metrics
+
+
+class FakeClient(ollama.Client):
+    """Client answering chat calls without a server."""
+
+    def chat(self, model="", messages=None, **kwargs):
+        return ChatResponse(model=model, done=True, done_reason="stop",
+                            prompt_eval_count=3, eval_count=2,
+                            message={"role": "assistant", "content": "ok"})
+
+
+class HostClient(FakeClient):
+    """Client recording the chat calls it answers."""
+
+    def __init__(self, host):
+        super().__init__(host=host)
+        self.calls = 0
+
+    def chat(self, model="", messages=None, **kwargs):
+        self.calls += 1
+        return super().chat(model, messages, **kwargs)
+
+
+@pytest.fixture
+def restore_instrumentation():
+    yield
+    instrument()
+
+
+class TestInstrument:
+    """Test patching and restoring ollama functions."""
+
+    def test_uninstrument_restores_originals(self, restore_instrumentation):
+        """Test that uninstrumented functions are the original objects."""
+        assert hasattr(ollama.chat, "__wrapped__")
+        original = ollama.chat.__wrapped__
+        uninstrument()
+        assert ollama.chat is original
+        assert not hasattr(ollama.generate, "__wrapped__")
+        instrument()
+        assert ollama.chat.__wrapped__ is original
+
+    def test_instrument_is_idempotent(self):
+        """Test that instrumenting twice doesn't wrap twice."""
+        instrument()
+        instrument()
+        assert not hasattr(ollama.chat.__wrapped__, "__wrapped__")
+
+    def test_config_enables_features(self):
+        """Test that instrument() configures features by name."""
+        try:
+            instrument({"metrics": True})
+            assert get_metrics_registry() is not None
+            instrument({"metrics": False})
+            assert get_metrics_registry() is None
+        finally:
+            disable_metrics()
+        with pytest.raises(ValueError):
+            instrument({"unknown": True})
+
+
+class TestClientScoping:
+    """Test per-client opt-in and opt-out."""
+
+    def test_clients_are_not_metered_by_default(self, create_completion):
+        """Test that Client instances are left alone unless opted in."""
+        FakeClient().chat("m", [])
+        assert not create_completion.called
+
+    def test_instrument_client(self, create_completion):
+        """Test that a single client can be opted in and out again."""
+        client = instrument_client(FakeClient())
+        client.chat("m", [])
+        assert create_completion.call_count == 1
+        uninstrument_client(client)
+        client.chat("m", [])
+        assert create_completion.call_count == 1
+
+    def test_all_clients_with_one_opted_out(self, restore_instrumentation):
+        """Test class-level instrumentation with a client opted out."""
+        original = vars(ollama.Client)["chat"]
+        instrument(clients=True)
+        try:
+            metered, excluded = ollama.Client(), uninstrument_client(ollama.Client())
+            assert metered.chat.__wrapped__.__func__ is original
+            assert excluded.chat.__func__ is original
+        finally:
+            uninstrument()
+        assert vars(ollama.Client)["chat"] is original
+
+    def test_clients_keep_their_own_host(self, create_completion):
+        """Test that an instrumented client's calls aren't routed to the pool."""
+        router = enable_host_routing(["http://pool:11434"])
+        router.hosts[0]._client = mock.Mock()
+        try:
+            first = instrument_client(HostClient("http://first:11434"))
+            second = instrument_client(HostClient("http://second:11434"))
+            first.chat("m", [])
+            second.chat("m", [])
+        finally:
+            disable_host_routing()
+        assert (first.calls, second.calls) == (1, 1)
+        assert not router.hosts[0]._client.chat.called
+        assert create_completion.call_count == 2
+
+    def test_clients_do_not_share_responses(self, create_completion):
+        """Test that cached responses are only served to the same client."""
+        enable_response_cache()
+        enable_request_coalescing()
+        try:
+            first = instrument_client(HostClient("http://first:11434"))
+            second = instrument_client(HostClient("http://second:11434"))
+            options = {"temperature": 0}
+            first.chat("m", [], options=options)
+            second.chat("m", [], options=options)
+            first.chat("m", [], options=options)
+        finally:
+            disable_request_coalescing()
+            disable_response_cache()
+        assert (first.calls, second.calls) == (1, 1)
+
+
+class TestSuppressMetering:
+    """Test opting a code block out of metering."""
+
+    def test_suppressed_calls_are_not_metered(self, create_completion):
+        """Test that calls in the block reach Ollama without metering."""
+        wrapped = mock.Mock(return_value=None)
+        with suppress_metering():
+            middleware._metered_call(wrapped, ("m", []), {"usage_metadata": {"trace_id": "t"}}, "chat")
+        wrapped.assert_called_once_with("m", [])
+        assert not create_completion.called
+        client = instrument_client(FakeClient())
+        client.chat("m", [])
+        assert create_completion.call_count == 1
@@ -0,0 +1,122 @@
+"""
+Tests for traffic-driven keep_alive management and pre-warming.
+"""
+
+from unittest import mock
+
+from ollama import ChatResponse
+
+from revenium_middleware_ollama import middleware
+from revenium_middleware_ollama.keep_alive import (
+    KeepAliveManager,
+    disable_keep_alive_management,
+    enable_keep_alive_management,
+    normalize_model_name
+)
+
+
+def _manager(**options):
+    options.setdefault("warm_interval_s", None)
+    options.setdefault("hot_requests_per_minute", 6)
+    options.setdefault("cold_requests_per_minute", 0.2)
+    return KeepAliveManager(window_s=60, **options)
+
+
+class TestRequestRates:
+    """Test per-model request rate tracking."""
+
+    def test_rate_decays(self, monkeypatch):
+        """Test that the rate follows recent traffic."""
+        now = [1000.0]
+        monkeypatch.setattr("time.monotonic", lambda: now[0])
+        manager = _manager()
+        for _ in range(10):
+            manager.record("llama3.2")
+        assert manager.requests_per_minute("llama3.2") == 10
+        now[0] += 600
+        assert manager.requests_per_minute("llama3.2") < 0.01
+        assert manager.requests_per_minute("unknown") == 0
+
+    def test_keep_alive_tiers(self):
+        """Test hot, default and cold keep_alive hints."""
+        manager = _manager()
+        for _ in range(10):
+            manager.record("hot")
+        manager.record("warm")
+        assert manager.keep_alive_for("hot") == "30m"
+        assert manager.keep_alive_for("warm") is None
+        assert manager.keep_alive_for("cold") == "1m"
+        assert manager.hot_models() == ["hot"]
+
+    def test_caller_keep_alive_wins(self):
+        """Test that an explicit keep_alive is never overridden."""
+        manager = _manager()
+        kwargs = {"keep_alive": "5m"}
+        manager.apply("chat", ("m", []), kwargs, "m")
+        assert kwargs["keep_alive"] == "5m"
+        args = ("m", "text", None, None, -1)
+        kwargs = {}
+        manager.apply("embed", args, kwargs, "m")
+        assert "keep_alive" not in kwargs
+
+
+class TestPreWarming:
+    """Test pre-warming of evicted hot models."""
+
+    def test_warms_only_evicted_hot_models(self):
+        """Test that loaded and cold models are left alone."""
+        warm = mock.Mock()
+        manager = _manager(warm=warm, loaded_models=lambda: ["loaded:latest"])
+        for _ in range(10):
+            manager.record("loaded")
+            manager.record("evicted")
+        manager.record("cold")
+        assert manager.warm_evicted() == ["evicted"]
+        warm.assert_called_once_with("evicted", "30m")
+
+    def test_listing_errors_are_ignored(self):
+        """Test that an unreachable Ollama doesn't break the manager."""
+        manager = _manager(warm=mock.Mock(), loaded_models=mock.Mock(side_effect=ConnectionError))
+        for _ in range(10):
+            manager.record("m")
+        assert manager.warm_evicted() == []
+
+    def test_background_thread(self):
+        """Test that the background thread pre-warms periodically."""
+        warmed = mock.Mock()
+        manager = enable_keep_alive_management(
+            window_s=60, warm_interval_s=0.01, warm=warmed, loaded_models=lambda: []
+        )
+        try:
+            for _ in range(10):
+                manager.record("m")
+            for _ in range(200):
+                if warmed.called:
+                    break
+                manager._stop.wait(0.01)
+        finally:
+            disable_keep_alive_management()
+        warmed.assert_called_with("m", "30m")
+        assert manager._thread is None
+
+    def test_normalize_model_name(self):
+        """Test that untagged names match Ollama's loaded model names."""
+        assert normalize_model_name("llama3.2") == "llama3.2:latest"
+        assert normalize_model_name("qwen:7b") == "qwen:7b"
+
+
+class TestKeepAliveHints:
+    """Test keep_alive hints through the wrapper."""
+
+    def test_hint_is_sent_to_ollama(self, metering_client):
+        """Test that calls for rarely used models get a short keep_alive."""
+        enable_keep_alive_management(warm_interval_s=None)
+        wrapped = mock.Mock(return_value=ChatResponse(
+            model="m", done=True, prompt_eval_count=1, eval_count=1,
+            message={"role": "assistant", "content": "ok"}
+        ))
+        try:
+            middleware._metered_call(wrapped, ("m", []), {}, "chat")
+        finally:
+            disable_keep_alive_management()
+        assert wrapped.call_args.kwargs["keep_alive"] == "1m"
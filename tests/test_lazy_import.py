@@ -0,0 +1,41 @@
+"""
+Tests for deferred imports and patching.
+"""
+
+import subprocess
+import sys
+
+CHECK_LAZY_IMPORT = """
+import sys
+import revenium_middleware_ollama
+assert "ollama" not in sys.modules, "ollama imported eagerly"
+assert "revenium_middleware" not in sys.modules, "revenium_middleware imported eagerly"
+assert "opentelemetry" not in sys.modules, "opentelemetry imported eagerly"
+
+import ollama
+assert hasattr(ollama.chat, "__wrapped__"), "chat not patched"
+assert hasattr(ollama.generate, "__wrapped__"), "generate not patched"
+assert hasattr(ollama.embed, "__wrapped__"), "embed not patched"
+"""
+
+CHECK_PATCH_AFTER_OLLAMA = """
+import ollama
+import revenium_middleware_ollama
+assert hasattr(ollama.chat, "__wrapped__"), "chat not patched"
+"""
+
+
+def _run(code):
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+
+
+def test_import_defers_ollama_and_metering_client():
+    """Test that importing the package patches ollama only once it is imported."""
+    result = _run(CHECK_LAZY_IMPORT)
+    assert result.returncode == 0, result.stderr
+
+
+def test_patches_already_imported_ollama():
+    """Test that ollama imported before the package is patched immediately."""
+    result = _run(CHECK_PATCH_AFTER_OLLAMA)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,149 @@
+"""
+Tests for the in-process metrics registry and Prometheus exposition.
+"""
+
+import threading
+import urllib.request
+
+import pytest
+from revenium_middleware_ollama.metrics import (
+    CONTENT_TYPE,
+    Counter,
+    Histogram,
+    MetricsRegistry,
+    disable_metrics,
+    enable_metrics,
+    get_metrics_registry,
+    render_metrics,
+    start_metrics_server
+)
+
+
+@pytest.fixture
+def registry():
+    """Provide an enabled registry and disable it afterwards."""
+    disable_metrics()
+    yield enable_metrics(cold_load_threshold_ms=100)
+    disable_metrics()
+
+
+class TestShardedMetrics:
+    """Test per-thread counters and histograms."""
+
+    def test_counter_sums_across_threads(self):
+        """Test that increments from many threads are all collected."""
+        counter = Counter("test_total", "Test counter.")
+
+        def work():
+            for _ in range(1000):
+                counter.inc(("m", "CHAT"))
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert counter.collect() == {("m", "CHAT"): 8000}
+
+    def test_finished_thread_shards_are_retired(self):
+        """Test that shards of finished threads are folded into one total."""
+        counter = Counter("test_total", "Test counter.")
+        for _ in range(5):
+            thread = threading.Thread(target=counter.inc, args=(("m", "CHAT"), 2))
+            thread.start()
+            thread.join()
+
+        assert counter.collect() == {("m", "CHAT"): 10}
+        assert counter._shards == []
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test histogram exposition with cumulative buckets."""
+        histogram = Histogram("test_seconds", "Test histogram.", (0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(("m", "CHAT"), value)
+
+        lines = histogram.render()
+        assert 'test_seconds_bucket{model="m",operation_type="CHAT",le="0.1"} 2' in lines
+        assert 'test_seconds_bucket{model="m",operation_type="CHAT",le="1"} 3' in lines
+        assert 'test_seconds_bucket{model="m",operation_type="CHAT",le="+Inf"} 4' in lines
+        assert 'test_seconds_count{model="m",operation_type="CHAT"} 4' in lines
+        assert 'test_seconds_sum{model="m",operation_type="CHAT"} 3.65' in lines
+
+
+class TestMetricsRegistry:
+    """Test recording of Ollama responses."""
+
+    def test_observe_response(self, registry):
+        """Test tokens, latency, time to first token and cold loads."""
+        registry.observe_response(
+            "qwen2.5:0.5b", "CHAT", 12, 30, 0.4,
+            load_duration_ns=250_000_000, time_to_first_token_s=0.02
+        )
+        registry.observe_response("qwen2.5:0.5b", "CHAT", 8, 10, 0.2, load_duration_ns=1_000)
+
+        labels = ("qwen2.5:0.5b", "CHAT")
+        assert registry.requests.collect() == {labels: 2}
+        assert registry.input_tokens.collect() == {labels: 20}
+        assert registry.output_tokens.collect() == {labels: 40}
+        assert registry.cold_loads.collect() == {labels: 1}
+        assert registry.time_to_first_token.collect()[labels][-1] == 0.02
+
+    def test_queue_depth(self, registry):
+        """Test metering queue depth gauge."""
+        registry.metering_enqueued()
+        registry.metering_enqueued()
+        registry.metering_completed()
+        assert registry.queue_depth() == 1
+        assert "revenium_ollama_metering_queue_depth 1" in render_metrics()
+
+    def test_label_values_are_escaped(self, registry):
+        """Test that label values are escaped in exposition output."""
+        registry.observe_response('we"ird\\model', "GENERATE", 1, 1, 0.1)
+        assert 'model="we\\"ird\\\\model"' in render_metrics()
+
+    def test_disabled_by_default(self):
+        """Test that nothing is recorded until metrics are enabled."""
+        disable_metrics()
+        assert get_metrics_registry() is None
+        assert render_metrics() == ""
+
+
+class TestMetricsServer:
+    """Test the HTTP exposition endpoint."""
+
+    def test_serves_metrics(self):
+        """Test that /metrics returns the exposition text."""
+        registry = MetricsRegistry()
+        registry.observe_response("llama3.2", "GENERATE", 5, 7, 1.5)
+        server = start_metrics_server(port=0, addr="127.0.0.1", registry=registry)
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+            with urllib.request.urlopen(url) as response:
+                body = response.read().decode("utf-8")
+                assert response.headers["Content-Type"] == CONTENT_TYPE
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert 'revenium_ollama_output_tokens_total{model="llama3.2",operation_type="GENERATE"} 7' in body
+
+    def test_binds_localhost_by_default(self, monkeypatch):
+        """Test that the server only listens on localhost unless told otherwise."""
+        monkeypatch.delenv("REVENIUM_METRICS_ADDR", raising=False)
+        server = start_metrics_server(port=0, registry=MetricsRegistry())
+        try:
+            assert server.server_address[0] == "127.0.0.1"
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_addr_from_environment(self, monkeypatch):
+        """Test that REVENIUM_METRICS_ADDR sets the bind address."""
+        monkeypatch.setenv("REVENIUM_METRICS_ADDR", "0.0.0.0")
+        server = start_metrics_server(port=0, registry=MetricsRegistry())
+        try:
+            assert server.server_address[0] == "0.0.0.0"
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,139 @@
+"""
+Tests for OpenTelemetry span emission.
+"""
+
+import datetime
+from unittest import mock
+
+import pytest
+from ollama import ChatResponse
+
+pytest.importorskip("opentelemetry.sdk")
+
+from opentelemetry import trace as otel_trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from revenium_middleware_ollama import middleware, otel
+
+
+@pytest.fixture
+def span_exporter(monkeypatch):
+    """Route spans to an in-memory exporter through a local provider."""
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    monkeypatch.setattr(otel_trace, "get_tracer_provider", lambda: provider)
+    monkeypatch.setattr(otel, "_cached_provider", None)
+    yield exporter
+
+
+def _emit(**overrides):
+    request_time_dt = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+    kwargs = dict(
+        endpoint="chat",
+        model="qwen2.5:0.5b",
+        operation_type="CHAT",
+        request_time_dt=request_time_dt,
+        response_time_dt=request_time_dt + datetime.timedelta(seconds=2),
+        input_tokens=11,
+        output_tokens=22,
+        stop_reason="END",
+        transaction_id="ollama-123",
+    )
+    kwargs.update(overrides)
+    otel.emit_span(**kwargs)
+
+
+class TestSpanEmission:
+    """Test span attributes and linkage."""
+
+    def test_genai_attributes(self, span_exporter):
+        """Test that spans carry GenAI semantic-convention attributes."""
+        _emit(parent_transaction_id="parent-1")
+
+        (span,) = span_exporter.get_finished_spans()
+        assert span.name == "chat qwen2.5:0.5b"
+        assert span.kind == otel_trace.SpanKind.CLIENT
+        assert span.attributes["gen_ai.system"] == "ollama"
+        assert span.attributes["gen_ai.request.model"] == "qwen2.5:0.5b"
+        assert span.attributes["gen_ai.usage.input_tokens"] == 11
+        assert span.attributes["gen_ai.usage.output_tokens"] == 22
+        assert span.attributes["gen_ai.response.finish_reasons"] == ("END",)
+        assert span.attributes["revenium.transaction_id"] == "ollama-123"
+        assert span.attributes["revenium.parent_transaction_id"] == "parent-1"
+        assert span.end_time - span.start_time == 2_000_000_000
+
+    def test_generate_operation_name(self, span_exporter):
+        """Test that generate calls map to text_completion."""
+        _emit(endpoint="generate", operation_type="GENERATE")
+        (span,) = span_exporter.get_finished_spans()
+        assert span.attributes["gen_ai.operation.name"] == "text_completion"
+
+    def test_error_status(self, span_exporter):
+        """Test that ERROR stop reasons mark the span as failed."""
+        _emit(stop_reason="ERROR")
+        (span,) = span_exporter.get_finished_spans()
+        assert span.status.status_code == otel_trace.StatusCode.ERROR
+
+    def test_skipped_without_provider(self, monkeypatch):
+        """Test that no tracer is used when no SDK provider is configured."""
+        monkeypatch.setattr(
+            otel_trace, "get_tracer_provider", lambda: otel_trace.ProxyTracerProvider()
+        )
+        monkeypatch.setattr(otel, "_cached_provider", None)
+        assert otel._get_tracer() is None
+        _emit()
+
+
+class TestCallSpans:
+    """Test spans around metered calls."""
+
+    def test_span_is_current_during_call(self, span_exporter, metering_client):
+        """Test that the call runs inside its span, which ends once metered."""
+        current = []
+
+        def wrapped(*args, **kwargs):
+            current.append(otel_trace.get_current_span())
+            return ChatResponse(model="m", done=True, done_reason="stop", prompt_eval_count=3, eval_count=2,
+                                message={"role": "assistant", "content": "ok"})
+
+        middleware._metered_call(wrapped, ("m", []), {}, "chat")
+
+        (span,) = span_exporter.get_finished_spans()
+        assert current[0].get_span_context().span_id == span.context.span_id
+        assert span.attributes["gen_ai.usage.output_tokens"] == 2
+        assert not otel_trace.get_current_span().get_span_context().is_valid
+
+    def test_stream_closed_before_first_chunk(self, span_exporter, create_completion):
+        """Test that a stream closed before its first chunk still ends its span."""
+        def chunks():
+            yield ChatResponse(model="m", done=True, done_reason="stop",
+                               message={"role": "assistant", "content": "ok"})
+
+        stream = middleware._metered_call(
+            lambda *args, **kwargs: chunks(),
+            ("m", [{"role": "user", "content": "hello there"}]), {"stream": True}, "chat"
+        )
+        stream.close()
+
+        (span,) = span_exporter.get_finished_spans()
+        assert span.attributes["gen_ai.usage.input_tokens"] > 0
+        assert span.attributes["gen_ai.usage.output_tokens"] == 0
+        record = create_completion.call_args.kwargs
+        assert record["stop_reason"] == "CANCELLED"
+        assert record["input_token_count"] == span.attributes["gen_ai.usage.input_tokens"]
+
+    def test_failed_call_records_exception(self, span_exporter, metering_client):
+        """Test that a call that raises still ends its span, with the error."""
+        wrapped = mock.Mock(side_effect=ConnectionError("refused"))
+        with pytest.raises(ConnectionError):
+            middleware._metered_call(wrapped, ("m", []), {}, "chat")
+
+        (span,) = span_exporter.get_finished_spans()
+        assert span.status.status_code == otel_trace.StatusCode.ERROR
+        (event,) = span.events
+        assert event.name == "exception"
+        assert event.attributes["exception.type"] == "ConnectionError"
+
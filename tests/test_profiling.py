@@ -0,0 +1,105 @@
+"""
+Tests for per-stage timing of the middleware.
+"""
+
+from unittest import mock
+
+import pytest
+from ollama import ChatResponse
+
+from revenium_middleware_ollama import middleware
+from revenium_middleware_ollama.profiling import (
+    NULL_TIMER,
+    StageProfiler,
+    disable_stage_profiling,
+    enable_stage_profiling,
+    start_stage_timer
+)
+
+
+def _response(**fields):
+    return ChatResponse(model="m", done=True, done_reason="stop", prompt_eval_count=3,
+                        eval_count=2, message={"role": "assistant", "content": "ok"}, **fields)
+
+
+@pytest.fixture
+def profiler():
+    yield enable_stage_profiling(sample_rate=1.0)
+    disable_stage_profiling()
+
+
+class TestStageProfiler:
+    """Test sampling and the stage histogram."""
+
+    def test_sampling(self):
+        """Test that unsampled calls get a timer that records nothing."""
+        assert StageProfiler(sample_rate=0).start() is NULL_TIMER
+        assert StageProfiler(sample_rate=1).start().sampled
+        assert start_stage_timer() is NULL_TIMER
+        with pytest.raises(ValueError):
+            StageProfiler(sample_rate=2)
+
+    def test_snapshot(self):
+        """Test that percentiles come from the bucket bounds."""
+        profiler = StageProfiler(sample_rate=1)
+        for _ in range(99):
+            profiler.record("payload", 0.000003)
+        profiler.record("payload", 0.2)
+
+        summary = profiler.snapshot()["payload"]
+        assert summary["count"] == 100
+        assert summary["p50_s"] == 0.000005
+        assert summary["p99_s"] == 0.000005
+        assert summary["sum_s"] == pytest.approx(0.2 + 99 * 0.000003)
+        assert 'revenium_ollama_stage_duration_seconds_count{stage="payload"} 100' in profiler.render()
+
+    def test_callback_errors_are_contained(self):
+        """Test that a failing callback doesn't break recording."""
+        profiler = StageProfiler(sample_rate=1, callback=mock.Mock(side_effect=RuntimeError))
+        profiler.record("call", 0.1, "tx")
+        profiler.callback.assert_called_once_with("call", 0.1, "tx")
+        assert profiler.snapshot()["call"]["count"] == 1
+
+
+class TestMiddlewareStages:
+    """Test the stages recorded for metered calls."""
+
+    def test_non_streaming_call(self, profiler, create_completion):
+        """Test that every stage of a call is recorded once."""
+        profiler.callback = mock.Mock()
+        middleware._metered_call(mock.Mock(return_value=_response()), ("m", []), {}, "chat")
+
+        stages = [call.args[0] for call in profiler.callback.call_args_list]
+        # The test exporter runs inline, so the record is exported before
+        # the enqueue stage ends
+        assert stages == [
+            "metadata", "transaction_id", "prepare", "call",
+            "accounting", "payload", "export", "enqueue"
+        ]
+        transaction_id = create_completion.call_args.kwargs["transaction_id"]
+        assert {call.args[2] for call in profiler.callback.call_args_list[1:]} == {transaction_id}
+
+    def test_streaming_call(self, profiler, create_completion):
+        """Test that streams record wrapping and per-chunk wrapper time."""
+        chunks = [ChatResponse(model="m", done=False, message={"role": "assistant", "content": "a"}),
+                  _response()]
+        wrapped = mock.Mock(return_value=(chunk for chunk in chunks))
+        stream = middleware._metered_call(wrapped, ("m", []), {"stream": True}, "chat")
+        assert "stream_wrap" in profiler.snapshot()
+        assert "stream_chunks" not in profiler.snapshot()
+
+        list(stream)
+        assert set(profiler.snapshot()) == {
+            "metadata", "transaction_id", "prepare", "call", "stream_wrap",
+            "stream_chunks", "accounting", "enqueue", "payload", "export"
+        }
+
+    def test_unsampled_calls_record_nothing(self, create_completion):
+        """Test that a zero sample rate leaves the histogram empty."""
+        profiler = enable_stage_profiling(sample_rate=0)
+        try:
+            middleware._metered_call(mock.Mock(return_value=_response()), ("m", []), {}, "chat")
+            assert profiler.snapshot() == {}
+            assert create_completion.called
+        finally:
+            disable_stage_profiling()
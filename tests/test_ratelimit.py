@@ -0,0 +1,118 @@
+"""
+Tests for local per-tenant rate limiting.
+"""
+
+from unittest import mock
+
+import pytest
+from ollama import ChatResponse
+
+from revenium_middleware_ollama import middleware
+from revenium_middleware_ollama.ratelimit import (
+    RateLimitExceeded,
+    TenantRateLimiter,
+    disable_rate_limit,
+    enable_rate_limit,
+    tenant_key
+)
+
+TENANT_A = {"organization_id": "org-a", "subscriber": {"id": "user-1"}, "product_id": "p"}
+TENANT_B = {"organization_id": "org-b", "subscriber": {"id": "user-2"}, "product_id": "p"}
+
+
+class TestTenantKey:
+    """Test tenant identification from usage metadata."""
+
+    def test_tenant_key(self):
+        """Test that tenant keys use organization, subscriber and product."""
+        assert tenant_key(TENANT_A) == ("org-a", "user-1", "p")
+        assert tenant_key(None) == (None, None, None)
+
+
+class TestTenantRateLimiter:
+    """Test request and token buckets."""
+
+    def test_request_rate(self):
+        """Test that requests beyond the burst are refused."""
+        limiter = TenantRateLimiter(requests_per_second=2)
+        limiter.admit(TENANT_A)
+        limiter.admit(TENANT_A)
+        with pytest.raises(RateLimitExceeded) as exc_info:
+            limiter.admit(TENANT_A)
+        assert 0 < exc_info.value.retry_after <= 0.5
+        assert exc_info.value.tenant == ("org-a", "user-1", "p")
+
+    def test_zero_rates_are_rejected(self):
+        """Test that rates of zero are refused when the limiter is created."""
+        with pytest.raises(ValueError, match="requests_per_second"):
+            TenantRateLimiter(requests_per_second=0)
+        with pytest.raises(ValueError, match="tokens_per_minute for org-a"):
+            TenantRateLimiter(overrides={"org-a": {"tokens_per_minute": 0}})
+
+    def test_tenants_are_isolated(self):
+        """Test that one noisy tenant doesn't starve another."""
+        limiter = TenantRateLimiter(requests_per_second=1)
+        limiter.admit(TENANT_A)
+        with pytest.raises(RateLimitExceeded):
+            limiter.admit(TENANT_A)
+        limiter.admit(TENANT_B)
+
+    def test_tokens_charged_after_completion(self):
+        """Test that token usage is charged back and blocks once overdrawn."""
+        limiter = TenantRateLimiter(tokens_per_minute=100)
+        limiter.admit(TENANT_A)
+        limiter.charge(TENANT_A, 150)
+        with pytest.raises(RateLimitExceeded) as exc_info:
+            limiter.admit(TENANT_A)
+        assert "tokens per minute" in str(exc_info.value)
+        limiter.admit(TENANT_B)
+
+    def test_refill(self, monkeypatch):
+        """Test that buckets refill over time."""
+        now = [1000.0]
+        monkeypatch.setattr("time.monotonic", lambda: now[0])
+        limiter = TenantRateLimiter(requests_per_second=1, tokens_per_minute=60)
+        limiter.admit(TENANT_A)
+        limiter.charge(TENANT_A, 90)
+        now[0] += 31
+        limiter.admit(TENANT_A)
+
+    def test_max_wait_blocks_instead_of_raising(self):
+        """Test that callers can wait briefly for capacity."""
+        limiter = TenantRateLimiter(requests_per_second=20, request_burst=1, max_wait_s=1)
+        limiter.admit(TENANT_A)
+        limiter.admit(TENANT_A)
+
+    def test_overrides(self):
+        """Test per-organization limits."""
+        limiter = TenantRateLimiter(requests_per_second=1, overrides={"org-b": {"requests_per_second": 5}})
+        for _ in range(5):
+            limiter.admit(TENANT_B)
+
+    def test_tenant_state_is_bounded(self):
+        """Test that least recently seen tenants are evicted."""
+        limiter = TenantRateLimiter(requests_per_second=1, max_tenants=3)
+        for index in range(10):
+            limiter.admit({"organization_id": f"org-{index}"})
+        assert len(limiter._tenants) == 3
+
+
+class TestRateLimitedCalls:
+    """Test rate limiting through the wrapper."""
+
+    def test_refused_calls_never_reach_ollama(self, metering_client):
+        """Test that limits apply before the call and tokens are charged after."""
+        limiter = enable_rate_limit(tokens_per_minute=50)
+        wrapped = mock.Mock(return_value=ChatResponse(
+            model="m", done=True, prompt_eval_count=40, eval_count=20,
+            message={"role": "assistant", "content": "ok"}
+        ))
+        try:
+            middleware._metered_call(wrapped, ("m", []), {"usage_metadata": dict(TENANT_A)}, "chat")
+            with pytest.raises(RateLimitExceeded):
+                middleware._metered_call(wrapped, ("m", []), {"usage_metadata": dict(TENANT_A)}, "chat")
+        finally:
+            disable_rate_limit()
+
+        assert wrapped.call_count == 1
+        assert limiter._tenants[tenant_key(TENANT_A)].tokens < 0
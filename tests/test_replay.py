@@ -0,0 +1,156 @@
+"""
+Tests for replaying spooled metering records.
+"""
+
+import gzip
+import json
+import time
+from unittest import mock
+
+import pytest
+
+from revenium_middleware_ollama.replay import BloomIndex, iter_records, main, replay
+
+
+def _write(path, transaction_ids, opener=open):
+    with opener(path, "wt") as spool:
+        for transaction_id in transaction_ids:
+            spool.write(json.dumps({"transaction_id": transaction_id, "model": "m"}) + "\n")
+
+
+def _sent(send):
+    return sorted(call.args[0]["transaction_id"] for call in send.call_args_list)
+
+
+class TestReadingAndDedupe:
+    """Test streaming records and deduplicating them."""
+
+    def test_reads_directories_and_gzip(self, tmp_path):
+        """Test that directories are read in name order, including .gz files."""
+        _write(tmp_path / "a.jsonl", ["1", "2"])
+        _write(tmp_path / "b.jsonl.gz", ["3"], opener=gzip.open)
+        (tmp_path / "c.jsonl").write_text('not json\n\n{"model": "m"}\n')
+        (tmp_path / "notes.txt").write_text("ignored")
+
+        records = list(iter_records([str(tmp_path)]))
+        assert [record["transaction_id"] for record in records] == ["1", "2", "3"]
+
+    def test_bloom_index(self):
+        """Test that the Bloom filter reports added IDs."""
+        index = BloomIndex(expected_records=1000, false_positive_rate=0.01)
+        index.add(["a", "b"])
+        assert index.contains(["a", "b", "c"]) == [True, True, False]
+        seen = index.contains([f"id-{number}" for number in range(1000)])
+        assert sum(seen) <= 20
+
+    def test_bloom_skips_are_logged(self, tmp_path, caplog):
+        """Test that the opt-in Bloom filter logs every record it skips."""
+        _write(tmp_path / "spool.jsonl", ["1", "2", "1"])
+        send = mock.Mock()
+        stats = replay([str(tmp_path / "spool.jsonl")], batch_size=1, workers=1, bloom=True, send=send)
+        assert _sent(send) == ["1", "2"]
+        assert stats.duplicates == 1
+        assert "may be a false positive" in caplog.text
+
+
+class TestReplay:
+    """Test sending records."""
+
+    def test_dedupes_across_runs_with_index(self, tmp_path):
+        """Test that the SQLite index keeps replayed IDs across runs."""
+        _write(tmp_path / "spool.jsonl", ["1", "2", "2", "3"])
+        index_path = str(tmp_path / "index.sqlite")
+        send = mock.Mock()
+
+        stats = replay([str(tmp_path / "spool.jsonl")], index_path=index_path, batch_size=2, send=send)
+        assert _sent(send) == ["1", "2", "3"]
+        assert (stats.read, stats.duplicates, stats.sent) == (4, 1, 3)
+
+        _write(tmp_path / "more.jsonl", ["3", "4"])
+        stats = replay([str(tmp_path / "more.jsonl")], index_path=index_path, send=send)
+        assert _sent(send) == ["1", "2", "3", "4"]
+        assert stats.duplicates == 1
+
+    def test_interrupted_run_is_resumed(self, tmp_path):
+        """Test that records not sent before an interruption are sent by the next run."""
+        _write(tmp_path / "spool.jsonl", [str(number) for number in range(10)])
+        index_path = str(tmp_path / "index.sqlite")
+
+        def interrupt(record):
+            if record["transaction_id"] == "2":
+                raise KeyboardInterrupt
+
+        first_send = mock.Mock(side_effect=interrupt)
+        with pytest.raises(KeyboardInterrupt):
+            replay([str(tmp_path / "spool.jsonl")], index_path=index_path, batch_size=5, workers=1, send=first_send)
+        first_sent = [transaction_id for transaction_id in _sent(first_send) if transaction_id != "2"]
+        assert {"0", "1"} <= set(first_sent)
+
+        send = mock.Mock()
+        replay([str(tmp_path / "spool.jsonl")], index_path=index_path, batch_size=5, workers=1, send=send)
+        assert "2" in _sent(send)
+        # Every record is sent exactly once over both runs
+        assert sorted(first_sent + _sent(send)) == sorted(str(number) for number in range(10))
+
+    def test_failed_records_are_written_and_retried_later(self, tmp_path):
+        """Test that failed records leave the index and go to the failed file."""
+        _write(tmp_path / "spool.jsonl", ["1", "2"])
+        index_path = str(tmp_path / "index.sqlite")
+        failed_path = tmp_path / "failed.jsonl"
+        send = mock.Mock(side_effect=lambda record: record["transaction_id"] == "2" and 1 / 0)
+
+        stats = replay([str(tmp_path / "spool.jsonl")], index_path=index_path, max_retries=1,
+                       retry_backoff_s=0, failed_path=str(failed_path), send=send)
+        assert (stats.sent, stats.failed, stats.retries) == (1, 1, 1)
+        assert [json.loads(line)["transaction_id"] for line in failed_path.read_text().splitlines()] == ["2"]
+
+        send = mock.Mock()
+        replay([str(failed_path)], index_path=index_path, send=send)
+        assert _sent(send) == ["2"]
+
+    def test_rate_cap(self, tmp_path):
+        """Test that the rate cap spaces out batches."""
+        _write(tmp_path / "spool.jsonl", [str(number) for number in range(30)])
+        started = time.monotonic()
+        stats = replay([str(tmp_path / "spool.jsonl")], rate=20, batch_size=10, send=mock.Mock())
+        assert stats.sent == 30
+        # A one-second burst of 20 records, then 10 more at 20 per second
+        assert time.monotonic() - started >= 0.45
+
+    def test_dry_run_cli(self, tmp_path, capsys):
+        """Test that a dry run counts records without sending or indexing them."""
+        _write(tmp_path / "spool.jsonl", ["1", "1", "2"])
+        index_path = tmp_path / "index.sqlite"
+        assert main([str(tmp_path / "spool.jsonl"), "--index", str(index_path), "--dry-run"]) == 0
+        assert json.loads(capsys.readouterr().out) == {
+            "read": 3, "invalid": 0, "duplicates": 1, "sent": 0, "failed": 0, "retries": 0
+        }
+        assert not index_path.exists()
+
+    def test_retry_backoff_cli(self, tmp_path):
+        """Test that --retry-backoff reaches replay()."""
+        _write(tmp_path / "spool.jsonl", ["1"])
+        with mock.patch("revenium_middleware_ollama.replay.replay") as run:
+            run.return_value.failed = 0
+            run.return_value.as_dict.return_value = {}
+            assert main([str(tmp_path / "spool.jsonl"), "--retry-backoff", "0.25"]) == 0
+        assert run.call_args.kwargs["retry_backoff_s"] == 0.25
+
+    def test_rotate(self, tmp_path):
+        """Test that rotated spool files are removed once replayed, and kept after failures."""
+        spool_dir = tmp_path / "spool"
+        spool_dir.mkdir()
+        _write(spool_dir / "spool.jsonl", ["1", "2"])
+        index_path = str(tmp_path / "index.sqlite")
+        send = mock.Mock(side_effect=[None, ConnectionError])
+        stats = replay([str(spool_dir)], index_path=index_path, max_retries=0, send=send, rotate=True)
+
+        assert (stats.sent, stats.failed) == (1, 1)
+        (kept,) = spool_dir.iterdir()
+        assert kept.name.startswith("spool.replaying-") and kept.suffix == ".jsonl"
+
+        send = mock.Mock()
+        replay([str(spool_dir)], index_path=index_path, send=send, rotate=True)
+        assert _sent(send) == ["2"]
+        assert list(spool_dir.iterdir()) == []
+
@@ -0,0 +1,165 @@
+"""
+Tests for routing Ollama calls across a pool of hosts.
+"""
+
+import time
+from unittest import mock
+
+import pytest
+from ollama import ChatResponse, GenerateResponse, ResponseError
+
+from revenium_middleware_ollama import middleware
+from revenium_middleware_ollama.routing import (
+    HostRouter,
+    disable_host_routing,
+    enable_host_routing,
+    request_model
+)
+
+
+def _response(*args, **kwargs):
+    return ChatResponse(model="m", done=True, done_reason="stop",
+                        prompt_eval_count=1, eval_count=1,
+                        message={"role": "assistant", "content": "ok"})
+
+
+def _router(hosts=("http://a:11434", "http://b:11434"), **options):
+    router = HostRouter(list(hosts), **options)
+    for host in router.hosts:
+        host._client = mock.Mock()
+        host._client.chat.side_effect = _response
+    return router
+
+
+class TestHostSelection:
+    """Test host selection strategies."""
+
+    def test_request_model(self):
+        """Test model lookup from positional and keyword arguments."""
+        assert request_model(("llama3.2", []), {}) == "llama3.2"
+        assert request_model((), {"model": "qwen"}) == "qwen"
+        assert request_model((), {}) == ""
+
+    def test_least_outstanding(self):
+        """Test that the host with fewer outstanding calls is chosen."""
+        router = _router(model_affinity=False)
+        busy, idle = router.hosts
+        busy.acquire()
+        assert router.select("m") is idle
+
+    def test_latency_breaks_ties(self):
+        """Test that slow hosts are deprioritized."""
+        router = _router(model_affinity=False)
+        slow, fast = router.hosts
+        slow.latency_s, fast.latency_s = 2.0, 0.1
+        assert router.select("m") is fast
+
+    def test_power_of_two_picks_from_sample(self):
+        """Test that power-of-two-choices picks the better of two hosts."""
+        router = _router(hosts=("http://a", "http://b", "http://c"), strategy="power_of_two",
+                         model_affinity=False)
+        with mock.patch("random.sample", return_value=router.hosts[1:]):
+            router.hosts[1].acquire()
+            assert router.select("m") is router.hosts[2]
+
+    def test_model_affinity(self):
+        """Test that models stick to hosts that recently served them."""
+        router = _router()
+        warm = router.hosts[1]
+        router.call(warm, "chat", ("llama3.2", []), {})
+        warm.latency_s = 5.0
+        assert router.select("llama3.2") is warm
+        assert router.select("other-model") is router.hosts[0]
+
+    def test_unknown_strategy(self):
+        """Test that invalid strategies are rejected."""
+        with pytest.raises(ValueError):
+            HostRouter(["http://a"], strategy="random")
+
+
+class TestPassiveHealth:
+    """Test passive health tracking."""
+
+    def test_failing_host_is_ejected(self):
+        """Test that a host is ejected after repeated failures."""
+        router = _router(max_failures=2, model_affinity=False)
+        bad, good = router.hosts
+        bad._client.chat.side_effect = ConnectionError("down")
+        good.latency_s = 10.0
+
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                router.call(bad, "chat", ("m", []), {})
+
+        assert router.select("m") is good
+        assert bad.outstanding == 0
+
+    def test_request_errors_do_not_eject(self):
+        """Test that only connection errors, timeouts and 5xx count as failures."""
+        router = _router(max_failures=1, model_affinity=False)
+        host = router.hosts[0]
+        host._client.chat.side_effect = ResponseError("model not found", 404)
+
+        with pytest.raises(ResponseError):
+            router.call(host, "chat", ("m", []), {})
+        assert (host.failures, host.outstanding) == (0, 0)
+        assert host.is_available(time.monotonic())
+
+        host._client.chat.side_effect = ResponseError("overloaded", 503)
+        with pytest.raises(ResponseError):
+            router.call(host, "chat", ("m", []), {})
+        assert not host.is_available(time.monotonic())
+
+    def test_closed_stream_closes_source(self):
+        """Test that closing a routed stream early closes the host's stream."""
+        router = _router()
+        host = router.hosts[0]
+        closed = []
+
+        def source():
+            try:
+                yield GenerateResponse(model="m", response="a")
+                yield GenerateResponse(model="m", response="b")
+            finally:
+                closed.append(True)
+
+        # Held here so only an explicit close, not garbage collection, ends it
+        upstream = source()
+        host._client.generate.return_value = upstream
+        stream = router.call(host, "generate", ("m", "p"), {"stream": True})
+        next(stream)
+        stream.close()
+        assert closed == [True]
+        assert host.outstanding == 0
+
+    def test_stream_holds_host_until_consumed(self):
+        """Test that streams count as outstanding until finished."""
+        router = _router()
+        host = router.hosts[0]
+        host._client.generate.side_effect = lambda *a, **kw: iter(
+            [GenerateResponse(model="m", response="a"), GenerateResponse(model="m", response="b")]
+        )
+
+        stream = router.call(host, "generate", ("m", "p"), {"stream": True})
+        assert host.outstanding == 1
+        assert [chunk.response for chunk in stream] == ["a", "b"]
+        assert host.outstanding == 0
+
+
+class TestRoutedMetering:
+    """Test that routed calls record their host."""
+
+    def test_metering_record_includes_host(self, metering_client):
+        """Test that the chosen host is sent with the metering record."""
+        router = enable_host_routing(["http://gpu-1:11434"])
+        router.hosts[0]._client = mock.Mock()
+        router.hosts[0]._client.chat.side_effect = _response
+        wrapped = mock.Mock()
+        try:
+            middleware._metered_call(wrapped, ("m", []), {}, "chat")
+        finally:
+            disable_host_routing()
+
+        wrapped.assert_not_called()
+        record = metering_client.ai.create_completion.call_args.kwargs
+        assert record["extra_body"]["ollama_host"] == "http://gpu-1:11434"
@@ -0,0 +1,153 @@
+"""
+Tests for metering sinks and the exporter's per-sink queues.
+"""
+
+import threading
+from unittest import mock
+
+import pytest
+
+from revenium_middleware_ollama.exporter import MeteringExporter
+from revenium_middleware_ollama.sinks import (
+    CallbackSink,
+    CollectorSink,
+    MeteringSink,
+    ReveniumSink,
+    SinkError
+)
+
+
+def _record(transaction_id="tx"):
+    return lambda: {"transaction_id": transaction_id, "model": "m"}
+
+
+class _BlockedSink(MeteringSink):
+    """Sink that waits until released."""
+
+    name = "blocked"
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.records = []
+
+    def export(self, records):
+        self.release.wait(5)
+        self.records.extend(records)
+
+
+class TestFanOut:
+    """Test that every sink receives every record."""
+
+    def test_fan_out_to_all_sinks(self):
+        """Test that records reach every sink and are counted per sink."""
+        first, second = CollectorSink("first"), CollectorSink("second")
+        exporter = MeteringExporter(flush_interval_s=0.01, sinks=[first, second])
+        for index in range(5):
+            exporter.submit(_record(f"tx-{index}"))
+        assert exporter.flush(5)
+        exporter.stop()
+
+        assert [record["transaction_id"] for record in first.records] == [f"tx-{index}" for index in range(5)]
+        assert first.records == second.records
+        stats = exporter.stats()
+        assert stats["exported"] == 10
+        assert (stats["sinks"]["first"]["exported"], stats["sinks"]["second"]["exported"]) == (5, 5)
+
+    def test_slow_sink_does_not_stall_others(self):
+        """Test that a blocked sink only holds up its own queue."""
+        blocked, collector = _BlockedSink(), CollectorSink()
+        exporter = MeteringExporter(flush_interval_s=0.01, sinks=[blocked, collector])
+        for index in range(3):
+            exporter.submit(_record(f"tx-{index}"))
+
+        assert collector.wait_for(3, 5)
+        assert blocked.records == []
+        assert not exporter.flush(0.05)
+        blocked.release.set()
+        assert exporter.flush(5)
+        exporter.stop()
+        assert len(blocked.records) == 3
+
+    def test_sink_options(self):
+        """Test that queue options can be set per sink."""
+        blocked, collector = _BlockedSink(), CollectorSink()
+        exporter = MeteringExporter(
+            flush_interval_s=0.01, report_interval_s=None, sinks=[blocked, collector],
+            sink_options={"blocked": {"max_queue_size": 1, "batch_size": 1}}
+        )
+        for index in range(4):
+            exporter.submit(_record(f"tx-{index}"))
+        assert collector.wait_for(4, 5)
+        blocked.release.set()
+        assert exporter.flush(5)
+        exporter.stop()
+
+        stats = exporter.stats()["sinks"]
+        assert stats["collector"]["dropped"] == 0
+        assert stats["blocked"]["dropped"] > 0
+        assert stats["blocked"]["exported"] + stats["blocked"]["dropped"] == 4
+
+    def test_invalid_configuration(self):
+        """Test that duplicate names and unknown options are rejected."""
+        with pytest.raises(ValueError):
+            MeteringExporter(sinks=[CollectorSink(), CollectorSink()])
+        with pytest.raises(ValueError):
+            MeteringExporter(sinks=[CollectorSink()], sink_options={"missing": {}})
+        with pytest.raises(ValueError):
+            MeteringExporter(sinks=[CollectorSink()], sink_options={"collector": {"colour": 1}})
+        with pytest.raises(ValueError):
+            MeteringExporter(sinks=[])
+
+
+class TestSinks:
+    """Test the built-in sinks."""
+
+    def test_partial_failure_retries_the_rest(self):
+        """Test that only records named by a SinkError are retried."""
+        sent, failed = [], set()
+
+        def send(record):
+            if record["transaction_id"] == "b" and "b" not in failed:
+                failed.add("b")
+                raise ConnectionError
+            sent.append(record["transaction_id"])
+
+        exporter = MeteringExporter(
+            batch_size=10, flush_interval_s=0.01, retry_backoff_s=0, sinks=[ReveniumSink(send)]
+        )
+        for transaction_id in "abc":
+            exporter.submit(_record(transaction_id))
+        assert exporter.flush(5)
+        exporter.stop()
+
+        assert sorted(sent) == ["a", "b", "c"]
+        stats = exporter.stats()
+        assert (stats["exported"], stats["retries"], stats["failed"]) == (3, 1, 0)
+
+    def test_revenium_sink_reports_unsent_records(self):
+        """Test that ReveniumSink names the records it didn't send."""
+        records = [{"transaction_id": "a"}, {"transaction_id": "b"}, {"transaction_id": "c"}]
+        send = mock.Mock(side_effect=[None, ConnectionError])
+        with pytest.raises(SinkError) as excinfo:
+            ReveniumSink(send).export(records)
+        assert excinfo.value.records == records[1:]
+
+    def test_callback_sink(self):
+        """Test that CallbackSink passes whole batches."""
+        callback = mock.Mock()
+        exporter = MeteringExporter(batch_size=10, flush_interval_s=0.01, sinks=[CallbackSink(callback)])
+        for index in range(3):
+            exporter.submit(_record(f"tx-{index}"))
+        assert exporter.flush(5)
+        exporter.stop()
+        assert sum(len(call.args[0]) for call in callback.call_args_list) == 3
+
+    def test_collector_find_and_clear(self):
+        """Test looking up and forgetting collected records."""
+        collector = CollectorSink()
+        collector.export([{"transaction_id": "a"}, {"transaction_id": "b"}])
+        assert collector.find("b") == {"transaction_id": "b"}
+        assert collector.find("z") is None
+        assert not collector.wait_for(3, 0.01)
+        collector.clear()
+        assert collector.records == []
@@ -0,0 +1,342 @@
+"""
+Tests for metering of streamed responses.
+"""
+
+import asyncio
+import gc
+import threading
+import time
+from unittest import mock
+
+import pytest
+from ollama import ChatResponse, GenerateResponse
+
+from revenium_middleware_ollama import middleware
+from revenium_middleware_ollama.async_stream import aiter_stream
+from revenium_middleware_ollama.chunk_merging import (
+    ChunkMerger,
+    disable_chunk_merging,
+    enable_chunk_merging
+)
+from revenium_middleware_ollama.tee import DEFAULT_MAX_BLOCK_S, SlowConsumerError, StreamTee, tee_stream
+
+
+def _chunks(count=5):
+    return [
+        ChatResponse(model="m", done=False, message={"role": "assistant", "content": "a"})
+        for _ in range(count)
+    ] + [ChatResponse(model="m", done=True, done_reason="stop", prompt_eval_count=7,
+                      eval_count=count, message={"role": "assistant", "content": ""})]
+
+
+class _Upstream:
+    """Generator standing in for Ollama's stream that records being closed."""
+
+    def __init__(self, chunks):
+        self.closed = False
+        self._chunks = chunks
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._chunks:
+            raise StopIteration
+        return self._chunks.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+def _stream(upstream):
+    return middleware.handle_streaming_response(
+        upstream, middleware.datetime.datetime.now(middleware.datetime.timezone.utc),
+        {}, "tx-1", "chat", {"stream": True}
+    )
+
+
+class TestCancelledStreams:
+    """Test metering of streams the consumer didn't exhaust."""
+
+    def test_complete_stream(self, create_completion):
+        """Test that exhausted streams are metered once with Ollama's counts."""
+        assert len(list(_stream(_Upstream(_chunks())))) == 6
+        record = create_completion.call_args.kwargs
+        assert create_completion.call_count == 1
+        assert record["stop_reason"] == "END"
+        assert record["output_token_count"] == 5
+
+    def test_break_meters_partial_usage(self, create_completion):
+        """Test that a consumer breaking early is metered as cancelled."""
+        upstream = _Upstream(_chunks())
+        stream = _stream(upstream)
+        for index, _ in enumerate(stream):
+            if index == 2:
+                break
+        stream.close()
+
+        record = create_completion.call_args.kwargs
+        assert create_completion.call_count == 1
+        assert record["stop_reason"] == "CANCELLED"
+        assert record["output_token_count"] == 3
+        assert record["extra_body"]["token_count_source"] == "estimated"
+        assert upstream.closed
+
+    def test_garbage_collected_stream(self, create_completion):
+        """Test that abandoned streams are metered when collected."""
+        stream = _stream(_Upstream(_chunks()))
+        next(stream)
+        del stream
+        gc.collect()
+        assert create_completion.call_args.kwargs["stop_reason"] == "CANCELLED"
+
+    def test_close_after_final_chunk(self, create_completion):
+        """Test that closing after the final chunk is a normal completion."""
+        stream = _stream(_Upstream(_chunks(2)))
+        for _ in range(3):
+            next(stream)
+        stream.close()
+        assert create_completion.call_args.kwargs["stop_reason"] == "END"
+
+    def test_stream_closed_before_first_chunk(self, create_completion):
+        """Test that a stream closed before its first chunk is metered as cancelled."""
+        upstream = _Upstream(_chunks())
+        _stream(upstream).close()
+
+        record = create_completion.call_args.kwargs
+        assert create_completion.call_count == 1
+        assert record["stop_reason"] == "CANCELLED"
+        assert record["output_token_count"] == 0
+        assert upstream.closed
+
+
+class TestChunkMerging:
+    """Test merging of token chunks into frames."""
+
+    def test_merges_by_size(self):
+        """Test that frames close at max_chars and the final chunk passes through."""
+        merger = ChunkMerger(max_chars=2, max_interval_ms=10000)
+        chunks = _chunks(5)
+        frames = list(merger.merge(iter(chunks)))
+        assert [frame.message.content for frame in frames] == ["aa", "aa", "a", ""]
+        assert frames[-1] is chunks[-1]
+        assert frames[-1].eval_count == 5
+
+    def test_merges_by_time(self, monkeypatch):
+        """Test that frames close once they span max_interval_ms."""
+        now = [0.0]
+
+        def chunks():
+            for _ in range(4):
+                now[0] += 0.015
+                yield ChatResponse(model="m", done=False, message={"role": "assistant", "content": "ab"})
+
+        monkeypatch.setattr("time.monotonic", lambda: now[0])
+        merger = ChunkMerger(max_chars=1000, max_interval_ms=20)
+        assert [frame.message.content for frame in merger.merge(chunks())] == ["ababab", "ab"]
+
+    def test_generate_chunks_and_thinking(self):
+        """Test that generate responses and thinking text are merged."""
+        chunks = [
+            GenerateResponse(model="m", done=False, response="x", thinking="t")
+            for _ in range(3)
+        ]
+        frame, = ChunkMerger().merge(iter(chunks))
+        assert (frame.response, frame.thinking) == ("xxx", "ttt")
+
+    def test_tool_calls_are_not_merged(self):
+        """Test that tool call chunks are passed through unchanged."""
+        tool_chunk = ChatResponse(model="m", done=False, message={
+            "role": "assistant", "content": "",
+            "tool_calls": [{"function": {"name": "f", "arguments": {}}}]
+        })
+        chunks = _chunks(2)
+        chunks.insert(1, tool_chunk)
+        frames = list(ChunkMerger().merge(iter(chunks)))
+        assert frames[1] is tool_chunk
+        assert len(frames) == 4
+
+    def test_metering_counts_original_chunks(self, create_completion):
+        """Test that merging doesn't change the metered output tokens."""
+        chunks = _chunks(5)
+        chunks[-1].eval_count = None
+        enable_chunk_merging(max_chars=100, max_interval_ms=10000)
+        try:
+            stream = middleware._metered_call(
+                mock.Mock(return_value=(chunk for chunk in chunks)), ("m", []), {"stream": True}, "chat"
+            )
+            frames = list(stream)
+        finally:
+            disable_chunk_merging()
+        assert [frame.message.content for frame in frames] == ["aaaaa", ""]
+        assert frames[0]._revenium_transaction_id == frames[1]._revenium_transaction_id
+        assert create_completion.call_args.kwargs["output_token_count"] == 5
+
+
+class TestStreamTee:
+    """Test fan-out of one stream to several consumers."""
+
+    def test_consumers_see_every_chunk_and_metering_happens_once(self, create_completion):
+        """Test that concurrent consumers each get all chunks, metered once."""
+        first, second, third = tee_stream(_stream(_Upstream(_chunks(50))), consumers=3, buffer_size=4)
+        results = {}
+
+        def consume(name, iterator):
+            results[name] = [chunk.message.content for chunk in iterator]
+
+        threads = [
+            threading.Thread(target=consume, args=(name, iterator))
+            for name, iterator in (("a", first), ("b", second), ("c", third))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        assert results["a"] == results["b"] == results["c"] == ["a"] * 50 + [""]
+        assert create_completion.call_count == 1
+        assert create_completion.call_args.kwargs["stop_reason"] == "END"
+
+    def test_disconnect_policy(self, create_completion):
+        """Test that a slow consumer is detached while the others continue."""
+        fast, slow = tee_stream(_stream(_Upstream(_chunks(10))), buffer_size=3, policy="disconnect")
+        assert len(list(fast)) == 11
+        with pytest.raises(SlowConsumerError):
+            list(slow)
+        assert create_completion.call_count == 1
+
+    def test_block_policy_times_out(self):
+        """Test that blocking on a stalled consumer ends after max_block_s."""
+        fast, slow = tee_stream(iter(range(10)), buffer_size=2, max_block_s=0.01)
+        assert list(fast) == list(range(10))
+        with pytest.raises(SlowConsumerError):
+            next(slow)
+
+    def test_block_policy_is_bounded_by_default(self):
+        """Test that blocking has a finite default, and None waits until the slow consumer closes."""
+        assert StreamTee(iter(())).max_block_s == DEFAULT_MAX_BLOCK_S
+
+        fast, slow = tee_stream(iter(range(10)), buffer_size=2, max_block_s=None)
+        received = []
+        reader = threading.Thread(target=lambda: received.extend(fast))
+        reader.start()
+        reader.join(0.1)
+        assert reader.is_alive() and received == [0, 1]
+        slow.close()
+        reader.join(5)
+        assert received == list(range(10))
+
+    def test_closing_all_consumers_cancels_the_stream(self, create_completion):
+        """Test that the stream is closed and metered as cancelled once all consumers leave."""
+        upstream = _Upstream(_chunks())
+        first, second = tee_stream(_stream(upstream))
+        next(first)
+        first.close()
+        next(second)
+        second.close()
+        assert upstream.closed
+        assert create_completion.call_args.kwargs["stop_reason"] == "CANCELLED"
+
+    def test_errors_reach_every_consumer(self):
+        """Test that a stream error is raised to each consumer after its chunks."""
+        def failing():
+            yield 1
+            raise ConnectionError("lost")
+
+        first, second = tee_stream(failing())
+        assert next(first) == 1
+        with pytest.raises(ConnectionError):
+            next(first)
+        assert next(second) == 1
+        with pytest.raises(ConnectionError):
+            next(second)
+
+
+class TestAsyncIteration:
+    """Test async iteration of sync streams on the thread pool."""
+
+    def test_chunks_and_metering(self, create_completion):
+        """Test that all chunks arrive and the stream is metered once."""
+        async def consume():
+            return [chunk async for chunk in aiter_stream(_stream(_Upstream(_chunks(20))), prefetch=2)]
+
+        chunks = asyncio.run(consume())
+        assert len(chunks) == 21
+        assert create_completion.call_count == 1
+        assert create_completion.call_args.kwargs["stop_reason"] == "END"
+
+    def test_event_loop_is_not_blocked(self):
+        """Test that slow chunk reads run off the event loop."""
+        def slow():
+            for index in range(3):
+                time.sleep(0.05)
+                yield index
+
+        async def main():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.005)
+                    ticks += 1
+
+            task = asyncio.create_task(ticker())
+            chunks = [chunk async for chunk in aiter_stream(slow())]
+            task.cancel()
+            return chunks, ticks
+
+        chunks, ticks = asyncio.run(main())
+        assert chunks == [0, 1, 2]
+        assert ticks > 10
+
+    def test_prefetch_is_bounded(self):
+        """Test that at most prefetch chunks are read ahead."""
+        reads = []
+
+        def counting():
+            for index in range(100):
+                reads.append(index)
+                yield index
+
+        async def main():
+            iterator = aiter_stream(counting(), prefetch=3)
+            first = await iterator.__anext__()
+            await asyncio.sleep(0.05)
+            read_ahead = len(reads)
+            await iterator.aclose()
+            return first, read_ahead
+
+        first, read_ahead = asyncio.run(main())
+        assert first == 0
+        assert read_ahead <= 5
+
+    def test_early_exit_cancels_the_stream(self, create_completion):
+        """Test that leaving the loop early meters the stream as cancelled."""
+        upstream = _Upstream(_chunks(20))
+
+        async def main():
+            iterator = aiter_stream(_stream(upstream))
+            async for _ in iterator:
+                break
+            await iterator.aclose()
+            for _ in range(100):
+                if create_completion.called:
+                    break
+                await asyncio.sleep(0.01)
+
+        asyncio.run(main())
+        assert upstream.closed
+        assert create_completion.call_args.kwargs["stop_reason"] == "CANCELLED"
+
+    def test_errors_are_raised_to_the_consumer(self):
+        """Test that a stream error is raised from the async iterator."""
+        def failing():
+            yield 1
+            raise ConnectionError("lost")
+
+        async def main():
+            return [chunk async for chunk in aiter_stream(failing())]
+
+        with pytest.raises(ConnectionError):
+            asyncio.run(main())
@@ -0,0 +1,95 @@
+"""
+Tests for the synchronous metering test harness.
+"""
+
+import threading
+from unittest import mock
+
+from ollama import ChatResponse
+
+from revenium_middleware_ollama import middleware
+from revenium_middleware_ollama.exporter import (
+    disable_metering_exporter,
+    enable_metering_exporter,
+    get_metering_exporter
+)
+from revenium_middleware_ollama.testing import capture_metering
+
+
+def _response(prompt_eval_count=3, eval_count=2):
+    return ChatResponse(model="m", done=True, done_reason="stop", prompt_eval_count=prompt_eval_count,
+                        eval_count=eval_count, message={"role": "assistant", "content": "ok"})
+
+
+def _chunks(count):
+    return [
+        ChatResponse(model="m", done=False, message={"role": "assistant", "content": "a"})
+        for _ in range(count)
+    ] + [ChatResponse(model="m", done=True, done_reason="stop", prompt_eval_count=7,
+                      eval_count=count, message={"role": "assistant", "content": ""})]
+
+
+class TestCaptureMetering:
+    """Test that records are captured inline, without threads."""
+
+    def test_records_are_captured_before_the_call_returns(self, revenium_metering, monkeypatch):
+        """Test that a metered call's record is collected synchronously."""
+        run_async_in_thread = mock.Mock()
+        monkeypatch.setattr(middleware, "run_async_in_thread", run_async_in_thread)
+        threads = threading.active_count()
+
+        response = middleware._metered_call(mock.Mock(return_value=_response()), ("m", []), {}, "chat")
+
+        (record,) = revenium_metering.records
+        assert record["transaction_id"] == response._revenium_transaction_id
+        assert (record["input_token_count"], record["output_token_count"]) == (3, 2)
+        assert revenium_metering.find(response._revenium_transaction_id) is record
+        assert not run_async_in_thread.called
+        assert threading.active_count() == threads
+
+    def test_stream_is_captured_when_consumed(self, revenium_metering):
+        """Test that a stream's record is collected once it completes."""
+        stream = middleware._metered_call(
+            mock.Mock(return_value=(chunk for chunk in _chunks(4))), ("m", []), {"stream": True}, "chat"
+        )
+        assert revenium_metering.records == []
+        list(stream)
+        (record,) = revenium_metering.records
+        assert (record["is_streamed"], record["output_token_count"]) == (True, 4)
+
+    def test_many_calls_in_order(self, revenium_metering):
+        """Test that a high volume of calls is captured in call order."""
+        for index in range(1000):
+            middleware._metered_call(
+                mock.Mock(return_value=_response(eval_count=index)), ("m", []), {}, "chat"
+            )
+        assert [record["output_token_count"] for record in revenium_metering.records] == list(range(1000))
+
+    def test_concurrent_calls_are_all_counted(self, revenium_metering):
+        """Test that calls captured from many threads are counted exactly."""
+        def call():
+            for _ in range(200):
+                middleware._metered_call(mock.Mock(return_value=_response()), ("m", []), {}, "chat")
+
+        threads = [threading.Thread(target=call) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = get_metering_exporter().stats()
+        (sink_queue,) = get_metering_exporter()._sink_queues
+        assert len(revenium_metering.records) == 1600
+        assert stats["enqueued"] == stats["exported"] == sink_queue.offered == sink_queue.handled == 1600
+        assert stats["dropped"] == 0
+
+    def test_active_exporter_is_restored(self):
+        """Test that the exporter in place before the capture comes back."""
+        exporter = enable_metering_exporter(send=mock.Mock(), report_interval_s=None)
+        try:
+            with capture_metering() as collector:
+                assert get_metering_exporter() is not exporter
+            assert get_metering_exporter() is exporter
+            assert collector.records == []
+        finally:
+            disable_metering_exporter()
@@ -0,0 +1,144 @@
+"""
+Tests for pre-flight prompt token estimation.
+"""
+
+import timeit
+from unittest import mock
+
+from ollama import ChatResponse, Message
+
+from revenium_middleware_ollama import middleware
+from revenium_middleware_ollama.context import current_request
+from revenium_middleware_ollama.token_estimator import (
+    PromptTokenEstimator,
+    disable_token_estimation,
+    enable_token_estimation
+)
+
+MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant. " * 20},
+    Message(role="user", content="What is the capital of France?"),
+]
+
+
+class TestMeasure:
+    """Test prompt measurement."""
+
+    def test_chat(self):
+        """Test that chat messages are measured from dicts and Message objects."""
+        estimator = PromptTokenEstimator()
+        size, parts = estimator.measure("chat", ("m", MESSAGES), {})
+        assert size == len(MESSAGES[0]["content"]) + len(MESSAGES[1].content)
+        assert parts == 2
+
+    def test_generate_and_embed(self):
+        """Test that generate prompts and embed inputs are measured."""
+        estimator = PromptTokenEstimator()
+        assert estimator.measure("generate", (), {"model": "m", "prompt": "abcd", "system": "ef"}) == (6, 1)
+        assert estimator.measure("embed", ("m", ["ab", "cd"]), {}) == (4, 2)
+        assert estimator.measure("embed", (), {"model": "m", "input": "abc"}) == (3, 1)
+
+    def test_non_ascii_text_is_measured_in_bytes(self):
+        """Test that dense scripts are measured in UTF-8 bytes, with long texts cached."""
+        estimator = PromptTokenEstimator()
+        assert estimator.text_size("日本") == 6
+        long_text = "日本語" * 200
+        assert estimator.text_size(long_text) == 1800
+        assert estimator.text_size(long_text) == 1800
+        assert estimator._cached_size.cache_info().hits == 1
+
+    def test_measure_is_fast(self):
+        """Test that measuring a typical chat prompt takes microseconds."""
+        estimator = PromptTokenEstimator()
+        args = ("m", MESSAGES)
+        seconds = min(timeit.repeat(lambda: estimator.measure("chat", args, {}), number=1000, repeat=3))
+        assert seconds / 1000 < 50e-6
+
+
+class TestCalibration:
+    """Test online calibration of the per-model ratio."""
+
+    def test_calibrates_towards_reported_counts(self):
+        """Test that estimates converge on the counts Ollama reports."""
+        estimator = PromptTokenEstimator(message_overhead_tokens=0, alpha=0.5)
+        assert estimator.estimate("m", 400, 1) == 100
+        for _ in range(20):
+            estimator.calibrate("m", 400, 1, 200)
+        assert estimator.estimate("m", 400, 1) == 200
+        assert estimator.estimate("other", 400, 1) == 100
+
+    def test_outliers_are_ignored(self):
+        """Test that implausible samples don't move the ratio."""
+        estimator = PromptTokenEstimator(message_overhead_tokens=0)
+        estimator.calibrate("m", 400, 1, 1)
+        estimator.calibrate("m", 400, 1, 0)
+        assert estimator.bytes_per_token("m") == 4.0
+
+
+class TestRequestContext:
+    """Test the estimate on the request context."""
+
+    def test_estimate_and_error(self, metering_client):
+        """Test that the estimate is visible during the call and its error afterwards."""
+        seen = []
+
+        def wrapped(*args, **kwargs):
+            seen.append(current_request().estimated_prompt_tokens)
+            return ChatResponse(model="m", done=True, prompt_eval_count=90, eval_count=1,
+                                message={"role": "assistant", "content": "Paris"})
+
+        enable_token_estimation()
+        try:
+            response = middleware._metered_call(wrapped, ("m", MESSAGES), {}, "chat")
+        finally:
+            disable_token_estimation()
+
+        context = response._revenium_request_context
+        assert seen == [context.estimated_prompt_tokens]
+        assert context.prompt_tokens == 90
+        assert context.estimate_error == 90 - context.estimated_prompt_tokens
+        assert current_request() is None
+
+
+class TestFallbackAccounting:
+    """Test token accounting when Ollama omits counts."""
+
+    def test_exact_counts_are_flagged(self, create_completion):
+        """Test that reported counts are metered as exact."""
+        wrapped = mock.Mock(return_value=ChatResponse(
+            model="m", done=True, prompt_eval_count=12, eval_count=3,
+            message={"role": "assistant", "content": "Paris"}
+        ))
+        middleware._metered_call(wrapped, ("m", MESSAGES), {}, "chat")
+        record = create_completion.call_args.kwargs
+        assert (record["input_token_count"], record["output_token_count"]) == (12, 3)
+        assert record["extra_body"]["token_count_source"] == "exact"
+
+    def test_missing_counts_are_estimated(self, create_completion):
+        """Test that missing counts are estimated from the prompt and response text."""
+        wrapped = mock.Mock(return_value=ChatResponse(
+            model="m", done=True, message={"role": "assistant", "content": "x" * 40}
+        ))
+        response = middleware._metered_call(wrapped, ("m", MESSAGES), {}, "chat")
+        record = create_completion.call_args.kwargs
+        size = len(MESSAGES[0]["content"]) + len(MESSAGES[1].content)
+        assert record["input_token_count"] == round(size / 4) + 2 * 4
+        assert record["output_token_count"] == 10
+        assert record["extra_body"]["token_count_source"] == "estimated"
+        assert response._revenium_request_context.tokens_estimated
+        assert response._revenium_request_context.prompt_tokens is None
+
+    def test_streamed_chunks_are_counted(self, create_completion):
+        """Test that a stream without eval_count is metered one token per chunk."""
+        chunks = [
+            ChatResponse(model="m", done=False, message={"role": "assistant", "content": "a"})
+            for _ in range(5)
+        ] + [ChatResponse(model="m", done=True, prompt_eval_count=7,
+                          message={"role": "assistant", "content": ""})]
+        stream = middleware._metered_call(
+            mock.Mock(return_value=(chunk for chunk in chunks)), ("m", MESSAGES), {"stream": True}, "chat"
+        )
+        assert len(list(stream)) == 6
+        record = create_completion.call_args.kwargs
+        assert (record["input_token_count"], record["output_token_count"]) == (7, 5)
+        assert record["extra_body"]["token_count_source"] == "estimated"
@@ -15,7 +15,8 @@ from revenium_middleware_ollama.trace_fields import (
     get_retry_number,
     validate_trace_type,
     validate_trace_name,
-    detect_operation_type
+    detect_operation_type,
+    cached_env
 )
 
 
@@ -123,6 +124,17 @@ class TestTraceFieldCapture:
         assert get_parent_transaction_id() is None
         assert get_transaction_name() is None
 
+    def test_cached_env(self, monkeypatch):
+        """Test that variables are read once within a cached_env block."""
+        monkeypatch.setenv("REVENIUM_REGION", "eu-west-1")
+        monkeypatch.delenv("REVENIUM_RETRY_NUMBER", raising=False)
+        with cached_env():
+            assert get_region() == "eu-west-1"
+            monkeypatch.setenv("REVENIUM_REGION", "us-east-1")
+            assert get_region() == "eu-west-1"
+            assert get_retry_number() == 0
+        assert get_region() == "us-east-1"
+
 
 class TestTraceValidation:
     """Test validation logic for trace fields."""